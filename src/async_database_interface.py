@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module offers the functionality of the database interface to programs
+using asyncio, without blocking the event loop while the database is used.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import database_interface as dbi
+
+__author__ = "Marco Zeller"
+__version__ = "0.0.1"
+__license__ = "MIT"
+
+# methods of Database which are not offered by AsyncDatabase, since the pool
+# takes care of opening, initializing and closing the connections, and the
+# chunks of iter_explode_pack are read from a single query, which cannot be
+# continued by another call (use explode_pack instead), the instrumentation
+# and the subscribers to the changes belong to a single connection of the pool
+_excluded_methods = {'initialize', 'transaction', 'close',
+                     'iter_explode_pack', 'enable_instrumentation',
+                     'disable_instrumentation', 'subscribe', 'unsubscribe'}
+
+
+class AsyncDatabase:
+    def __init__(self, db_name, readers=4, read_cache_size=128):
+        """
+        Offers every public method of database_interface.Database as a
+        coroutine with the same arguments, e.g.
+        'items = await db.get_all_items()'.
+        The methods iter_items, iter_packs, iter_items_not_in_pack, and
+        iter_packs_not_in_pack are asynchronous generators used with
+        'async for'.
+        The work is done by a database_interface.DatabasePool for the
+        database in the file db_name with the number readers of connections
+        for reading, in as many threads (the read lane). Several reading
+        coroutines can run at the same time, e.g. with asyncio.gather,
+        more of them wait for a free thread.
+        The methods changing the database run one after the other in a
+        separate thread (the write lane), so they never wait for reading.
+        """
+        self.pool = dbi.DatabasePool(db_name,
+                                     readers=readers,
+                                     read_cache_size=read_cache_size)
+        self._read_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=readers,
+                thread_name_prefix='packlist-read')
+        self._write_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='packlist-write')
+
+    async def run_read(self, function, *arguments):
+        """
+        Calls function with a database_interface.Database for reading as the
+        first argument followed by arguments in the read lane and returns
+        its result.
+        All the reads of function see the same state of the database.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor,
+                                          self._call_read,
+                                          function,
+                                          arguments)
+
+    async def run_write(self, function, *arguments):
+        """
+        Calls function with the database_interface.Database for writing as
+        the first argument followed by arguments in the write lane and
+        returns its result.
+        All the changes of function are made in a single transaction, which
+        is rolled back if function raises an exception, so e.g. many edits
+        can be applied together or not at all.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor,
+                                          self._call_write,
+                                          function,
+                                          arguments)
+
+    def _call_read(self, function, arguments):
+        with self.pool.read() as db:
+            return function(db, *arguments)
+
+    def _call_write(self, function, arguments):
+        with self.pool.write() as db:
+            return function(db, *arguments)
+
+    def close(self):
+        """
+        Waits for the running and waiting work to be done and closes the
+        connections to the database.
+        """
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+        self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception, traceback):
+        # closing waits for the threads, which must not block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+def _coroutine_method(name, method):
+    """
+    Returns a coroutine function calling the method of Database with the
+    given name in the read or the write lane of AsyncDatabase.
+    """
+    if getattr(method, 'changes_database', False):
+        run = AsyncDatabase.run_write
+    else:
+        run = AsyncDatabase.run_read
+
+    @functools.wraps(method)
+    async def coroutine_method(self, *arguments, **keyword_arguments):
+        def call(db):
+            return getattr(db, name)(*arguments, **keyword_arguments)
+        return await run(self, call)
+
+    return coroutine_method
+
+
+def _generator_method(name, method):
+    """
+    Returns an asynchronous generator function yielding the rows of the
+    iterating method of Database with the given name.
+    Every page of rows is read with a separate call in the read lane.
+    """
+    @functools.wraps(method)
+    async def generator_method(self, *arguments, page_size=500, after_id=None,
+                               order_by='id'):
+        while True:
+            def read_page(db):
+                rows = getattr(db, name)(*arguments,
+                                         page_size=page_size,
+                                         after_id=after_id,
+                                         order_by=order_by)
+                return list(itertools.islice(rows, page_size))
+            page = await self.run_read(read_page)
+
+            for row in page:
+                yield row
+
+            if len(page) < page_size:
+                break
+            after_id = page[-1]['id']
+
+    return generator_method
+
+
+for _name, _method in vars(dbi.Database).items():
+    if _name.startswith('_') or _name in _excluded_methods:
+        continue
+    if _name.startswith('iter_'):
+        setattr(AsyncDatabase, _name, _generator_method(_name, _method))
+    else:
+        setattr(AsyncDatabase, _name, _coroutine_method(_name, _method))
+
+
+if __name__ == "__main__":
+    """
+    Run: 'py.test -s' to run all the existing tests.
+    """
+    pass
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the database interface module, measuring how the methods of
+Database scale with the size and the shape of the catalog.
+Run: 'python benchmark_database_interface.py --help' for the options.
+The results are written to a JSON file, which can be compared with the
+results of another version using the option --compare.
+"""
+import database_interface as dbi
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+
+__author__ = "Marco Zeller"
+__version__ = "0.0.1"
+__license__ = "MIT"
+
+
+def store_items(db, n_rows):
+    """
+    Stores n_rows items with distinct names and values into the database.
+    """
+    db.import_items({'name':     'Name' + str(i),
+                     'function': 'Function' + str(i),
+                     'weight':   str(i % 1000) + '.125',
+                     'volume':   str(i % 100) + '.5',
+                     'price':    str(i % 500) + '.95',
+                     'amount':   i % 10}
+                    for i in range(n_rows))
+
+
+def read_items_as_dicts(db):
+    """
+    Reads all items into a list of dictionaries, converting all the values
+    with a unit eagerly, the way the read methods worked before
+    Item was introduced.
+    """
+    with db.conn:
+        db.cursor.execute("""SELECT * FROM items""")
+        items_raw = db.cursor.fetchall()
+
+    items = len(items_raw)*[None]
+    for index, item_tuple in enumerate(items_raw):
+        items[index] = {'id':       item_tuple[0],
+                        'name':     item_tuple[1],
+                        'function': item_tuple[2],
+                        'weight':   dbi.from_fixed_point(item_tuple[3], 'weight'),
+                        'volume':   dbi.from_fixed_point(item_tuple[4], 'volume'),
+                        'price':    dbi.from_fixed_point(item_tuple[5], 'price'),
+                        'amount':   item_tuple[6]}
+    return items
+
+
+def read_items_as_rows(db):
+    """
+    Reads all items into a list of Item objects using get_all_items.
+    """
+    return db.get_all_items()
+
+
+def display_values(items):
+    """
+    Accesses the values the list screens display for every item.
+    """
+    for item in items:
+        item['name'] + ' (id = ' + str(item['id']) + ')'
+
+
+def all_values(items):
+    """
+    Accesses every value of every item.
+    """
+    for item in items:
+        for key in dbi.Item.attribute_names:
+            item[key]
+
+
+def measure(function, *arguments, repetitions=3):
+    """
+    Returns the best time in seconds of repetitions calls to function with
+    the given arguments and the result of the last call.
+    """
+    best = None
+    for repetition in range(repetitions):
+        start = time.perf_counter()
+        result = function(*arguments)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def measure_memory(function, *arguments):
+    """
+    Returns the memory in bytes allocated by the result of a call to function
+    with the given arguments and the peak of memory allocated during the call.
+    """
+    tracemalloc.start()
+    result = function(*arguments)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size, peak
+
+
+def benchmark_row_types(n_rows):
+    """
+    Compares reading n_rows items as dictionaries with reading them as
+    Item objects.
+    The read cache is disabled, so every call reads from the database.
+    Returns a list of dictionaries with the results for both.
+    """
+    db = dbi.Database(':memory:', read_cache_size=0)
+    store_items(db, n_rows)
+
+    results = []
+    for name, read in [('dict', read_items_as_dicts),
+                       ('Item', read_items_as_rows)]:
+        read_time, items = measure(read, db)
+        display_time, ignored = measure(display_values, items)
+        all_time, ignored = measure(all_values, items)
+        del items
+        size, peak = measure_memory(read, db)
+        results.append({'rows':         n_rows,
+                        'row_type':     name,
+                        'read_s':       read_time,
+                        'display_s':    display_time,
+                        'all_values_s': all_time,
+                        'size_bytes':   size,
+                        'peak_bytes':   peak})
+    return results
+
+
+def benchmark_pool_reads(n_rows, n_threads, reads_per_thread=20):
+    """
+    Measures reading n_rows items reads_per_thread times in each of
+    n_threads threads at the same time, using a DatabasePool with a reader
+    for every thread and the read cache disabled.
+    Returns a dictionary with the results.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        pool = dbi.DatabasePool(os.path.join(directory, 'benchmark.db'),
+                                readers=n_threads,
+                                read_cache_size=0)
+        with pool.write() as db:
+            store_items(db, n_rows)
+
+        def read():
+            for i in range(reads_per_thread):
+                with pool.read() as db:
+                    db.cursor.execute("""SELECT SUM(weight) FROM items
+                                         WHERE name LIKE '%7%'""")
+                    db.cursor.fetchall()
+
+        threads = [threading.Thread(target=read) for i in range(n_threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        pool.close()
+
+    return {'rows':          n_rows,
+            'threads':       n_threads,
+            'reads':         n_threads * reads_per_thread,
+            'elapsed_s':     elapsed,
+            'reads_per_s':   n_threads * reads_per_thread / elapsed}
+
+
+# Shapes of the synthetic catalogs created by generate_catalog:
+# 'wide'    a top pack directly including all the other packs,
+# 'deep'    a chain of packs, each including the previous one,
+# 'diamond' layers of packs, each including several packs of the previous
+#           layer, so the sub-packs are heavily shared.
+catalog_shapes = ['wide', 'deep', 'diamond']
+
+
+def generate_catalog(db, n_items, n_packs, shape, items_per_pack=5):
+    """
+    Stores n_items items and n_packs packs of the shape (one of the
+    catalog_shapes) into the empty database db, every pack including
+    items_per_pack items.
+    Returns a dictionary with the pack including all other packs for the
+    key 'top', a pack included by it for the key 'bottom', and a pack in
+    between for the key 'middle'.
+    """
+    store_items(db, n_items)
+
+    # the packs get the ids 1 to n_packs in the order they are stored
+    layer_width = max(1, n_packs // 10)
+
+    def records():
+        for i in range(n_packs):
+            items = {(i * items_per_pack + j) % n_items + 1: 1 + j % 3
+                     for j in range(items_per_pack)}
+            if shape == 'wide':
+                packs = {} if i < n_packs - 1 else \
+                    {pack_id: 1 for pack_id in range(1, n_packs)}
+            elif shape == 'deep':
+                packs = {i: 1} if i > 0 else {}
+            elif shape == 'diamond':
+                layer, position = divmod(i, layer_width)
+                if layer == 0:
+                    packs = {}
+                elif i == n_packs - 1:
+                    # the top pack includes the whole previous layer
+                    packs = {(layer - 1) * layer_width + k + 1: 1
+                             for k in range(layer_width)}
+                else:
+                    packs = {(layer - 1) * layer_width +
+                             (position + k) % layer_width + 1: 1
+                             for k in range(3)}
+            else:
+                raise ValueError('unknown shape ' + repr(shape))
+            yield {'name':     'Pack' + str(i),
+                   'function': shape,
+                   'items':    items,
+                   'packs':    packs}
+
+    report = db.import_packs(records())
+    assert not report['errors'], report['errors'][:3]
+
+    return {'top':    {'id': n_packs},
+            'middle': {'id': max(1, n_packs // 2)},
+            'bottom': {'id': 1}}
+
+
+def benchmark_catalog(n_items, n_packs, shape, repetitions=3):
+    """
+    Measures the methods of Database on a catalog with n_items items and
+    n_packs packs of the shape (one of the catalog_shapes).
+    The read cache is disabled, so every call reads from the database.
+    Returns a list of dictionaries with the results, one for every method.
+    """
+    db = dbi.Database(':memory:', read_cache_size=0)
+    start = time.perf_counter()
+    packs = generate_catalog(db, n_items, n_packs, shape)
+    generate_time = time.perf_counter() - start
+    top, middle, bottom = packs['top'], packs['middle'], packs['bottom']
+
+    def attributes_recalculated(pack):
+        with db.transaction():
+            db._mark_stale_packs_including_pack(pack)
+        return db.get_attributes_pack(pack)
+
+    def buildable_amounts_recalculated():
+        with db.transaction():
+            db.cursor.execute("""UPDATE pack_totals SET stale = 1""")
+        return db.get_buildable_amounts()
+
+    def update_pack_toggling_item(pack):
+        # change the included items and change them back
+        values = db.get_attributes_pack(pack)
+        included_items = db.get_items_in_pack(pack)
+        included_packs = db.get_packs_in_pack(pack)
+        changed_items = [dict(item) for item in included_items[1:]]
+        db.update_pack(values, changed_items, included_packs)
+        db.update_pack(values, included_items, included_packs)
+
+    benchmarks = [
+        ('get_attributes_pack', db.get_attributes_pack, top),
+        ('get_attributes_pack_recalculated', attributes_recalculated, top),
+        ('get_buildable_amounts_recalculated', buildable_amounts_recalculated),
+        ('get_packs_not_in_pack_top', db.get_packs_not_in_pack, top),
+        ('get_packs_not_in_pack_bottom', db.get_packs_not_in_pack, bottom),
+        ('leads_to_circular_reference_top',
+         db.leads_to_circular_reference, top, bottom),
+        ('leads_to_circular_reference_bottom',
+         db.leads_to_circular_reference, bottom, top),
+        ('update_pack', update_pack_toggling_item, middle),
+        ('get_all_items', db.get_all_items),
+        ('get_all_packs', db.get_all_packs),
+        ('iter_items_first_page', lambda: next(db.iter_items())),
+        ('get_items_not_in_pack', db.get_items_not_in_pack, middle),
+        ('explode_pack', db.explode_pack, top),
+        ('need_to_buy', db.need_to_buy, {top['id']: 2, middle['id']: 3}),
+        ('where_used_item', db.where_used, {'id': 1}, 'item'),
+        ('search_broad', db.search, 'name'),
+        ('search_narrow', db.search, 'name12 function12')]
+
+    results = [{'benchmark': 'generate_catalog',
+                'shape':     shape,
+                'items':     n_items,
+                'packs':     n_packs,
+                'seconds':   generate_time}]
+    for benchmark in benchmarks:
+        name, function, arguments = benchmark[0], benchmark[1], benchmark[2:]
+        seconds, ignored = measure(function, *arguments,
+                                   repetitions=repetitions)
+        results.append({'benchmark': name,
+                        'shape':     shape,
+                        'items':     n_items,
+                        'packs':     n_packs,
+                        'seconds':   seconds})
+    db.close()
+    return results
+
+
+def run_suite(item_sizes, pack_sizes, shapes=catalog_shapes, repetitions=3,
+              progress=None):
+    """
+    Runs benchmark_catalog for every combination of the number of items in
+    item_sizes, the number of packs in pack_sizes, and the shapes.
+    progress is called with every result (e.g. print) if it is given.
+    Returns a dictionary describing the environment, with the list of all
+    the results for the key 'results'.
+    """
+    results = []
+    for n_items, n_packs, shape in itertools.product(item_sizes, pack_sizes,
+                                                     shapes):
+        for result in benchmark_catalog(n_items, n_packs, shape,
+                                        repetitions):
+            results.append(result)
+            if progress is not None:
+                progress(result)
+
+    return {'revision': git_revision(),
+            'date':     datetime.datetime.now().isoformat(timespec='seconds'),
+            'python':   platform.python_version(),
+            'sqlite':   sqlite3.sqlite_version,
+            'machine':  platform.machine(),
+            'results':  results}
+
+
+def git_revision():
+    """
+    Returns the hash of the commit checked out in the directory of this
+    file, or None if it is not in a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    """
+    Returns a tuple identifying the measurement of the result, to find the
+    same measurement in the results of another run.
+    """
+    return (result['benchmark'], result['shape'], result['items'],
+            result['packs'])
+
+
+def compare_results(old_run, new_run):
+    """
+    Returns a list of (key, old seconds, new seconds, ratio) tuples for
+    every measurement in the runs old_run and new_run (as returned by
+    run_suite), sorted by the ratio of the new to the old time, so the
+    largest regressions come last.
+    """
+    old_seconds = {result_key(result): result['seconds']
+                   for result in old_run['results']}
+    compared = []
+    for result in new_run['results']:
+        key = result_key(result)
+        if key in old_seconds and old_seconds[key] > 0:
+            compared.append((key, old_seconds[key], result['seconds'],
+                             result['seconds'] / old_seconds[key]))
+    compared.sort(key=lambda comparison: comparison[3])
+    return compared
+
+
+def format_result(result):
+    return '{benchmark:<36} {shape:<8} {items:>8} items {packs:>6} packs ' \
+           '{milliseconds:10.3f} ms'.format(
+                milliseconds=1000 * result['seconds'], **result)
+
+
+def parse_sizes(text):
+    return [int(float(size)) for size in text.split(',')]
+
+
+if __name__ == "__main__":
+    """
+    Runs the benchmarks, prints the results and writes them to a file.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=parse_sizes, default=[1000, 100000],
+                        help='comma separated numbers of items '
+                             '(default: 1000,100000, e.g. 1e5,1e6)')
+    parser.add_argument('--packs', type=parse_sizes, default=[100, 1000],
+                        help='comma separated numbers of packs '
+                             '(default: 100,1000)')
+    parser.add_argument('--shapes', type=lambda text: text.split(','),
+                        default=catalog_shapes,
+                        help='comma separated shapes of the catalogs '
+                             '(default: ' + ','.join(catalog_shapes) + ')')
+    parser.add_argument('--repetitions', type=int, default=3,
+                        help='the best of this many calls is reported')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='file to write the results to')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--rows', action='store_true',
+                        help='also compare the row types and the reads of '
+                             'the pool with the largest number of items')
+    arguments = parser.parse_args()
+
+    run = run_suite(arguments.items, arguments.packs, arguments.shapes,
+                    arguments.repetitions,
+                    progress=lambda result: print(format_result(result)))
+
+    if arguments.rows:
+        n_rows = max(arguments.items)
+        run['row_types'] = benchmark_row_types(n_rows)
+        run['pool_reads'] = [benchmark_pool_reads(n_rows, n_threads)
+                             for n_threads in [1, 2, 4]]
+        for result in run['row_types']:
+            print('{row_type:>5}: read {read_s:.3f} s, '
+                  'display {display_s:.3f} s, '
+                  'all values {all_values_s:.3f} s, '
+                  '{size_bytes:,} bytes (peak {peak_bytes:,} bytes) '
+                  'for {rows} rows'.format(**result))
+        for result in run['pool_reads']:
+            print('{threads:>2} threads: {reads_per_s:.1f} reads/s '
+                  'for {rows} rows'.format(**result))
+
+    with open(arguments.output, 'w') as output:
+        json.dump(run, output, indent=1)
+    print('results written to ' + arguments.output)
+
+    if arguments.compare:
+        with open(arguments.compare) as old_output:
+            old_run = json.load(old_output)
+        for key, old, new, ratio in compare_results(old_run, run):
+            print('{:<36} {:<8} {:>8} items {:>6} packs'.format(*key) +
+                  ' {:10.3f} ms -> {:10.3f} ms ({:.2f}x)'.format(
+                      1000 * old, 1000 * new, ratio))
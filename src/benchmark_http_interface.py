@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator for the HTTP service of the http_interface module, measuring
+the requests per second and the latencies.
+Run: 'python benchmark_http_interface.py [number of clients] [host:port]'
+Without host:port a service for a temporary database with some packs is
+started in the same process.
+"""
+import http.client
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import http_interface
+
+__author__ = "Marco Zeller"
+__version__ = "0.0.1"
+__license__ = "MIT"
+
+
+def store_packs(host, port, n_items=200, n_packs=50):
+    """
+    Stores n_items items and n_packs packs, each including some of the items
+    and the previous pack, using the service at host and port.
+    """
+    connection = http.client.HTTPConnection(host, port)
+    edits = [{'method': 'store_new_item',
+              'arguments': [{'name': 'Name' + str(i),
+                             'function': 'Function' + str(i),
+                             'weight': str(i % 10) + '.25',
+                             'volume': '1',
+                             'price': '2.5',
+                             'amount': 1}]}
+             for i in range(n_items)]
+    for i in range(n_packs):
+        items = [{'id': i * 3 % n_items + j + 1, 'selected': 1}
+                 for j in range(3)]
+        packs = [{'id': i, 'selected': 1}] if i > 0 else []
+        edits.append({'method': 'store_new_pack',
+                      'arguments': [{'name': 'Pack' + str(i),
+                                     'function': 'Function' + str(i)},
+                                    items, packs]})
+    request(connection, 'POST', '/batch/edits', {'edits': edits})
+    connection.close()
+
+
+def request(connection, method, path, body=None):
+    """
+    Sends a request over the connection and returns the status and the
+    decoded JSON of the response.
+    """
+    encoded = None if body is None else json.dumps(body)
+    connection.request(method, path, body=encoded,
+                       headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def run_client(host, port, n_requests, n_packs, latencies):
+    """
+    Sends n_requests requests over a single connection which is kept open,
+    alternating the attributes of one pack and the totals of ten packs,
+    and appends the latency of every request in seconds to latencies.
+    """
+    connection = http.client.HTTPConnection(host, port)
+    for i in range(n_requests):
+        start = time.perf_counter()
+        if i % 2:
+            status, ignored = request(connection, 'GET',
+                                      '/packs/' + str(i % n_packs + 1))
+        else:
+            status, ignored = request(connection, 'POST', '/batch/totals',
+                                      {'packs': [(i + j) % n_packs + 1
+                                                 for j in range(10)]})
+        latencies.append(time.perf_counter() - start)
+        assert status == 200
+    connection.close()
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values
+    lies.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def benchmark_service(host, port, n_clients, n_requests=200, n_packs=50):
+    """
+    Runs n_clients clients at the same time, each sending n_requests requests
+    to the service at host and port.
+    Returns a dictionary with the results.
+    """
+    latencies = []
+    clients = [threading.Thread(target=run_client,
+                                args=(host, port, n_requests, n_packs,
+                                      latencies))
+               for i in range(n_clients)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    return {'clients':          n_clients,
+            'requests':         len(latencies),
+            'requests_per_s':   len(latencies) / elapsed,
+            'p50_ms':           1000 * percentile(latencies, 0.5),
+            'p99_ms':           1000 * percentile(latencies, 0.99)}
+
+
+if __name__ == "__main__":
+    """
+    Runs the benchmark and prints the results.
+    """
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    if len(sys.argv) > 2:
+        host, port = sys.argv[2].rsplit(':', 1)
+        result = benchmark_service(host, int(port), n_clients)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            server = http_interface.Server(
+                    os.path.join(directory, 'benchmark.db'),
+                    ('127.0.0.1', 0))
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            host, port = server.server_address
+            store_packs(host, port)
+            result = benchmark_service(host, port, n_clients)
+            server.shutdown()
+            thread.join()
+            server.server_close()
+    print('{clients} clients: {requests_per_s:.0f} requests/s, '
+          'p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms '
+          'for {requests} requests'.format(**result))
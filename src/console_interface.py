@@ -8,7 +8,11 @@ and the utility module for more complex operations.
 """
 import npyscreen as nps
 import database_interface as dbi
+import collections
+import concurrent.futures
 import decimal
+import itertools
+import os
 
 __author__ = "Marco Zeller"
 __version__ = "0.0.10"
@@ -16,6 +20,24 @@ __license__ = "MIT"
 
 db_name = 'databases/manual_testing.db'
 
+# the statistics of the database are recorded (see
+# database_interface.Instrumentation) if this environment variable is set,
+# they are shown on a hidden screen opened with Ctrl+T from the main menu
+instrumentation_variable = 'PACKLIST_INSTRUMENTATION'
+instrumentation_top = 10
+
+# the lists of items and packs only hold window_pages pages of page_size rows
+# read from the database, enough to fill the screen while scrolling
+page_size = 100
+window_pages = 3
+
+# number of rows shown for the text typed into the search fields
+search_limit = 100
+
+# the data of the packs last highlighted in the list of packs is loaded in the
+# background (see Prefetcher), up to prefetch_size of them are kept
+prefetch_size = 8
+
 default_values_new_item = {'name':     "Give a Name",
                            'function': "Describe Function",
                            'weight':   "0",
@@ -36,6 +58,10 @@ language_english = {'name':         "Name: ",
                     'volume':       "Volume [" + unit_for['volume'] + "]: ",
                     'price':        "Price [" + unit_for['price'] + "]: ",
                     'amount':       "Amount: ",
+                    'buildable':    "buildable: ",
+                    'used':         "used: ",
+                    'where_used':   "Where Used",
+                    'used_by':      "Packs including ",
                     'main_menu':    "Main Menu",
                     'add_new_item': "Add a new Item",
                     'list_items':   "List Items",
@@ -44,11 +70,117 @@ language_english = {'name':         "Name: ",
                     'list_packs':   "List Packs",
                     'edit_pack':    "Edit Pack",
                     'select_items': "Select Items:",
-                    'select_packs': "Select Packs:"}
+                    'select_packs': "Select Packs:",
+                    'search':       "Search: ",
+                    'instrumentation': "Instrumentation",
+                    'instrumentation_disabled':
+                        "Set " + instrumentation_variable + " to record the "
+                        "calls of the database.",
+                    'hottest_methods': "Methods (calls, total ms, max ms, "
+                                       "statements):",
+                    'hottest_queries': "Statements (executions):",
+                    'loading':      "..."}
 
 language = language_english
 
 
+def load_pack_data(db, pack):
+    """
+    Reads everything EditPack shows for the pack from the Database db:
+    its attributes, the included items and packs, and the first page of the
+    items and packs which are not included.
+    """
+    return {'attributes': db.get_attributes_pack(pack),
+            'items_in_pack': db.get_items_in_pack(pack),
+            'packs_in_pack': db.get_packs_in_pack(pack),
+            'items_not_in_pack': list(itertools.islice(
+                db.iter_items_not_in_pack(pack, page_size=page_size),
+                page_size)),
+            'packs_not_in_pack': list(itertools.islice(
+                db.iter_packs_not_in_pack(pack, page_size=page_size),
+                page_size))}
+
+
+class Prefetcher:
+    def __init__(self, db, db_name):
+        """
+        Loads the data of packs (see load_pack_data) in a thread with its own
+        connection for reading to the database in the file db_name, so it is
+        ready when the pack is opened.
+        The data is kept until the Database db publishes a change affecting
+        it (see database_changed).
+        For a database in memory, which cannot be shared by connections,
+        nothing is loaded in the background.
+        """
+        self.db = db
+        self._loads = collections.OrderedDict()
+        self.db.subscribe(self.database_changed)
+        if db_name == ':memory:':
+            self._reader = None
+            self._executor = None
+        else:
+            self._reader = dbi.Database(db_name,
+                                        profile='read-only-browse',
+                                        check_same_thread=False)
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1,
+                    thread_name_prefix='packlist-prefetch')
+
+    def prefetch(self, pack):
+        """
+        Starts loading the data of pack in the background unless it is
+        loaded already. The loads which have not started yet are dropped,
+        only the pack last asked for is of interest.
+        """
+        if self._executor is not None:
+            self.load(pack)
+
+    def load(self, pack):
+        """
+        Returns a concurrent.futures.Future of the data of pack (see
+        load_pack_data). Without a thread for loading it is read right away.
+        """
+        future = self._loads.get(pack['id'])
+        if future is not None and not future.cancelled():
+            self._loads.move_to_end(pack['id'])
+            return future
+
+        for waiting in self._loads.values():
+            waiting.cancel()
+        if self._executor is None:
+            future = concurrent.futures.Future()
+            future.set_result(load_pack_data(self.db, pack))
+        else:
+            future = self._executor.submit(load_pack_data, self._reader, pack)
+
+        self._loads[pack['id']] = future
+        while len(self._loads) > prefetch_size:
+            self._loads.popitem(last=False)
+        return future
+
+    def database_changed(self, changes):
+        # changed totals only affect the data of their own pack, any other
+        # change (e.g. a renamed item) may show up in the data of every pack
+        if all(change.table == 'packs' and change.kind == 'totals' and
+               change.id is not None for change in changes):
+            for change in changes:
+                self._loads.pop(change.id, None)
+            return
+        for waiting in self._loads.values():
+            waiting.cancel()
+        self._loads.clear()
+
+    def close(self):
+        """
+        Drops the loads which have not started yet, waits for the running
+        one and closes the connection.
+        """
+        self.db.unsubscribe(self.database_changed)
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._reader.close()
+
+
 class MainMenu(nps.ActionFormMinimal):
     def go_to_add_item_screen(self):
         self.parentApp.switchForm('ADD_ITEM')
@@ -62,7 +194,12 @@ class MainMenu(nps.ActionFormMinimal):
     def go_to_list_packs_screen(self):
         self.parentApp.switchForm('LIST_PACKS')
 
+    def go_to_instrumentation_screen(self, keypress):
+        self.parentApp.switchForm('INSTRUMENTATION')
+
     def create(self):
+        # hidden screen, not listed in the menu
+        self.add_handlers({'^T': self.go_to_instrumentation_screen})
         self.add(nps.ButtonPress,
                  name=language['add_new_item'],
                  when_pressed_function=self.go_to_add_item_screen)
@@ -145,7 +282,225 @@ class AddItem(nps.ActionFormV2):
         self.parentApp.setNextForm('MAIN')
 
 
-class ItemList(nps.MultiLineAction):
+class WindowedList:
+    """
+    Mixin for the list widgets of npyscreen showing the rows of the database,
+    which only holds a window of a few pages of rows (see page_size and
+    window_pages) as its values instead of all the rows.
+    The next or previous page is read when the cursor moves past the end of
+    the window and the page furthest away from the cursor is dropped, so
+    opening and scrolling the list costs the same for any number of rows.
+    The pages are read with the iterating methods of the database (e.g.
+    iter_items), which continue after the id of the last row of the
+    previous page; only these ids are kept for the pages not in the window.
+    """
+    # True if the rows shown changed in the database since they were read
+    # (see note_changes)
+    stale = True
+
+    def show_rows(self, read_page, head=None):
+        """
+        Shows the rows returned by read_page starting with the first row.
+        read_page is called with the id of the row to continue after (or
+        None for the first page) and the number of rows to read, e.g.
+        'lambda after_id, size: db.iter_items(page_size=size,
+        after_id=after_id)'.
+        The rows in the list head (e.g. the items included in a pack) are
+        shown before the rows returned by read_page.
+        If read_page is None only the rows in head are shown (e.g. the
+        results of a search).
+        """
+        self._read_page = read_page
+        # for every page read so far the id to continue after or the list
+        # of rows for the head
+        if read_page is None:
+            self._page_starts = [head or []]
+            self._last_page = 0
+        else:
+            self._page_starts = [None] if head is None else [head, None]
+            self._last_page = None
+        self.stale = False
+        self._show_first_pages()
+
+    def _show_first_pages(self):
+        self._first_page = 0
+        self._pages = []
+        self.cursor_line = 0
+        self.start_display_at = 0
+        self._set_window()
+        self._fill_window()
+
+    def _fill_window(self, n_pages=1):
+        """
+        Reads pages after the window until it has n_pages pages and at least
+        page_size rows.
+        """
+        while (len(self._pages) < n_pages or len(self.values) < page_size) \
+                and self._append_page():
+            pass
+
+    def reload_rows(self):
+        """
+        Reads the pages of the window again, e.g. after a row was changed or
+        deleted, keeping the position of the cursor.
+        """
+        n_pages = len(self._pages)
+        if self._read_page is None:
+            return
+        self.stale = False
+        del self._page_starts[self._first_page + 1:]
+        self._last_page = None
+        self._pages = []
+        self._set_window()
+        self._fill_window(n_pages)
+        # the rows of the window might all have been deleted
+        while not self.values and self._prepend_page():
+            pass
+
+    def show_first_rows(self):
+        """
+        Moves the cursor to the first row, the first pages are only read
+        again if the window moved away from them.
+        """
+        if self._first_page == 0:
+            self.cursor_line = 0
+            self.start_display_at = 0
+        else:
+            self._show_first_pages()
+
+    def note_changes(self, changes, table):
+        """
+        Marks the list as stale if the rows shown are affected by the
+        changes of the database (see database_interface.Change) of the rows
+        in table: a row in the window was updated or deleted, or a row was
+        stored while the window holds the last page (the rows are ordered by
+        their id). The results of a search are affected by any change, like
+        the rows shown by any change of another connection.
+        """
+        if self.stale:
+            return
+        shown = {row['id'] for row in self.values}
+        shows_last_page = self._last_page is not None and \
+            self._first_page + len(self._pages) > self._last_page
+        for change in changes:
+            if change.table != table or \
+                    change.kind not in ('stored', 'updated', 'deleted',
+                                        'changed'):
+                continue
+            if self._read_page is None or change.id is None or \
+                    change.id in shown or \
+                    (change.kind == 'stored' and shows_last_page):
+                self.stale = True
+                return
+
+    def _read(self, number):
+        """
+        Returns the rows of the page with the given number.
+        """
+        start = self._page_starts[number]
+        if isinstance(start, list):
+            page = start
+        else:
+            page = list(itertools.islice(self._read_page(start, page_size),
+                                         page_size))
+            if len(page) < page_size:
+                self._last_page = number
+        if len(self._page_starts) == number + 1 and \
+                self._last_page != number:
+            self._page_starts.append(page[-1]['id'] if page else start)
+        return page
+
+    def _set_window(self):
+        self.values = [row for page in self._pages for row in page]
+
+    def _append_page(self):
+        """
+        Adds the page after the window, dropping the first page if the
+        window is full.
+        Returns False if there are no more pages.
+        """
+        number = self._first_page + len(self._pages)
+        if self._last_page is not None and number > self._last_page:
+            return False
+        page = self._read(number)
+        if not page and self._pages:
+            return False
+        self._pages.append(page)
+        if len(self._pages) > window_pages:
+            self._move_window(-len(self._pages.pop(0)))
+            self._first_page += 1
+        self._set_window()
+        return True
+
+    def _prepend_page(self):
+        """
+        Adds the page before the window, dropping the last page if the
+        window is full.
+        Returns False if the window starts with the first page.
+        """
+        if self._first_page == 0:
+            return False
+        self._first_page -= 1
+        page = self._read(self._first_page)
+        self._pages.insert(0, page)
+        self._move_window(len(page))
+        if len(self._pages) > window_pages:
+            self._pages.pop()
+        self._set_window()
+        return True
+
+    def _move_window(self, lines):
+        self.cursor_line += lines
+        self.start_display_at = max(0, self.start_display_at + lines)
+
+    def _read_pages_for(self, lines):
+        """
+        Reads the pages needed to move the cursor by the number of lines.
+        """
+        while self.cursor_line + lines >= len(self.values) - 1 and \
+                self._append_page():
+            pass
+        while self.cursor_line + lines < 0 and self._prepend_page():
+            pass
+
+    def h_cursor_line_down(self, ch):
+        self._read_pages_for(1)
+        return super().h_cursor_line_down(ch)
+
+    def h_cursor_line_up(self, ch):
+        self._read_pages_for(-1)
+        return super().h_cursor_line_up(ch)
+
+    def h_cursor_page_down(self, ch):
+        self._read_pages_for(len(self._my_widgets) - 1)
+        return super().h_cursor_page_down(ch)
+
+    def h_cursor_page_up(self, ch):
+        self._read_pages_for(1 - len(self._my_widgets))
+        return super().h_cursor_page_up(ch)
+
+    def h_cursor_beginning(self, ch):
+        if self._first_page > 0:
+            self._show_first_pages()
+        return super().h_cursor_beginning(ch)
+
+    def h_cursor_end(self, ch):
+        while self._append_page():
+            pass
+        return super().h_cursor_end(ch)
+
+
+class SearchText(nps.TitleText):
+    """
+    Field filtering the lists of its screen while the user types, by
+    calling show_search_results of the screen after every change.
+    """
+    def when_value_edited(self):
+        self.parent.show_search_results()
+        self.parent.display()
+
+
+class ItemList(WindowedList, nps.MultiLineAction):
     def display_value(self, vl):
         return vl['name'] + ' (id = ' + str(vl['id']) + ')'
 
@@ -155,6 +510,9 @@ class ItemList(nps.MultiLineAction):
             # delete the item and redraw the screen
             self.parent.parentApp.db.delete_item(act_on_this)
             self.parent.parentApp.switchForm('LIST_ITEMS')
+        elif keypress == ord('u'):
+            # go to the screen listing the packs including the item
+            self.parent.parentApp.switchForm('WHERE_USED')
         else:
             # go to the edit item screen
             self.parent.parentApp.switchForm('EDIT_ITEM')
@@ -162,25 +520,96 @@ class ItemList(nps.MultiLineAction):
 
 class ListItems(nps.ActionFormMinimal):
     def create(self):
-        item_list = self.parentApp.db.get_all_items()
+        self._search = self.add(SearchText, name=language['search'])
         self.item_list_widget = self.add(ItemList,
-                                         values=item_list,
+                                         values=[],
                                          scroll_exit=True,
                                          exit_right=True)
+        self.show_search_results()
 
         # Setup handler for deleting an item from list:
         # If the key 'd' is pressed call the function
         # item_list.actionHighlighted automatically with the right paramters.
         self.handlers[ord('d')] = self.item_list_widget.h_act_on_highlighted
+        # If the key 'u' is pressed show the packs including the item.
+        self.handlers[ord('u')] = self.item_list_widget.h_act_on_highlighted
+        # If the key '/' is pressed go to the search field above the list.
+        self.handlers[ord('/')] = self.item_list_widget.h_exit_up
         # TODO: remove unneeded handlers
 
+        # the list and not the search field has the focus when the screen
+        # is shown (see beforeEditing)
+        self.preserve_selected_widget = True
+
+        self.parentApp.db.subscribe(self.database_changed)
+
+    def database_changed(self, changes):
+        self.item_list_widget.note_changes(changes, 'items')
+
+    def show_search_results(self):
+        """
+        Shows the items matching the text in the search field, or all items
+        if it is empty.
+        """
+        db = self.parentApp.db
+        if self._search.value:
+            self.item_list_widget.show_rows(
+                    None, head=db.search_items(self._search.value,
+                                               limit=search_limit))
+        else:
+            self.item_list_widget.show_rows(
+                    lambda after_id, size: db.iter_items(page_size=size,
+                                                         after_id=after_id))
+
     def beforeEditing(self):
-        self.item_list_widget.values = self.parentApp.db.get_all_items()
+        self.editw = 1
+        # the rows are only read again if they changed, also by another
+        # connection (e.g. the HTTP service)
+        self.parentApp.db.check_other_connections()
+        if not self.item_list_widget.stale:
+            return
+        if self._search.value:
+            self.show_search_results()
+        else:
+            self.item_list_widget.reload_rows()
 
     def on_ok(self):
         self.parentApp.setNextForm('MAIN')
 
 
+class WhereUsedList(nps.MultiLineAction):
+    def display_value(self, vl):
+        return vl['name'] + ' (id = ' + str(vl['id']) + ', ' + \
+            language['used'] + str(vl['selected']) + ')'
+
+    def actionHighlighted(self, act_on_this, keypress):
+        # go to the edit pack screen
+        self.parent.parentApp.selected_pack = act_on_this
+        self.parent.parentApp.switchForm('EDIT_PACK')
+
+
+class WhereUsed(nps.ActionFormMinimal):
+    """
+    Screen listing every pack including the selected item directly or
+    through its sub-packs, with how many times the item is included.
+    """
+    def create(self):
+        self._item = self.add(nps.FixedText, editable=False)
+        self.pack_list_widget = self.add(WhereUsedList,
+                                         values=[],
+                                         scroll_exit=True,
+                                         exit_right=True)
+
+    def beforeEditing(self):
+        item = self.parentApp.selected_item
+        self._item.value = language['used_by'] + item['name'] + ':'
+        self.pack_list_widget.values = \
+            self.parentApp.db.where_used(item, 'item')
+
+    def on_ok(self):
+        self.parentApp.setNextForm('LIST_ITEMS')
+
+
 class EditItem(nps.ActionFormV2):
     """
     Screen containing a formular to edit the attributes of an existing item.
@@ -242,58 +671,79 @@ class EditItem(nps.ActionFormV2):
         self.parentApp.setNextForm('LIST_ITEMS')
 
 
-class SelectItems(nps.MultiSelectAction):
+class SelectRows(WindowedList, nps.MultiSelectAction):
+    """
+    Chooser for the items or packs included in a pack, showing how many
+    times every row is selected.
+    The selected amounts are kept by the row's id in the dictionary
+    selected, which only holds the selected rows, so the rows read for the
+    window are never changed and rows scrolled out of the window keep their
+    amount.
+    """
+    def show_rows(self, read_page, head=None, keep_selection=False):
+        """
+        Shows the rows like WindowedList.show_rows with the rows in head
+        selected as many times as their value for the key 'selected'.
+        With keep_selection the selected amounts are kept instead, e.g. to
+        show the results of a search.
+        """
+        if not keep_selection:
+            self.selected = {row['id']: row['selected'] for row in head or []
+                             if row['selected'] > 0}
+        super().show_rows(read_page, head)
+
     def display_value(self, vl):
-        return str(vl['selected']) + 'x :' + vl['name']
+        return str(self.selected.get(vl['id'], 0)) + 'x :' + vl['name']
 
-    def before_editing(self):
-        self.h_select()
+    def update(self, clear=True):
+        # mark the selected rows of the window
+        self.value = [index for index, row in enumerate(self.values)
+                      if row['id'] in self.selected]
+        super().update(clear=clear)
 
-    def actionHighlighted(self, act_on_this, keypress):
-        if keypress == ord('+'):
-            # increase the selected amount
-            act_on_this['selected'] += 1
-            # set selected if was zero before
-            if act_on_this['selected'] == 1:
-                self.h_select_toggle(keypress)
-
-        elif keypress == ord('-'):
-            # decrease the selected amount only if positive
-            if act_on_this['selected'] > 0:
-                act_on_this['selected'] -= 1
-                # unselect if reches zero
-                if act_on_this['selected'] == 0:
-                    self.h_select_toggle(keypress)
+    def _set_amount(self, row, amount):
+        if amount > 0:
+            self.selected[row['id']] = amount
         else:
-            # TODO: open popup to select amount using slider
-            pass
+            self.selected.pop(row['id'], None)
 
-    def actionSelected(self, act_on_these, keypress):
-        return act_on_these
+    def h_select_toggle(self, input):
+        # an empty chooser (e.g. a search without results) has no row
+        if not self.values:
+            return
+        row = self.values[self.cursor_line]
+        self._set_amount(row, 0 if row['id'] in self.selected else 1)
 
+    def h_select(self, input):
+        if not self.values:
+            return
+        row = self.values[self.cursor_line]
+        self._set_amount(row, max(1, self.selected.get(row['id'], 0)))
 
-class SelectPacks(nps.MultiSelectAction):
-    def display_value(self, vl):
-        return str(vl['selected']) + 'x :' + vl['name']
+    def h_select_none(self, input):
+        self.selected = {}
+
+    def get_selected_objects(self):
+        return [{'id': row_id, 'selected': amount}
+                for row_id, amount in self.selected.items()]
+
+    def h_act_on_highlighted(self, ch):
+        if not self.values:
+            return
+        return super().h_act_on_highlighted(ch)
 
-    def before_editing(self):
-        self.h_select()
+    def h_act_on_selected(self, ch):
+        return self.actionSelected(self.get_selected_objects(), ch)
 
     def actionHighlighted(self, act_on_this, keypress):
+        amount = self.selected.get(act_on_this['id'], 0)
         if keypress == ord('+'):
             # increase the selected amount
-            act_on_this['selected'] += 1
-            # set selected if was zero before
-            if act_on_this['selected'] == 1:
-                self.h_select_toggle(keypress)
+            self._set_amount(act_on_this, amount + 1)
 
         elif keypress == ord('-'):
             # decrease the selected amount only if positive
-            if act_on_this['selected'] > 0:
-                act_on_this['selected'] -= 1
-                # unselect if reches zero
-                if act_on_this['selected'] == 0:
-                    self.h_select_toggle(keypress)
+            self._set_amount(act_on_this, max(0, amount - 1))
         else:
             # TODO: open popup to select amount using slider
             pass
@@ -302,6 +752,14 @@ class SelectPacks(nps.MultiSelectAction):
         return act_on_these
 
 
+class SelectItems(SelectRows):
+    pass
+
+
+class SelectPacks(SelectRows):
+    pass
+
+
 class AddPack(nps.ActionFormV2):
     """
     Screen containing a formular to enter the attributes of a new pack.
@@ -311,6 +769,11 @@ class AddPack(nps.ActionFormV2):
     def reset_fields(self):
         self._name.value = default_values_new_pack['name']
         self._function.value = default_values_new_pack['function']
+        if self._search.value:
+            # all the rows are shown again instead of the search results
+            self.item_chooser.stale = True
+            self.pack_chooser.stale = True
+        self._search.value = ''
 
     def create(self):
         """
@@ -322,15 +785,15 @@ class AddPack(nps.ActionFormV2):
         # draw the fields needed to enter the attributes
         self._name = self.add(nps.TitleText, name=language['name'])
         self._function = self.add(nps.TitleText, name=language['function'])
+        # filters the items and packs to choose from
+        self._search = self.add(SearchText, name=language['search'])
 
         self.add(nps.TitleFixedText,
                  name=language['select_items'])
 
-        item_list = self.parentApp.db.get_all_items()
-        for item in item_list:
-            item['selected'] = 0
+        # the rows are read when the screen is shown
         self.item_chooser = self.add(SelectItems,
-                                     values=item_list,
+                                     values=[],
                                      scroll_exit=True,
                                      exit_right=True,
                                      max_height=10)
@@ -338,11 +801,8 @@ class AddPack(nps.ActionFormV2):
         self.add(nps.TitleFixedText,
                  name=language['select_packs'])
 
-        pack_list = self.parentApp.db.get_all_packs()
-        for pack in pack_list:
-            pack['selected'] = 0
         self.pack_chooser = self.add(SelectPacks,
-                                     values=pack_list,
+                                     values=[],
                                      scroll_exit=True,
                                      exit_right=True,
                                      max_height=10)
@@ -371,16 +831,50 @@ class AddPack(nps.ActionFormV2):
         # fill in the fields with the default values
         self.reset_fields()
 
-    def beforeEditing(self):
-        self.item_chooser.values = self.parentApp.db.get_all_items()
-        for item in self.item_chooser.values:
-            item['selected'] = 0
-        self.item_chooser.h_select_none('r')
+        self.parentApp.db.subscribe(self.database_changed)
+
+    def database_changed(self, changes):
+        self.item_chooser.note_changes(changes, 'items')
+        self.pack_chooser.note_changes(changes, 'packs')
+
+    def show_search_results(self, keep_selection=True):
+        """
+        Shows the items and packs matching the text in the search field in
+        the choosers, or all of them if it is empty.
+        Unless keep_selection is False the selected amounts are kept.
+        """
+        db = self.parentApp.db
+        self._show_chooser_rows(self.item_chooser, db.search_items,
+                                db.iter_items, keep_selection)
+        self._show_chooser_rows(self.pack_chooser, db.search_packs,
+                                db.iter_packs, keep_selection)
+
+    def _show_chooser_rows(self, chooser, search, iterate, keep_selection):
+        if self._search.value:
+            chooser.show_rows(None,
+                              head=search(self._search.value,
+                                          limit=search_limit),
+                              keep_selection=keep_selection)
+        else:
+            chooser.show_rows(
+                    lambda after_id, size: iterate(page_size=size,
+                                                   after_id=after_id),
+                    keep_selection=keep_selection)
 
-        self.pack_chooser.values = self.parentApp.db.get_all_packs()
-        for pack in self.pack_chooser.values:
-            pack['selected'] = 0
-        self.pack_chooser.h_select_none('r')
+    def beforeEditing(self):
+        # the rows of a chooser are only read again if they changed, also by
+        # another connection (e.g. the HTTP service)
+        db = self.parentApp.db
+        db.check_other_connections()
+        for chooser, search, iterate in (
+                (self.item_chooser, db.search_items, db.iter_items),
+                (self.pack_chooser, db.search_packs, db.iter_packs)):
+            if chooser.stale:
+                self._show_chooser_rows(chooser, search, iterate,
+                                        keep_selection=False)
+            else:
+                chooser.h_select_none(None)
+                chooser.show_first_rows()
 
     def on_ok(self):
         """
@@ -415,9 +909,15 @@ class AddPack(nps.ActionFormV2):
         self.parentApp.setNextForm('MAIN')
 
 
-class PackList(nps.MultiLineAction):
+class PackList(WindowedList, nps.MultiLineAction):
+    # how many of every pack can be built, by the pack's id
+    buildable_amounts = {}
+
     def display_value(self, vl):
-        return vl['name'] + ' (id = ' + str(vl['id']) + ')'
+        amount = self.buildable_amounts.get(vl['id'])
+        return vl['name'] + ' (id = ' + str(vl['id']) + ', ' + \
+            language['buildable'] + ('-' if amount is None else str(amount)) + \
+            ')'
 
     def actionHighlighted(self, act_on_this, keypress):
         self.parent.parentApp.selected_pack = act_on_this
@@ -432,20 +932,99 @@ class PackList(nps.MultiLineAction):
 
 class ListPacks(nps.ActionFormMinimal):
     def create(self):
-        pack_list = self.parentApp.db.get_all_packs()
+        self._search = self.add(SearchText, name=language['search'])
         self.pack_list_widget = self.add(PackList,
-                                         values=pack_list,
+                                         values=[],
                                          scroll_exit=True,
                                          exit_right=True)
+        self.show_search_results()
+        self.pack_list_widget.buildable_amounts = \
+            self.parentApp.db.get_buildable_amounts()
+        # ids of the packs whose buildable amount changed, None for all
+        self._changed_totals = set()
 
         # Setup handler for deleting an item from list:
         # If the key 'd' is pressed call the function
         # item_list.actionHighlighted automatically with the right paramters.
         self.handlers[ord('d')] = self.pack_list_widget.h_act_on_highlighted
+        # If the key '/' is pressed go to the search field above the list.
+        self.handlers[ord('/')] = self.pack_list_widget.h_exit_up
         # TODO: remove unneeded handlers
 
+        # the list and not the search field has the focus when the screen
+        # is shown (see beforeEditing)
+        self.preserve_selected_widget = True
+
+        self.parentApp.db.subscribe(self.database_changed)
+
+    def database_changed(self, changes):
+        self.pack_list_widget.note_changes(changes, 'packs')
+        self._changed_totals.update(
+                change.id for change in changes
+                if change.table == 'packs' and change.kind in ('stored',
+                                                               'totals',
+                                                               'changed'))
+        for change in changes:
+            if change.table == 'packs' and change.kind == 'deleted':
+                self._changed_totals.discard(change.id)
+                self.pack_list_widget.buildable_amounts.pop(change.id, None)
+
+    def show_search_results(self):
+        """
+        Shows the packs matching the text in the search field, or all packs
+        if it is empty.
+        """
+        db = self.parentApp.db
+        if self._search.value:
+            self.pack_list_widget.show_rows(
+                    None, head=db.search_packs(self._search.value,
+                                               limit=search_limit))
+        else:
+            self.pack_list_widget.show_rows(
+                    lambda after_id, size: db.iter_packs(page_size=size,
+                                                         after_id=after_id))
+
     def beforeEditing(self):
-        self.pack_list_widget.values = self.parentApp.db.get_all_packs()
+        self.editw = 1
+        # the rows and buildable amounts are only read again if they changed,
+        # also by another connection (e.g. the HTTP service)
+        self.parentApp.db.check_other_connections()
+        if self.pack_list_widget.stale:
+            if self._search.value:
+                self.show_search_results()
+            else:
+                self.pack_list_widget.reload_rows()
+        self.update_buildable_amounts()
+        self.prefetch_highlighted_pack()
+
+    def update_buildable_amounts(self):
+        """
+        Reads the buildable amounts of the packs whose totals changed, all of
+        them at once if there are many.
+        """
+        db = self.parentApp.db
+        changed, self._changed_totals = self._changed_totals, set()
+        if None in changed or len(changed) > page_size:
+            self.pack_list_widget.buildable_amounts = \
+                db.get_buildable_amounts()
+            return
+        for pack_id in changed:
+            self.pack_list_widget.buildable_amounts[pack_id] = \
+                db.get_attributes_pack({'id': pack_id})['amount']
+
+    def adjust_widgets(self):
+        # called after every key pressed
+        self.prefetch_highlighted_pack()
+
+    def prefetch_highlighted_pack(self):
+        """
+        Starts loading the data of the highlighted pack for EditPack in the
+        background.
+        """
+        packs = self.pack_list_widget.values
+        cursor_line = self.pack_list_widget.cursor_line
+        if 0 <= cursor_line < len(packs):
+            self.parentApp.prefetcher.prefetch(packs[cursor_line])
 
     def on_ok(self):
         self.parentApp.setNextForm('MAIN')
@@ -457,19 +1036,27 @@ class EditPack(nps.ActionFormV2):
     It has an 'OK' button which updates the pack's values in the database and
     a 'CANCEL' button to leave the formular without changing the database.
     """
-    def fill_in_fields(self):
+    def fill_in_fields(self, pack_values=None):
         pack = self.parentApp.selected_pack
         self._name.value = pack['name']
         self._function.value = pack['function']
 
-        # get the calculated values for the selected_pack
-        pack_values = self.parentApp.db.get_attributes_pack(pack)
+        # the calculated values for the selected_pack are shown when they
+        # are loaded (see show_loaded_data)
+        if pack_values is None:
+            for field in (self._weight, self._volume, self._price,
+                          self._amount):
+                field.value = language['loading']
+            return
 
         # fill in the fields accordingly
         self._weight.value = str(pack_values['weight'])
         self._volume.value = str(pack_values['volume'])
         self._price.value = str(pack_values['price'])
-        self._amount.value = str(pack_values['amount'])
+        if pack_values['amount'] is None:
+            self._amount.value = '-'
+        else:
+            self._amount.value = str(pack_values['amount'])
 
     def create(self):
         """
@@ -483,11 +1070,13 @@ class EditPack(nps.ActionFormV2):
         self._volume = self.add(nps.TitleFixedText, name=language['volume'])
         self._price = self.add(nps.TitleFixedText, name=language['price'])
         self._amount = self.add(nps.TitleFixedText, name=language['amount'])
+        # filters the items and packs to choose from
+        self._search = self.add(SearchText, name=language['search'])
 
         self.add(nps.TitleFixedText,
                  name=language['select_items'])
         self.item_chooser = self.add(SelectItems,
-                                     values=None,
+                                     values=[],
                                      scroll_exit=True,
                                      exit_right=True,
                                      max_height=10)
@@ -495,7 +1084,7 @@ class EditPack(nps.ActionFormV2):
         self.add(nps.TitleFixedText,
                  name=language['select_packs'])
         self.pack_chooser = self.add(SelectPacks,
-                                     values=None,
+                                     values=[],
                                      scroll_exit=True,
                                      exit_right=True,
                                      max_height=10)
@@ -521,42 +1110,104 @@ class EditPack(nps.ActionFormV2):
         self.pack_chooser.add_handlers(pack_chooser_handlers)
 
     def beforeEditing(self):
-        # fill in the fields with the default values
+        # the screen is shown right away, the data of the pack is loaded in
+        # the background unless it was prefetched from the list of packs or
+        # kept since the pack was last opened (see Prefetcher), unless
+        # another connection changed the database meanwhile
+        self.parentApp.db.check_other_connections()
+        self._pack_data = None
+        self._loading = self.parentApp.prefetcher.load(
+                self.parentApp.selected_pack)
         self.fill_in_fields()
 
-        top_pack = self.parentApp.selected_pack
-
-        included_items = self.parentApp.db.get_items_in_pack(top_pack)
-        not_included_items = self.parentApp.db.get_items_not_in_pack(top_pack)
-        selected_items_indices = []
-
-        for index, item in enumerate(included_items):
-            # double check if really selected
-            # TODO: throw an error in future
-            if item['selected'] > 0:
-                selected_items_indices.append(index)
-
-        self.item_chooser.values = included_items + not_included_items
-        self.item_chooser.value = selected_items_indices
-
-        # TODO: when implemented use functions from database
-        included_packs = self.parentApp.db.get_packs_in_pack(top_pack)
-        not_included_packs = self.parentApp.db.get_packs_not_in_pack(top_pack)
+        self._search.value = ''
+        self.item_chooser.show_rows(None, head=[])
+        self.pack_chooser.show_rows(None, head=[])
+        self.show_loaded_data()
 
-        selected_packs_indices = []
+        # while the data is loaded the screen checks for it every 100 ms
+        self.keypress_timeout = None if self._pack_data else 1
 
-        for index, pack in enumerate(included_packs):
-            # double check if really selected
-            # TODO: throw an error in future
-            if pack['selected'] > 0:
-                selected_packs_indices.append(index)
-
-        self.pack_chooser.values = included_packs + not_included_packs
-        self.pack_chooser.value = selected_packs_indices
+    def show_loaded_data(self, wait=False):
+        """
+        Fills in the values and the choosers once the data of the pack is
+        loaded, with wait = True it waits for it.
+        Returns True if the data is shown.
+        """
+        if self._pack_data is not None:
+            return True
+        if not wait and not self._loading.done():
+            return False
+
+        self._pack_data = self._loading.result()
+        self.keypress_timeout = None
+        self.fill_in_fields(self._pack_data['attributes'])
+        self.show_search_results(keep_selection=False)
+        return True
+
+    def while_waiting(self):
+        # called every keypress_timeout while no key is pressed
+        if self.show_loaded_data():
+            self.display()
+
+    def adjust_widgets(self):
+        # called after every key pressed
+        self.show_loaded_data()
+
+    def while_editing(self, widget=None):
+        # the search field and the choosers can only be used with the data
+        if widget is not None and \
+                widget in (self._search, self.item_chooser, self.pack_chooser):
+            self.show_loaded_data(wait=True)
+
+    def show_search_results(self, keep_selection=True):
+        """
+        Shows the items and packs matching the text in the search field in
+        the choosers, or all of them if it is empty.
+        Unless keep_selection is False the selected amounts are kept.
+        """
+        if self._pack_data is None:
+            # the results are shown with the loaded data
+            self.show_loaded_data(wait=True)
+            return
+        db = self.parentApp.db
+        top_pack = self.parentApp.selected_pack
 
-        # there seems to be a bug in the library this fixes it
-        self.item_chooser.vale = self.item_chooser.value
-        self.pack_chooser.vale = self.pack_chooser.value
+        if self._search.value:
+            self.item_chooser.show_rows(
+                    None,
+                    head=db.search_items(self._search.value,
+                                         limit=search_limit),
+                    keep_selection=keep_selection)
+            # only the packs which can be included are shown
+            packs = [pack for pack in db.search_packs(self._search.value,
+                                                      limit=search_limit)
+                     if not db.leads_to_circular_reference(top_pack, pack)]
+            self.pack_chooser.show_rows(None, head=packs,
+                                        keep_selection=keep_selection)
+            return
+
+        # the included items and packs are shown first, followed by the
+        # ones which are not included read page by page, the first page is
+        # loaded with the other data
+        def read_page(loaded, iter_not_in_pack):
+            def read(after_id, size):
+                if after_id is None and size == page_size:
+                    return loaded
+                return iter_not_in_pack(top_pack, page_size=size,
+                                        after_id=after_id)
+            return read
+
+        self.item_chooser.show_rows(
+                read_page(self._pack_data['items_not_in_pack'],
+                          db.iter_items_not_in_pack),
+                head=self._pack_data['items_in_pack'],
+                keep_selection=keep_selection)
+        self.pack_chooser.show_rows(
+                read_page(self._pack_data['packs_not_in_pack'],
+                          db.iter_packs_not_in_pack),
+                head=self._pack_data['packs_in_pack'],
+                keep_selection=keep_selection)
 
     def on_ok(self):
         """
@@ -569,7 +1220,9 @@ class EditPack(nps.ActionFormV2):
         pack_data['name'] = self._name.value
         pack_data['function'] = self._function.value
 
-        # send the dictionary to the database interface
+        # send the dictionary to the database interface, the selection is
+        # only complete with the loaded data
+        self.show_loaded_data(wait=True)
         included_items = self.item_chooser.h_act_on_selected('a')
         included_packs = self.pack_chooser.h_act_on_selected('a')
         self.parentApp.db.update_pack(pack_data, included_items, included_packs)
@@ -586,11 +1239,45 @@ class EditPack(nps.ActionFormV2):
         self.parentApp.setNextForm('LIST_PACKS')
 
 
+class Instrumentation(nps.ActionFormMinimal):
+    """
+    Screen listing the methods of the database taking the most time and the
+    statements executed most often since the application started.
+    """
+    def create(self):
+        self.report_widget = self.add(nps.Pager, values=[])
+
+    def beforeEditing(self):
+        instrumentation = self.parentApp.db.instrumentation
+        if instrumentation is None:
+            self.report_widget.values = [language['instrumentation_disabled']]
+            return
+
+        report = instrumentation.report(top=instrumentation_top)
+        lines = [language['hottest_methods']]
+        for method in report['methods']:
+            lines.append('  {method}: {calls}, {total_ms:.1f}, {max_ms:.1f}, '
+                         '{statements}'.format(**method))
+        lines.append('')
+        lines.append(language['hottest_queries'])
+        for statement in report['statements']:
+            lines.append('  ' + str(statement['count']) + ': ' +
+                         statement['statement'])
+        self.report_widget.values = lines
+
+    def on_ok(self):
+        self.parentApp.setNextForm('MAIN')
+
+
 class App(nps.NPSAppManaged):
     def onStart(self):
         # add an abstract database object to the application
         # used by user interface to make changes to the database
         self.db = dbi.Database(self.db_name)
+        if os.environ.get(instrumentation_variable):
+            self.db.enable_instrumentation()
+        # loads the data of the highlighted pack before it is opened
+        self.prefetcher = Prefetcher(self.db, self.db_name)
 
         # add the different screens to the application
         # 'MAIN' is the starting screen
@@ -606,6 +1293,9 @@ class App(nps.NPSAppManaged):
         self.add_item = self.addForm('EDIT_ITEM',
                                      EditItem,
                                      name=language['edit_item'])
+        self.add_item = self.addForm('WHERE_USED',
+                                     WhereUsed,
+                                     name=language['where_used'])
         self.add_item = self.addForm('ADD_PACK',
                                      AddPack,
                                      name=language['add_new_pack'])
@@ -615,6 +1305,12 @@ class App(nps.NPSAppManaged):
         self.add_item = self.addForm('EDIT_PACK',
                                      EditPack,
                                      name=language['edit_pack'])
+        self.add_item = self.addForm('INSTRUMENTATION',
+                                     Instrumentation,
+                                     name=language['instrumentation'])
+
+    def onCleanExit(self):
+        self.prefetcher.close()
 
 
 if __name__ == "__main__":
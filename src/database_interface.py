@@ -6,37 +6,824 @@ It offers abstractions for all the functionality provided by the database.
 """
 import sqlite3
 import decimal
+import contextlib
+import queue
+import threading
+import itertools
+import json
+import re
+import time
+import functools
+import inspect
+import collections
+import collections.abc
+import packlist_utils
+
+# The values of the attributes with a unit are stored as integers counting
+# the smallest fraction of the unit, given by the number of decimal places.
+# E. g. weight in mg, volume in mL, and price in centimes.
+decimal_places = {'weight': 6,
+                  'volume': 3,
+                  'price':  2}
+
+# Version of the schema created by Database.initialize, stored in the
+# database as user_version to know which migrations are needed.
+schema_version = 3
+
+# Settings applied to the connection by Database, chosen by the name of the
+# profile. 'interactive' is used by the user interfaces, 'bulk-load' trades
+# durability on power loss for speed when importing large amounts of data,
+# and 'read-only-browse' refuses to change the database.
+connection_profiles = {
+    'interactive':      {'journal_mode': 'wal',
+                         'synchronous':  'normal',
+                         'cache_size':   -16000,
+                         'mmap_size':    64 * 2**20,
+                         'temp_store':   'memory',
+                         'foreign_keys': 'on',
+                         'query_only':   'off'},
+    'bulk-load':        {'journal_mode': 'wal',
+                         'synchronous':  'off',
+                         'cache_size':   -256000,
+                         'mmap_size':    256 * 2**20,
+                         'temp_store':   'memory',
+                         'foreign_keys': 'on',
+                         'query_only':   'off'},
+    'read-only-browse': {'synchronous':  'normal',
+                         'cache_size':   -64000,
+                         'mmap_size':    256 * 2**20,
+                         'temp_store':   'memory',
+                         'foreign_keys': 'on',
+                         'query_only':   'on'}}
+
+# upper bounds in milliseconds of the buckets of the latency histograms
+# recorded by Instrumentation, slower calls are counted in an extra bucket
+latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                   1000, 2500]
+
+# weights of the columns name and function when ranking the results of
+# Database.search, a match in the name counts more than one in the function
+search_weights = (10.0, 1.0)
+
+# ranking costs time for every matching row, the results of a search matching
+# more rows than this (e.g. for the first letter typed) are not ranked
+search_rank_limit = 10000
+
+# names of the values SQLite returns for some of the settings
+_setting_names = {'synchronous':  ['off', 'normal', 'full', 'extra'],
+                  'temp_store':   ['default', 'file', 'memory'],
+                  'foreign_keys': ['off', 'on'],
+                  'query_only':   ['off', 'on']}
+
+
+def to_fixed_point(value, attribute):
+    """
+    Converts the value (a decimal.Decimal, an integer, or a string) of the
+    attribute ('weight', 'volume', or 'price') to the integer it is stored as
+    in the database.
+    Digits beyond the stored decimal places are rounded.
+    Raises a ValueError for an infinite value or NaN.
+    """
+    value = decimal.Decimal(value)
+    if not value.is_finite():
+        raise ValueError(attribute + ' must be a finite number, not ' +
+                         str(value))
+    value = value.scaleb(decimal_places[attribute])
+    return int(value.to_integral_value(rounding=decimal.ROUND_HALF_EVEN))
+
+
+def _storable_value(value, attribute):
+    """
+    Returns the value of the attribute read from a record to import if it is
+    a string or an integer SQLite can store (64 bit).
+    Raises a TypeError for any other type and a ValueError for an integer out
+    of range, so a bad record is reported instead of failing the insert.
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        if not -2**63 <= value < 2**63:
+            raise ValueError(attribute + ' out of range: ' + str(value))
+        return value
+    raise TypeError(attribute + ' must be a string or an integer, not ' +
+                    type(value).__name__)
+
+
+def from_fixed_point(value, attribute):
+    """
+    Converts the integer value of the attribute ('weight', 'volume', or
+    'price') as it is stored in the database back to a decimal.Decimal.
+    Trailing zeros are removed, so that e.g. a weight of 1500000 mg is
+    returned as Decimal('1.5').
+    """
+    value = decimal.Decimal(value).scaleb(-decimal_places[attribute])
+    if value == value.to_integral_value():
+        return value.quantize(1)
+    return value.normalize()
+
+
+def _cached_read(method):
+    """
+    Decorator for the methods of Database which only read from the database,
+    caching their results in the read cache of the Database.
+    Arguments which are dictionaries (e.g. a pack) are identified by the
+    value for the key 'id'.
+    The caller gets a copy of a cached list of rows, so changing a row
+    (e.g. its value for 'selected') does not change the cache.
+    """
+    @functools.wraps(method)
+    def cached_method(self, *arguments, **keyword_arguments):
+        key = (method.__name__,)
+        for argument in arguments:
+            if isinstance(argument, collections.abc.Mapping):
+                argument = argument['id']
+            key += (argument,)
+        if keyword_arguments:
+            key += tuple(sorted(keyword_arguments.items()))
+        return self._read_through_cache(key, method, arguments,
+                                        keyword_arguments)
+
+    return cached_method
+
+
+def _invalidates_cache(method):
+    """
+    Decorator for the methods of Database which change the database,
+    invalidating the read cache of the Database after they are done.
+    The decorated methods are marked with changes_database = True, so e.g.
+    AsyncDatabase knows to run them with the connection for writing.
+    """
+    @functools.wraps(method)
+    def invalidating_method(self, *arguments, **keyword_arguments):
+        try:
+            return method(self, *arguments, **keyword_arguments)
+        finally:
+            self._bump_generation()
+
+    invalidating_method.changes_database = True
+    return invalidating_method
+
+
+# A change of the database published to the subscribers of a Database (see
+# Database.subscribe): the table ('items' or 'packs') and the id of the
+# changed row, or None if any number of rows changed, and the kind of the
+# change, 'stored', 'updated' (the row's own values), or 'deleted', and for
+# packs also 'contents' (the included items or packs) and 'totals' (the
+# calculated values, e.g. the buildable amount), or 'changed' if another
+# connection changed the table in any way (see
+# Database.check_other_connections).
+Change = collections.namedtuple('Change', ['table', 'id', 'kind'])
+
+
+class Instrumentation:
+    """
+    Statistics about the use of a Database, recorded after calling
+    Database.enable_instrumentation: for every public method the number of
+    calls, the time they took as total, maximum and histogram (see
+    latency_buckets), and the number of statements executed, rows returned,
+    and rows changed; and for every statement how many times it was
+    executed.
+    The values of a method include the methods called by it, e.g. the
+    statements of iter_items are counted for get_all_items as well.
+    """
+    # literals in the statements, replaced to count statements which only
+    # differ in the values of their parameters together
+    _literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Drops all the recorded statistics.
+        """
+        self.methods = {}
+        self.statements = {}
+        self._running = []
+
+    def record_statement(self, statement):
+        """
+        Counts the statement, called by SQLite for every executed statement
+        (see sqlite3.Connection.set_trace_callback).
+        """
+        statement = ' '.join(self._literals.sub('?', statement).split())
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        for statistics in self._running:
+            statistics['statements'] += 1
+
+    def timed(self, name, method, conn):
+        """
+        Returns a function calling method and recording its statistics for
+        the given name, conn is the connection used by the method.
+        If method returns a generator (e.g. iter_items) the call is recorded
+        when the generator is exhausted or closed, including the time spent
+        producing its values.
+        """
+        @functools.wraps(method)
+        def timed_method(*arguments, **keyword_arguments):
+            # looked up for every call, so a reset is in effect right away
+            statistics = self._statistics(name)
+            changes = conn.total_changes
+            self._running.append(statistics)
+            start = time.perf_counter()
+            try:
+                result = method(*arguments, **keyword_arguments)
+            except BaseException:
+                self._running.pop()
+                self._record(statistics, time.perf_counter() - start,
+                             conn.total_changes - changes, 0)
+                raise
+            seconds = time.perf_counter() - start
+            self._running.pop()
+            if inspect.isgenerator(result):
+                # the rows of the iterating methods (e.g. iter_items) are
+                # read while the generator is consumed
+                return self._timed_generator(statistics, result, conn,
+                                             seconds,
+                                             conn.total_changes - changes)
+            self._record(statistics, seconds, conn.total_changes - changes,
+                         len(result) if isinstance(result, (list, dict))
+                         else 0)
+            return result
+
+        return timed_method
+
+    def _statistics(self, name):
+        """
+        Returns the dictionary with the statistics of the method name.
+        """
+        if name not in self.methods:
+            self.methods[name] = {'calls':       0,
+                                  'seconds':     0.0,
+                                  'max_seconds': 0.0,
+                                  'statements':  0,
+                                  'rows':        0,
+                                  'changes':     0,
+                                  'histogram':   [0] * (len(latency_buckets)
+                                                        + 1)}
+        return self.methods[name]
+
+    def _timed_generator(self, statistics, generator, conn, seconds,
+                         changes):
+        """
+        Generator yielding the values of generator and recording the time it
+        took to produce them (not the time the caller spent in between) in
+        statistics, with the seconds and changes of creating it, as one call
+        when it is exhausted or closed.
+        """
+        rows = 0
+        try:
+            while True:
+                total_changes = conn.total_changes
+                self._running.append(statistics)
+                start = time.perf_counter()
+                try:
+                    value = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                    self._running.pop()
+                    changes += conn.total_changes - total_changes
+                rows += 1
+                yield value
+        finally:
+            generator.close()
+            self._record(statistics, seconds, changes, rows)
+
+    def _record(self, statistics, seconds, changes, rows):
+        """
+        Records a call which took seconds and changed and returned the
+        numbers of rows in statistics.
+        """
+        statistics['calls'] += 1
+        statistics['seconds'] += seconds
+        statistics['max_seconds'] = max(statistics['max_seconds'], seconds)
+        statistics['changes'] += changes
+        statistics['rows'] += rows
+        bucket = 0
+        while bucket < len(latency_buckets) and \
+                seconds * 1000 > latency_buckets[bucket]:
+            bucket += 1
+        statistics['histogram'][bucket] += 1
+
+    def report(self, top=None):
+        """
+        Returns a dictionary with the statistics of the methods called at
+        least once for the key 'methods', a list of dictionaries ordered by
+        the total time, and the statements for the key 'statements', a list
+        of dictionaries with the statement for the key 'statement' and the
+        number of executions for the key 'count', ordered by the count.
+        Only the top methods and statements are returned if top is given.
+        The histograms are lists of [upper bound in ms, count] pairs, the
+        last one with the upper bound None.
+        """
+        methods = []
+        for name, statistics in self.methods.items():
+            if not statistics['calls']:
+                continue
+            methods.append({
+                'method':     name,
+                'calls':      statistics['calls'],
+                'total_ms':   1000 * statistics['seconds'],
+                'mean_ms':    1000 * statistics['seconds'] /
+                              statistics['calls'],
+                'max_ms':     1000 * statistics['max_seconds'],
+                'statements': statistics['statements'],
+                'rows':       statistics['rows'],
+                'changes':    statistics['changes'],
+                'histogram':  [[bound, count] for bound, count
+                               in zip(latency_buckets + [None],
+                                      statistics['histogram'])]})
+        methods.sort(key=lambda method: method['total_ms'], reverse=True)
+
+        statements = [{'statement': statement, 'count': count}
+                      for statement, count in self.statements.items()]
+        statements.sort(key=lambda statement: statement['count'],
+                        reverse=True)
+
+        return {'methods': methods[:top], 'statements': statements[:top]}
+
+    def dump(self, file):
+        """
+        Writes the report as JSON to the opened file.
+        """
+        json.dump(self.report(), file, indent=1)
+
+
+class _Row(collections.abc.MutableMapping):
+    """
+    Base class of the rows returned by the methods of Database.
+    A row can be used like a dictionary with the attribute's name (String)
+    as key to the corresponding value, for the keys in attribute_names and
+    optionally 'selected'.
+    Uses __slots__ instead of a dictionary per row to save memory.
+    """
+    __slots__ = ()
+
+    attribute_names = ()
+
+    # keys whose value is stored unchanged in the slot of the same name
+    _plain_keys = frozenset(['selected'])
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """
+        Creates an instance from a row read from the database.
+        Can be used as row_factory of a sqlite3.Cursor for a query selecting
+        the columns in the order of the arguments of __init__.
+        """
+        return cls(*row)
+
+    def __getitem__(self, key):
+        if key in self._plain_keys:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._plain_keys:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key != 'selected' or not hasattr(self, 'selected'):
+            raise KeyError(key)
+        del self.selected
+
+    def __iter__(self):
+        yield from self.attribute_names
+        if hasattr(self, 'selected'):
+            yield 'selected'
+
+    def __len__(self):
+        return len(self.attribute_names) + hasattr(self, 'selected')
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + repr(dict(self)) + ')'
+
+    def copy(self):
+        """
+        Returns a shallow copy of the row.
+        """
+        duplicate = type(self).__new__(type(self))
+        for name in self.__slots__:
+            if hasattr(self, name):
+                setattr(duplicate, name, getattr(self, name))
+        return duplicate
+
+
+class Item(_Row):
+    """
+    An item as returned by the methods of Database reading items.
+    It can be used like a dictionary with the attribute's name (String) as
+    key to the corresponding value, for the keys 'id', 'name', 'function',
+    'weight', 'volume', 'price', 'amount', and optionally 'selected'.
+    The values for 'weight', 'volume', and 'price' are kept as they are
+    stored in the database and only converted to decimal.Decimal when they
+    are accessed for the first time.
+    """
+    __slots__ = ('id', 'name', 'function', '_weight', '_volume', '_price',
+                 'amount', 'selected')
+
+    attribute_names = ('id', 'name', 'function', 'weight', 'volume', 'price',
+                       'amount')
+
+    _plain_keys = frozenset(['id', 'name', 'function', 'amount', 'selected'])
+
+    def __init__(self, id, name, function, weight, volume, price, amount,
+                 selected=None):
+        """
+        The arguments weight, volume, and price are the integers stored in
+        the database (see to_fixed_point).
+        If selected is None the item has no value for the key 'selected'.
+        """
+        self.id = id
+        self.name = name
+        self.function = function
+        self._weight = weight
+        self._volume = volume
+        self._price = price
+        self.amount = amount
+        if selected is not None:
+            self.selected = selected
+
+    def copy(self):
+        """
+        Returns a shallow copy of the item.
+        """
+        return Item(self.id, self.name, self.function,
+                    self._weight, self._volume, self._price, self.amount,
+                    getattr(self, 'selected', None))
+
+    def __getitem__(self, key):
+        if key in self._plain_keys:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if key in decimal_places:
+            value = getattr(self, '_' + key)
+            if type(value) is int:
+                value = from_fixed_point(value, key)
+                setattr(self, '_' + key, value)
+            return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in decimal_places:
+            # only the integers read from the database are fixed-point values
+            if type(value) is int:
+                value = decimal.Decimal(value)
+            setattr(self, '_' + key, value)
+        else:
+            super().__setitem__(key, value)
+
+
+class Pack(_Row):
+    """
+    A pack as returned by the methods of Database reading packs.
+    It can be used like a dictionary with the attribute's name (String) as
+    key to the corresponding value, for the keys 'id', 'name', 'function',
+    and optionally 'selected'.
+    """
+    __slots__ = ('id', 'name', 'function', 'selected')
+
+    attribute_names = ('id', 'name', 'function')
+
+    _plain_keys = frozenset(['id', 'name', 'function', 'selected'])
+
+    def __init__(self, id, name, function, selected=None):
+        """
+        If selected is None the pack has no value for the key 'selected'.
+        """
+        self.id = id
+        self.name = name
+        self.function = function
+        if selected is not None:
+            self.selected = selected
+
+    def copy(self):
+        """
+        Returns a shallow copy of the pack.
+        """
+        return Pack(self.id, self.name, self.function,
+                    getattr(self, 'selected', None))
 
 
 class Database:
-    def __init__(self, db_name):
+    def __init__(self, db_name, profile='interactive', read_cache_size=128,
+                 check_same_thread=True):
         """
         The argument db_name is a string, giving the name of the database
         in the filesystem.
         Use db_name = ':memory:' to create a temporary database for testing.
+        The argument profile is the name of one of the connection_profiles
+        or a dictionary with settings to apply to the connection instead of
+        the ones of the profile 'interactive'.
+        The argument read_cache_size is the number of results of the reading
+        methods kept in the read cache, 0 disables the cache.
+        With check_same_thread = False the object can be handed from one
+        thread to another (e.g. by DatabasePool), but it must never be used
+        by two threads at the same time.
         """
         self.db_name = db_name
-        self.conn = sqlite3.connect(db_name)
+        self.conn = sqlite3.connect(db_name,
+                                    check_same_thread=check_same_thread)
         self.cursor = self.conn.cursor()
+        self._transaction_depth = 0
+        self.instrumentation = None
+
+        # the read cache is cleared whenever the generation changes, which
+        # happens after every change made through this object, or when
+        # data_version shows another connection changed the database
+        self._generation = 0
+        self._data_version = None
+        self._read_cache = collections.OrderedDict()
+        self._read_cache_size = read_cache_size
+        self._read_cache_hits = 0
+        self._read_cache_misses = 0
+
+        # the changes are collected during a transaction and published when
+        # it is committed, only if anybody subscribed
+        self._subscribers = []
+        self._changes = []
+
+        if isinstance(profile, str):
+            profile = connection_profiles[profile]
+        else:
+            profile = dict(connection_profiles['interactive'], **profile)
+        self.profile = profile
+
+        # refusing changes is applied after initializing the database
+        self._apply_settings({name: value for name, value in profile.items()
+                              if name != 'query_only'})
 
         # initialize the database here to take the burden off the user
         self.initialize()
 
+        if 'query_only' in profile:
+            self._apply_settings({'query_only': profile['query_only']})
+
+        # the changes of other connections are noticed from now on
+        self.cursor.execute("""PRAGMA data_version""")
+        self._data_version = self.cursor.fetchone()[0]
+
+    def _apply_settings(self, settings):
+        """
+        Applies the settings, a dictionary with the name of a PRAGMA as key to
+        the value to set, to the connection.
+        Must be called outside of a transaction, where SQLite ignores some of
+        the settings (e.g. foreign_keys).
+        """
+        for name, value in settings.items():
+            self.cursor.execute("""PRAGMA """ + name + """ = """ + str(value))
+            # some settings (e.g. journal_mode) return the new value
+            self.cursor.fetchall()
+
+    @contextlib.contextmanager
+    def transaction(self, begin='DEFERRED'):
+        """
+        Context manager running the statements inside of it in a single
+        transaction, which is committed at the end or rolled back if an
+        exception is raised.
+        Transactions can be nested, e.g. by calling the methods of this
+        object inside of a transaction: only the outermost one begins and
+        commits the transaction, so all the changes made inside of it are
+        committed together or not at all.
+        The argument begin is 'DEFERRED' or 'IMMEDIATE', the latter takes the
+        lock for writing at the start of the transaction instead of at the
+        first change.
+        """
+        if self._transaction_depth > 0:
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+            return
+
+        self._transaction_depth = 1
+        try:
+            with self.conn:
+                if not self.conn.in_transaction:
+                    self.cursor.execute("""BEGIN """ + begin)
+                yield self
+        except BaseException:
+            # the read cache may hold results of the rolled back changes
+            self._bump_generation()
+            self._changes = []
+            raise
+        finally:
+            self._transaction_depth = 0
+        self._notify_subscribers()
+
+    def subscribe(self, callback):
+        """
+        Calls callback with a list of the changes (see Change) of every
+        transaction made through this object after it is committed, e.g. to
+        only read the changed rows again.
+        Changes made by other connections are only published as a change of
+        every row of every table when they are noticed (see
+        check_other_connections).
+        """
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """
+        Stops calling callback for the changes of the database.
+        """
+        self._subscribers.remove(callback)
+
+    def _publish(self, table, kind, ids):
+        """
+        Records a change of kind for the rows of table with the given ids,
+        which is published when the transaction is committed.
+        Needs to be called inside of the transaction making the change.
+        """
+        if self._subscribers:
+            self._changes.extend(Change(table, row_id, kind) for row_id in ids)
+
+    def _notify_subscribers(self):
+        # every change is only published once, in the order it was made
+        changes = list(dict.fromkeys(self._changes))
+        self._changes = []
+        if changes:
+            # the subscribers may read the changed rows right away
+            self._bump_generation()
+            for callback in list(self._subscribers):
+                callback(changes)
+
+    def check_other_connections(self):
+        """
+        Returns True if another connection (e.g. the HTTP service using the
+        same file) changed the database since the last check, which is
+        noticed by PRAGMA data_version. The read cache is cleared then and
+        the change is published to the subscribers as
+        Change(table, None, 'changed') for both tables, since it is unknown
+        which rows changed.
+        Also checked by every read through the read cache.
+        """
+        self.cursor.execute("""PRAGMA data_version""")
+        data_version = self.cursor.fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+        self._bump_generation()
+        for callback in list(self._subscribers):
+            callback([Change('items', None, 'changed'),
+                      Change('packs', None, 'changed')])
+        return True
+
+    def close(self):
+        """
+        Closes the connection to the database.
+        """
+        self.conn.close()
+
+    def _instrumented_methods(self):
+        """
+        Returns the names of the public methods recorded by the
+        instrumentation.
+        """
+        return [name for name, value in vars(Database).items()
+                if callable(value) and not name.startswith('_')
+                and name not in ('transaction', 'close',
+                                 'enable_instrumentation',
+                                 'disable_instrumentation',
+                                 'subscribe', 'unsubscribe')]
+
+    def enable_instrumentation(self):
+        """
+        Starts recording statistics about the calls of the public methods
+        and the executed statements (see Instrumentation).
+        The recorded statistics are kept if the instrumentation is enabled
+        again after disabling it.
+        Returns the Instrumentation, which is also available as the
+        attribute instrumentation.
+        """
+        if self.instrumentation is None:
+            self.instrumentation = Instrumentation()
+        # the timed methods are only set on this object, so a Database
+        # without instrumentation calls its methods directly
+        for name in self._instrumented_methods():
+            setattr(self, name,
+                    self.instrumentation.timed(name,
+                                               getattr(Database, name)
+                                               .__get__(self),
+                                               self.conn))
+        self.conn.set_trace_callback(self.instrumentation.record_statement)
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        """
+        Stops recording statistics, without any overhead for the calls of the
+        methods afterwards.
+        """
+        for name in self._instrumented_methods():
+            self.__dict__.pop(name, None)
+        self.conn.set_trace_callback(None)
+
+    def _bump_generation(self):
+        """
+        Starts a new generation of the data, invalidating the read cache.
+        """
+        self._generation += 1
+        self._read_cache.clear()
+
+    def _read_through_cache(self, key, method, arguments,
+                            keyword_arguments={}):
+        """
+        Returns a copy of the cached result for key, if there is none the
+        method is called with the arguments and its result is cached.
+        The least recently used results are dropped if the cache is full.
+        """
+        self.check_other_connections()
+
+        try:
+            result = self._read_cache[key]
+            self._read_cache.move_to_end(key)
+            self._read_cache_hits += 1
+        except KeyError:
+            self._read_cache_misses += 1
+            result = method(self, *arguments, **keyword_arguments)
+            if self._read_cache_size > 0:
+                self._read_cache[key] = result
+                while len(self._read_cache) > self._read_cache_size:
+                    self._read_cache.popitem(last=False)
+
+        if isinstance(result, list):
+            return [row.copy() for row in result]
+        if isinstance(result, dict):
+            return result.copy()
+        return result
+
+    def read_cache_info(self):
+        """
+        Returns a dictionary with the number of cache hits and misses of the
+        reading methods for the keys 'hits' and 'misses', the number of
+        cached results and the maximal number for the keys 'size' and
+        'maxsize', and the current generation of the data for the key
+        'generation'.
+        """
+        return {'hits':       self._read_cache_hits,
+                'misses':     self._read_cache_misses,
+                'size':       len(self._read_cache),
+                'maxsize':    self._read_cache_size,
+                'generation': self._generation}
+
+    def connection_settings(self):
+        """
+        Returns a dictionary with the name of a PRAGMA as key to the value in
+        effect on the connection, for all the settings of the
+        connection_profiles.
+        The values are given in the form used by connection_profiles, so
+        they can be compared with a profile to verify it is applied.
+        The journal_mode of a database in memory is always 'memory'.
+        """
+        settings = {}
+        for name in ['journal_mode', 'synchronous', 'cache_size',
+                     'mmap_size', 'temp_store', 'foreign_keys', 'query_only']:
+            self.cursor.execute("""PRAGMA """ + name)
+            row = self.cursor.fetchone()
+            value = None if row is None else row[0]
+            if name in _setting_names and value is not None:
+                value = _setting_names[name][value]
+            settings[name] = value
+
+        return settings
+
     def initialize(self):
         """
         Creates the tables needed for storing the data if
         they do not already exist.
         Needs be called before a new database can be used.
         If called on an existing database it does not have any side effects.
+        Databases created by an older version are migrated to the
+        current schema.
         """
-        with self.conn:
+        with self.transaction():
+            self.cursor.execute("""PRAGMA user_version""")
+            version = self.cursor.fetchone()[0]
+            self.cursor.execute("""SELECT EXISTS (
+                                       SELECT * FROM sqlite_master
+                                       WHERE type = 'table'
+                                       AND name = 'items')""")
+            existing_database = self.cursor.fetchone()[0]
+
+        if existing_database and version < 1:
+            self._migrate_to_fixed_point()
+
+        with self.transaction():
             self.cursor.execute("""CREATE TABLE IF NOT EXISTS items(
                                    id integer PRIMARY KEY,
                                    name text,
                                    function text,
-                                   weight text,
-                                   volume text,
-                                   price text,
+                                   weight integer,
+                                   volume integer,
+                                   price integer,
                                    amount integer) """)
 
             self.cursor.execute("""CREATE TABLE IF NOT EXISTS packs(
@@ -66,9 +853,219 @@ class Database:
                                    ON DELETE CASCADE)
                                    """)
 
-            # activate the constraints on foreign_keys in database
-            self.cursor.execute("""PRAGMA foreign_keys = ON""")
+            # the primary keys only support looking up the content of a pack,
+            # these indexes support looking up the packs including something
+            self.cursor.execute("""CREATE INDEX IF NOT EXISTS
+                                   included_items_item
+                                   ON included_items(item)""")
+
+            self.cursor.execute("""CREATE INDEX IF NOT EXISTS
+                                   included_packs_included_pack
+                                   ON included_packs(included_pack)""")
+
+            # support resolving references by name when importing
+            self.cursor.execute("""CREATE INDEX IF NOT EXISTS
+                                   items_name
+                                   ON items(name)""")
+
+            self.cursor.execute("""CREATE INDEX IF NOT EXISTS
+                                   packs_name
+                                   ON packs(name)""")
+
+            # full-text index over the names and functions used by search
+            self._full_text_search = self._create_search_index('items') and \
+                self._create_search_index('packs')
+
+            # cache for the calculated values of every pack, a missing or
+            # stale row is recalculated the next time it is read, so the
+            # cache of an older version can simply be dropped
+            if existing_database and version < 2:
+                self.cursor.execute("""DROP TABLE IF EXISTS pack_totals""")
+
+            self.cursor.execute("""CREATE TABLE IF NOT EXISTS pack_totals(
+                                   pack integer PRIMARY KEY,
+                                   weight integer,
+                                   volume integer,
+                                   price integer,
+                                   amount integer,
+                                   stale integer,
+                                   FOREIGN KEY (pack) REFERENCES packs(id)
+                                   ON DELETE CASCADE)
+                                   """)
+
+            # closure of the included packs: a row for every pack and every
+            # pack included in it directly or indirectly (including itself)
+            # with the total amount it is included summed over all paths
+            self.cursor.execute("""CREATE TABLE IF NOT EXISTS pack_closure(
+                                   ancestor integer,
+                                   descendant integer,
+                                   amount integer,
+                                   PRIMARY KEY (ancestor, descendant),
+                                   FOREIGN KEY (ancestor) REFERENCES packs(id)
+                                   ON DELETE CASCADE,
+                                   FOREIGN KEY (descendant) REFERENCES packs(id)
+                                   ON DELETE CASCADE)
+                                   """)
+
+            self.cursor.execute("""CREATE INDEX IF NOT EXISTS
+                                   pack_closure_descendant
+                                   ON pack_closure(descendant)""")
+
+            if version != schema_version:
+                self.cursor.execute("""PRAGMA user_version = """ +
+                                    str(schema_version))
+
+            # fill the closure for databases created before it existed
+            self.cursor.execute("""SELECT EXISTS (
+                                       SELECT * FROM packs
+                                       WHERE NOT EXISTS (
+                                           SELECT * FROM pack_closure
+                                           WHERE ancestor = packs.id
+                                           AND descendant = packs.id))""")
+            closure_incomplete = self.cursor.fetchone()[0]
+
+        if closure_incomplete:
+            self.rebuild_pack_closure()
+
+    def _create_search_index(self, table):
+        """
+        Creates the full-text index of the table ('items' or 'packs') if it
+        does not exist yet and fills it with the existing rows, and the
+        triggers keeping it in sync with the table.
+        The index is a FTS5 table with the name of the table followed by
+        '_search', which only holds the index and reads the values from the
+        table itself (external content).
+        Returns False if SQLite was built without FTS5, search then scans
+        the table instead. Raises the other sqlite3.OperationalErrors.
+        Needs to be called inside of the transaction of initialize.
+        """
+        index = table + '_search'
+        self.cursor.execute("""SELECT EXISTS (
+                                   SELECT * FROM sqlite_master
+                                   WHERE type = 'table'
+                                   AND name = :index)""",
+                            {'index': index})
+        index_exists = self.cursor.fetchone()[0]
+
+        # the prefix indexes answer the queries for the first letters of a
+        # word, which are typed most often, without scanning the index
+        try:
+            self.cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS """ +
+                                index + """ USING fts5(
+                                   name,
+                                   function,
+                                   content = '""" + table + """',
+                                   content_rowid = 'id',
+                                   prefix = '1 2 3')""")
+        except sqlite3.OperationalError as error:
+            # only a SQLite built without FTS5 has no module fts5, any other
+            # error (e.g. a conflicting name) is not hidden by scanning
+            if 'no such module' not in str(error):
+                raise
+            return False
 
+        if not index_exists:
+            self.cursor.execute("""INSERT INTO """ + index + """(""" +
+                                index + """) VALUES ('rebuild')""")
+
+        # an external content index needs the old values to remove a row
+        self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS """ + index +
+                            """_insert AFTER INSERT ON """ + table + """
+                               BEGIN
+                                   INSERT INTO """ + index + """
+                                       (rowid, name, function)
+                                   VALUES (new.id, new.name, new.function);
+                               END""")
+        self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS """ + index +
+                            """_delete AFTER DELETE ON """ + table + """
+                               BEGIN
+                                   INSERT INTO """ + index + """
+                                       (""" + index + """, rowid, name,
+                                        function)
+                                   VALUES ('delete', old.id, old.name,
+                                           old.function);
+                               END""")
+        self.cursor.execute("""CREATE TRIGGER IF NOT EXISTS """ + index +
+                            """_update AFTER UPDATE OF name, function
+                               ON """ + table + """
+                               WHEN old.name IS NOT new.name
+                               OR old.function IS NOT new.function
+                               BEGIN
+                                   INSERT INTO """ + index + """
+                                       (""" + index + """, rowid, name,
+                                        function)
+                                   VALUES ('delete', old.id, old.name,
+                                           old.function);
+                                   INSERT INTO """ + index + """
+                                       (rowid, name, function)
+                                   VALUES (new.id, new.name, new.function);
+                               END""")
+        return True
+
+    def _migrate_to_fixed_point(self):
+        """
+        Migrates a database created by an older version, which stored the
+        values for 'weight', 'volume', and 'price' of the items as text, to
+        store them as integers (see decimal_places).
+        The table items is copied and converted inside of SQLite in a single
+        transaction, so the migration either completes or leaves the
+        database unchanged.
+        The calculated values in pack_totals are dropped and recalculated
+        when they are read the next time.
+        Raises a ValueError naming the item and the value if a value is not
+        a number, the database is left unchanged then so it can be fixed.
+        """
+        self.conn.create_function('to_fixed_point', 2, to_fixed_point,
+                                  deterministic=True)
+
+        # the old table is dropped, which must not delete the included items
+        self._apply_settings({'foreign_keys': 'off'})
+        try:
+            with self.conn:
+                self.cursor.execute("""BEGIN""")
+                # the error of the conversion inside of SQLite does not tell
+                # which row failed
+                self.cursor.execute("""SELECT id, weight, volume, price
+                                       FROM items""")
+                for row in self.cursor.fetchall():
+                    for attribute, value in zip(['weight', 'volume', 'price'],
+                                                row[1:]):
+                        try:
+                            to_fixed_point(value, attribute)
+                        except (TypeError, ValueError,
+                                decimal.InvalidOperation):
+                            raise ValueError(
+                                    'cannot migrate the table items: ' +
+                                    attribute + ' of the item with the id ' +
+                                    str(row[0]) + ' is not a number: ' +
+                                    repr(value)) from None
+                self.cursor.execute("""CREATE TABLE items_fixed_point(
+                                       id integer PRIMARY KEY,
+                                       name text,
+                                       function text,
+                                       weight integer,
+                                       volume integer,
+                                       price integer,
+                                       amount integer) """)
+                self.cursor.execute("""INSERT INTO items_fixed_point
+                                       SELECT id,
+                                           name,
+                                           function,
+                                           to_fixed_point(weight, 'weight'),
+                                           to_fixed_point(volume, 'volume'),
+                                           to_fixed_point(price, 'price'),
+                                           amount
+                                       FROM items""")
+                self.cursor.execute("""DROP TABLE items""")
+                self.cursor.execute("""ALTER TABLE items_fixed_point
+                                       RENAME TO items""")
+                self.cursor.execute("""DROP TABLE IF EXISTS pack_totals""")
+                self.cursor.execute("""PRAGMA user_version = 1""")
+        finally:
+            self._apply_settings({'foreign_keys':
+                                  self.profile.get('foreign_keys', 'on')})
+
+    @_invalidates_cache
     def store_new_item(self, item_values):
         """
         Stores a new item in the database.
@@ -80,17 +1077,18 @@ class Database:
         if it does it will be ignoered.
         This function creates a new instance (= new id) of this item
         in the database.
+        Returns the id of the new item.
         """
         item_values_for_db = {
                 'id':       None,
                 'name':     item_values['name'],
                 'function': item_values['function'],
-                'weight':   str(item_values['weight']),
-                'volume':   str(item_values['volume']),
-                'price':    str(item_values['price']),
+                'weight':   to_fixed_point(item_values['weight'], 'weight'),
+                'volume':   to_fixed_point(item_values['volume'], 'volume'),
+                'price':    to_fixed_point(item_values['price'], 'price'),
                 'amount':   item_values['amount']}
 
-        with self.conn:
+        with self.transaction():
             self.cursor.execute("""INSERT INTO items VALUES
                                    (:id,
                                     :name,
@@ -100,7 +1098,12 @@ class Database:
                                     :price,
                                     :amount)""",
                                 item_values_for_db)
+            item_id = self.cursor.lastrowid
+            self._publish('items', 'stored', [item_id])
+
+        return item_id
 
+    @_cached_read
     def get_all_items(self):
         """
         Returns a list of dictionaries of all items in the database.
@@ -109,27 +1112,108 @@ class Database:
         Item's 'id' can be used later when referring to an item
         read from the database using this function.
         """
-        with self.conn:
-            # get the raw item-data from the database
-            self.cursor.execute("""SELECT * FROM items""")
-            items_raw = self.cursor.fetchall()
-
-        # reserve space in list for all items
-        items = len(items_raw)*[None]
-
-        # add a dictionary with attributes for every item to the list
-        for index, item_tuple in enumerate(items_raw):
-            item = {'id':       item_tuple[0],
-                    'name':     item_tuple[1],
-                    'function': item_tuple[2],
-                    'weight':   decimal.Decimal(item_tuple[3]),
-                    'volume':   decimal.Decimal(item_tuple[4]),
-                    'price':    decimal.Decimal(item_tuple[5]),
-                    'amount':   item_tuple[6]}
-            items[index] = item
-
-        return items
+        return list(self.iter_items())
 
+    def iter_items(self, page_size=500, after_id=None, order_by='id'):
+        """
+        Generator yielding a dictionary for every item in the database like
+        the ones returned by get_all_items.
+        The items are read page by page, each page with page_size items, so
+        the memory used does not depend on the number of items.
+        The items are ordered by order_by which is either 'id' or 'name'.
+        If after_id is the id of an item, only the items after this item are
+        yielded, e.g. the id of the last item shown to continue browsing.
+        """
+        return self._iter_keyset("""SELECT id, name, function, weight,
+                                        volume, price, amount
+                                    FROM items""",
+                                 'items', None, {},
+                                 page_size, after_id, order_by, Item.from_row)
+
+    def _iter_keyset(self, query, table, condition, parameters,
+                     page_size, after_id, order_by, row_factory):
+        """
+        Generator yielding the rows returned by query page by page, each row
+        created by the function row_factory (e.g. Item.from_row).
+        query must select the columns 'id' and 'name' from table, condition is
+        an additional condition for the WHERE clause (or None) using the named
+        parameters in the dictionary parameters.
+        Every page is read with a separate query continuing after the last
+        row of the previous page (keyset pagination), so reading a page
+        costs the same no matter how far into the table it is.
+        The parameters page_size, after_id, and order_by are described in
+        iter_items.
+        """
+        # names which are NULL come first and do not compare with the row
+        # value, so the rows after a NULL name are found with null_keyset
+        null_keyset = None
+        if order_by == 'id':
+            keyset = table + """.id > :after_id"""
+            order = """ ORDER BY """ + table + """.id"""
+        elif order_by == 'name':
+            keyset = """(""" + table + """.name, """ + table + """.id) >
+                        (:after_name, :after_id)"""
+            null_keyset = """(""" + table + """.name IS NULL AND
+                              """ + table + """.id > :after_id
+                              OR """ + table + """.name IS NOT NULL)"""
+            order = """ ORDER BY """ + table + """.name, """ + table + """.id"""
+        else:
+            raise ValueError('cannot order by ' + repr(order_by))
+
+        parameters = dict(parameters)
+        parameters['after_id'] = after_id
+        parameters['after_name'] = None
+        parameters['page_size'] = page_size
+
+        if after_id is not None and order_by == 'name':
+            with self.transaction():
+                self.cursor.execute("""SELECT name FROM """ + table + """
+                                       WHERE id = :after_id""",
+                                    parameters)
+                row = self.cursor.fetchone()
+            if row is None:
+                raise ValueError('no row with id ' + str(after_id) +
+                                 ' in ' + table)
+            parameters['after_name'] = row[0]
+
+        def page_query_for(keyset):
+            page_query = query
+            if keyset is not None:
+                page_query += """ WHERE """ + keyset
+            if condition is not None:
+                page_query += """ AND (""" if keyset is not None \
+                    else """ WHERE ("""
+                page_query += condition + """)"""
+            return page_query + order + """ LIMIT :page_size"""
+
+        first_page_query = page_query_for(None)
+        next_page_query = page_query_for(keyset)
+        null_page_query = page_query_for(null_keyset or keyset)
+
+        def next_query():
+            if parameters['after_name'] is None:
+                return null_page_query
+            return next_page_query
+
+        page_query = first_page_query if after_id is None else next_query()
+        while True:
+            with self.transaction():
+                # use a separate cursor, so the database can be used
+                # between reading two pages
+                cursor = self.conn.cursor()
+                cursor.row_factory = row_factory
+                page = cursor.execute(page_query, parameters).fetchall()
+
+            yield from page
+
+            if len(page) < page_size:
+                break
+
+            parameters['after_id'] = page[-1]['id']
+            parameters['after_name'] = page[-1]['name']
+            page_query = next_query()
+
+    @_invalidates_cache
     def update_item(self, item_values):
         """
         This function modifies an existing instance (refered by its id)
@@ -145,11 +1229,11 @@ class Database:
                 'id':       item_values['id'],
                 'name':     item_values['name'],
                 'function': item_values['function'],
-                'weight':   str(item_values['weight']),
-                'volume':   str(item_values['volume']),
-                'price':    str(item_values['price']),
+                'weight':   to_fixed_point(item_values['weight'], 'weight'),
+                'volume':   to_fixed_point(item_values['volume'], 'volume'),
+                'price':    to_fixed_point(item_values['price'], 'price'),
                 'amount':   item_values['amount']}
-        with self.conn:
+        with self.transaction():
             self.cursor.execute("""UPDATE items SET
                                        name =  :name,
                                        function = :function,
@@ -159,7 +1243,195 @@ class Database:
                                        amount = :amount
                                    WHERE id = :id""",
                                 item_values_for_db)
+            self._publish('items', 'updated', [item_values_for_db['id']])
+
+            self._mark_stale_packs_including_item(item_values_for_db)
+
+    def update_item_impact(self, item_values, dry_run=False):
+        """
+        Updates an item like update_item and returns how the weight, volume,
+        and price of every pack including it change.
+        With dry_run = True the database is not changed, like with
+        preview_item_impact.
+        Returns a list of dictionaries, one for every pack including the
+        item directly or through any of its sub-packs, with the values of
+        the pack for the keys 'id' and 'name', how many times the item is
+        included for the key 'selected' (see where_used), and dictionaries
+        with the values for 'weight', 'volume', and 'price' before and after
+        the change for the keys 'before' and 'after'.
+        The values after the change are calculated by adding the change of
+        the item multiplied by how many times it is included to the values
+        before, so no pack is recalculated. If the database is changed these
+        values are stored in the table pack_totals, except if the amount of
+        the item changed, which needs the buildable amounts to be
+        recalculated.
+        The packs are ordered by their id.
+        """
+        if dry_run:
+            return self.preview_item_impact(item_values)
+        return self._apply_item_impact(item_values)
+
+    # the call may change the database, e.g. AsyncDatabase runs it with the
+    # connection for writing
+    update_item_impact.changes_database = True
+
+    def preview_item_impact(self, item_values):
+        """
+        Returns how the weight, volume, and price of every pack including
+        the item change if it is updated with item_values, as described in
+        update_item_impact, without changing the database (e.g. to compare
+        several gear swaps).
+        It only reads, so it can also be used by a connection refusing
+        changes (query_only); the missing or stale values of the packs are
+        calculated without storing them.
+        """
+        with self.transaction():
+            return self._item_impact(item_values)[2]
 
+    @_invalidates_cache
+    def _apply_item_impact(self, item_values):
+        """
+        Updates the item and the stored values of the packs including it as
+        described in update_item_impact and returns the impact.
+        """
+        item_id = item_values['id']
+        with self.transaction():
+            # only the missing or stale totals of the packs including the
+            # item are calculated
+            self.cursor.execute("""INSERT OR REPLACE INTO pack_totals """ +
+                                self._pack_totals_query(
+                                    """{pack} IN (""" +
+                                    self._packs_including_item_query +
+                                    """)
+                                       AND {pack} NOT IN (
+                                           SELECT pack FROM pack_totals
+                                           WHERE NOT stale)"""),
+                                {'id': item_id})
+
+            item_raw, new_values, impact, totals_after = \
+                self._item_impact(item_values)
+
+            self.cursor.execute("""UPDATE items SET
+                                       name =  :name,
+                                       function = :function,
+                                       weight = :weight,
+                                       volume = :volume,
+                                       price = :price,
+                                       amount = :amount
+                                   WHERE id = :id""",
+                                dict(new_values,
+                                     id=item_id,
+                                     name=item_values['name'],
+                                     function=item_values['function'],
+                                     amount=item_values['amount']))
+            self._publish('items', 'updated', [item_id])
+
+            self.cursor.executemany("""UPDATE pack_totals SET
+                                           weight = :weight,
+                                           volume = :volume,
+                                           price = :price
+                                       WHERE pack = :pack""",
+                                    totals_after)
+            self._publish('packs', 'totals',
+                          [totals['pack'] for totals in totals_after])
+            if item_values['amount'] != item_raw[3]:
+                self._mark_stale_packs_including_item({'id': item_id})
+
+        return impact
+
+    # the ids of the packs including the item with the id :id directly or
+    # through any of their sub-packs
+    _packs_including_item_query = """SELECT pack_closure.ancestor
+                                     FROM included_items
+                                     INNER JOIN pack_closure
+                                     ON pack_closure.descendant =
+                                         included_items.pack
+                                     WHERE included_items.item = :id"""
+
+    def _item_impact(self, item_values):
+        """
+        Returns the stored values of the item as a tuple, a dictionary with
+        the new fixed-point values of the item, the impact as described in
+        update_item_impact, and a list of dictionaries with the fixed-point
+        values after the change of every pack including the item for the
+        keys 'pack', 'weight', 'volume', and 'price'.
+        Nothing is changed, the missing or stale values of the packs are
+        calculated without storing them.
+        Raises a KeyError if there is no item with the id of item_values.
+        Needs to be called inside of a transaction.
+        """
+        item_id = item_values['id']
+        new_values = {attribute: to_fixed_point(item_values[attribute],
+                                                attribute)
+                      for attribute in decimal_places}
+
+        self.cursor.execute("""SELECT weight, volume, price, amount
+                               FROM items
+                               WHERE id = :id""",
+                            {'id': item_id})
+        item_raw = self.cursor.fetchone()
+        if item_raw is None:
+            raise KeyError(item_id)
+        deltas = {'weight': new_values['weight'] - item_raw[0],
+                  'volume': new_values['volume'] - item_raw[1],
+                  'price':  new_values['price'] - item_raw[2]}
+
+        self.cursor.execute("""WITH calculated (pack, weight, volume, price,
+                                                amount, stale) AS (""" +
+                            self._pack_totals_query(
+                                """{pack} IN (""" +
+                                self._packs_including_item_query +
+                                """)
+                                   AND {pack} NOT IN (
+                                       SELECT pack FROM pack_totals
+                                       WHERE NOT stale)""") + """),
+                               totals AS (
+                                   SELECT pack, weight, volume, price
+                                   FROM pack_totals
+                                   WHERE NOT stale
+                                   UNION ALL
+                                   SELECT pack, weight, volume, price
+                                   FROM calculated)
+                               SELECT packs.id, packs.name,
+                                   SUM(pack_closure.amount *
+                                       included_items.amount),
+                                   totals.weight,
+                                   totals.volume,
+                                   totals.price
+                               FROM included_items
+                               INNER JOIN pack_closure
+                               ON pack_closure.descendant =
+                                   included_items.pack
+                               INNER JOIN packs
+                               ON packs.id = pack_closure.ancestor
+                               INNER JOIN totals
+                               ON totals.pack = packs.id
+                               WHERE included_items.item = :id
+                               GROUP BY packs.id
+                               ORDER BY packs.id""",
+                            {'id': item_id})
+        packs_raw = self.cursor.fetchall()
+
+        impact = []
+        totals_after = []
+        for pack_id, name, quantity, weight, volume, price in packs_raw:
+            before = {'weight': weight, 'volume': volume, 'price': price}
+            after = {attribute: before[attribute] +
+                     quantity * deltas[attribute]
+                     for attribute in before}
+            totals_after.append(dict(after, pack=pack_id))
+            impact.append({
+                'id':       pack_id,
+                'name':     name,
+                'selected': quantity,
+                'before':   {attribute: from_fixed_point(value, attribute)
+                             for attribute, value in before.items()},
+                'after':    {attribute: from_fixed_point(value, attribute)
+                             for attribute, value in after.items()}})
+
+        return item_raw, new_values, impact, totals_after
+
+    @_invalidates_cache
     def delete_item(self, item_values):
         """
         This function deletes an existing instance (refered by its id)
@@ -172,10 +1444,20 @@ class Database:
         """
         # TODO: Maybe only mark as deleted and provide an additional function
         #       to irevertible delete it.
-        with self.conn:
+        with self.transaction():
+            self._mark_stale_packs_including_item(item_values)
+            if self._subscribers:
+                # the item is removed from the packs including it
+                self.cursor.execute("""SELECT pack FROM included_items
+                                       WHERE item = :id""",
+                                    {'id': item_values['id']})
+                self._publish('packs', 'contents',
+                              [row[0] for row in self.cursor.fetchall()])
             self.cursor.execute("""DELETE FROM items WHERE id = :id""",
-                                item_values)
+                                {'id': item_values['id']})
+            self._publish('items', 'deleted', [item_values['id']])
 
+    @_invalidates_cache
     def store_new_pack(self, pack_values, included_items, included_packs):
         """
         Stores a new pack in the database.
@@ -195,8 +1477,10 @@ class Database:
         must contain a value to the key 'id' which refers to an item in the
         database and a value to the key 'selected' which is an integer > 0
         which represents how many times the item is selected in a pack.
+        The id of the new pack is set for the key 'id' of pack_values.
+        Returns the number of included items and packs stored.
         """
-        with self.conn:
+        with self.transaction():
             pack_values['id'] = None
             self.cursor.execute("""INSERT INTO packs VALUES
                                    (:id,
@@ -205,35 +1489,22 @@ class Database:
                                 pack_values)
 
             pack_values['id'] = self.cursor.lastrowid
+            self._publish('packs', 'stored', [pack_values['id']])
 
-            # catch and handle empty packs
-            if included_items is None:
-                included_items = []
-
-            for item in included_items:
-                if item['selected'] > 0:
-                    self.cursor.execute("""INSERT INTO included_items VALUES
-                                           (:pack_id,
-                                            :item_id,
-                                            :selected)""",
-                                        {'pack_id': pack_values['id'],
-                                         'item_id': item['id'],
-                                         'selected': item['selected']})
-
-            # catch and handle empty packs
-            if included_packs is None:
-                included_packs = []
-
-            for pack in included_packs:
-                if pack['selected'] > 0:
-                    self.cursor.execute("""INSERT INTO included_packs VALUES
-                                           (:pack_id,
-                                            :included_pack_id,
-                                            :selected)""",
-                                        {'pack_id': pack_values['id'],
-                                         'included_pack_id': pack['id'],
-                                         'selected': pack['selected']})
+            self.cursor.execute("""INSERT INTO pack_closure VALUES
+                                   (:id,
+                                    :id,
+                                    1)""",
+                                pack_values)
+
+            changed_rows = self._write_included_items(pack_values,
+                                                      included_items)
+            changed_rows += self._write_included_packs(pack_values,
+                                                       included_packs)
 
+        return changed_rows
+
+    @_cached_read
     def get_all_packs(self):
         """
         Returns a list of dictionaries of all packs in the database.
@@ -242,23 +1513,20 @@ class Database:
         Pack's 'id' can be used later when referring to a pack
         read from the database using this function.
         """
-        with self.conn:
-            # get the raw item-data from the database
-            self.cursor.execute("""SELECT * FROM packs""")
-            packs_raw = self.cursor.fetchall()
-
-        # reserve space in list for all packs
-        packs = len(packs_raw)*[None]
+        return list(self.iter_packs())
 
-        # add a dictionary with attributes for every pack to the list
-        for index, pack_tuple in enumerate(packs_raw):
-            item = {'id':       pack_tuple[0],
-                    'name':     pack_tuple[1],
-                    'function': pack_tuple[2]}
-            packs[index] = item
-
-        return packs
+    def iter_packs(self, page_size=500, after_id=None, order_by='id'):
+        """
+        Generator yielding a dictionary for every pack in the database like
+        the ones returned by get_all_packs.
+        The packs are read page by page as described in iter_items.
+        """
+        return self._iter_keyset("""SELECT id, name, function
+                                    FROM packs""",
+                                 'packs', None, {},
+                                 page_size, after_id, order_by, Pack.from_row)
 
+    @_invalidates_cache
     def delete_pack(self, pack_values):
         """
         This function deletes an existing instance (refered by its id)
@@ -271,13 +1539,37 @@ class Database:
         """
         # TODO: Maybe only mark as deleted and provide an additional function
         #       to irevertible delete it.
-        with self.conn:
+        with self.transaction():
+            self._mark_stale_packs_including_pack(pack_values)
+            self._write_included_packs(pack_values, [])
+
+            # remove the pack from all the packs including it
+            self.cursor.execute("""SELECT pack, amount FROM included_packs
+                                   WHERE included_pack = :id""",
+                                {'id': pack_values['id']})
+            for including_pack, amount in self.cursor.fetchall():
+                self._shift_pack_closure(including_pack,
+                                         pack_values['id'],
+                                         -amount)
+                self._publish('packs', 'contents', [including_pack])
+            self.cursor.execute("""DELETE FROM included_packs WHERE
+                                   included_pack = :id""",
+                                {'id': pack_values['id']})
+
+            self.cursor.execute("""DELETE FROM pack_closure WHERE
+                                   ancestor = :id OR descendant = :id""",
+                                {'id': pack_values['id']})
             self.cursor.execute("""DELETE FROM packs WHERE id = :id""",
-                                pack_values)
+                                {'id': pack_values['id']})
             self.cursor.execute("""DELETE FROM included_items WHERE
                                    pack = :id""",
-                                pack_values)
+                                {'id': pack_values['id']})
+            self.cursor.execute("""DELETE FROM pack_totals WHERE
+                                   pack = :id""",
+                                {'id': pack_values['id']})
+            self._publish('packs', 'deleted', [pack_values['id']])
 
+    @_cached_read
     def get_attributes_pack(self, pack):
         """
         Returns a dictionary with all attributes of a pack from the database.
@@ -289,110 +1581,308 @@ class Database:
         be overwritten with the values from the database.
         The values for 'weight', 'volume', 'price', and 'amount' are calculated
         recursively from the included items and packs.
+        The values are cached in the table pack_totals and only recalculated
+        after a change to an included item or pack.
         The value for 'amount' stands for how many packs of these type can be
-        built with the available amounts of items.
+        built with the available amounts of items, it is None if the pack
+        does not include any items.
         """
-        with self.conn:
-            # get the raw data for all included items from the database
+        with self.transaction():
+            # get the raw data of the pack itself from the database
             self.cursor.execute("""SELECT * FROM packs
                                    WHERE id = :id""",
-                                pack)
+                                {'id': pack['id']})
             pack_raw = self.cursor.fetchone()
 
-        # create a dictionary with the known return values
+        # look up the calculated values for the pack
+        totals = self._get_pack_totals(pack)
+
         pack_values = {'id':       pack['id'],
                        'name':     pack_raw[1],
                        'function': pack_raw[2],
-                       'weight':   decimal.Decimal(0.0),
-                       'volume':   decimal.Decimal(0.0),
-                       'price':    decimal.Decimal(0.0),
-                       'amount':   "infinitely"}
-        # if amount is not changed later this means there is neither an item
-        # nor a pack included in this pack therefore in theory we can build
-        # infinitely many packs of this type
-
-        with self.conn:
-            # get the raw data for all included items from the database
-            self.cursor.execute("""SELECT * FROM items
-                                   INNER JOIN included_items
-                                   ON items.id = included_items.item
-                                   AND included_items.pack = :id""",
-                                pack)
-            included_items_raw = self.cursor.fetchall()
-
-        # go through all items and update pack_values accordingly
-        for index, included_item in enumerate(included_items_raw):
-            # read out the needed values from the raw data tuple
-            weight = decimal.Decimal(included_item[3])
-            volume = decimal.Decimal(included_item[4])
-            price = decimal.Decimal(included_item[5])
-            amount_available = included_item[6]
-            amount_selected = included_item[9]
-
-            # update values according to item's attribute and amount selected
-            pack_values['weight'] += amount_selected * weight
-            pack_values['price'] += amount_selected * price
-            pack_values['volume'] += amount_selected * volume
-            amount = amount_available // amount_selected
-
-            if index == 0:
-                pack_values['amount'] = amount
-            else:
-                pack_values['amount'] = min(amount,
-                                            pack_values['amount'])
+                       'weight':   totals['weight'],
+                       'volume':   totals['volume'],
+                       'price':    totals['price'],
+                       'amount':   totals['amount']}
 
-        with self.conn:
-            # get the raw data for all included packs from the database
-            self.cursor.execute("""SELECT * FROM packs
-                                   INNER JOIN included_packs
-                                   ON packs.id = included_packs.included_pack
-                                   AND included_packs.pack = :id""",
-                                pack)
-            included_packs_raw = self.cursor.fetchall()
-
-        # go through all packs and update pack_values accordingly
-        for index, included_pack in enumerate(included_packs_raw):
-            # read out the needed values from the raw data tuple
-            included_pack_dict = {'id': included_pack[0]}
-            # TODO: can the recursion be avoided for better efficiency?
-            sub_pack_values = self.get_attributes_pack(included_pack_dict)
-            weight = sub_pack_values['weight']
-            volume = sub_pack_values['volume']
-            price = sub_pack_values['price']
-            amount_available = sub_pack_values['amount']
-            amount_selected = included_pack[5]
-
-            # update values according to item's attribute and amount selected
-            pack_values['weight'] += amount_selected * weight
-            pack_values['price'] += amount_selected * price
-            pack_values['volume'] += amount_selected * volume
-
-            if amount_available == 'infinitely':
-                continue
+        return pack_values
 
-            # TODO: temp fix, remove as soon as amount is calculated correctly
-            if amount_available == 'not implemented':
-                continue
+    def _refresh_pack_totals(self, pack=None):
+        """
+        Calculates the weight, volume, price and buildable amount of the by
+        the argument specified pack and stores them in the table pack_totals.
+        The parameter pack is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        If pack is None the values of all packs in the database are
+        calculated.
+        Needs to be called inside of a transaction.
+        """
+        if pack is None:
+            condition = None
+        else:
+            condition = """{pack} = :id"""
 
-            # TODO: Calculation of amount does not properly work yet.
-            #       E. g. the case if two packs include the same unique item
-            #       and a the top-level pack includes both of these packs.
-            #       The amount will be one (each included pack can be built
-            #       once) but should be zero (since they cannot be built at
-            #       the same time with the available items).
-            amount = amount_available // amount_selected
+        self.cursor.execute("""INSERT OR REPLACE INTO pack_totals """ +
+                            self._pack_totals_query(condition),
+                            {'id': None if pack is None else pack['id']})
 
-            if pack_values['amount'] == 'infinitely':
-                pack_values['amount'] = amount
-            else:
-                pack_values['amount'] = min(amount,
-                                            pack_values['amount'])
+    def _refresh_stale_pack_totals(self):
+        """
+        Calculates the values of every pack whose values are missing or
+        marked as stale in the table pack_totals in a single statement and
+        stores them.
+        Needs to be called inside of a transaction.
+        """
+        self.cursor.execute("""INSERT OR REPLACE INTO pack_totals """ +
+                            self._pack_totals_query(
+                                """{pack} NOT IN (
+                                       SELECT pack FROM pack_totals
+                                       WHERE NOT stale)"""))
 
-        # TODO: temporary fix, remove as soon as amount is calculated correctly
-        pack_values['amount'] = 'not implemented'
+    def _pack_totals_query(self, condition=None):
+        """
+        Returns the query calculating the weight, volume, price and
+        buildable amount of the packs as rows of the table pack_totals.
+        The query is limited to the packs whose id fulfills the SQL
+        condition, in which '{pack}' stands for the id, or calculates all
+        packs if condition is None.
+        Every pack is flattened in a single pass to the total amount required
+        of every item included in it or any of its sub-packs, multiplied
+        along every path and summed over all paths as stored in the table
+        pack_closure. Items included by several sub-packs are required by
+        each of them, so they are counted once per sub-pack.
+        The weight, volume and price are summed up over the required items,
+        the buildable amount is the smallest number of times the available
+        amount of an item covers its required amount.
+        """
+        if condition is None:
+            outer_filter = inner_filter = ""
+        else:
+            outer_filter = """WHERE """ + condition.format(pack='packs.id')
+            inner_filter = """WHERE """ + condition.format(
+                    pack='pack_closure.ancestor')
+
+        return """SELECT packs.id,
+                      COALESCE(SUM(requirements.required * items.weight), 0),
+                      COALESCE(SUM(requirements.required * items.volume), 0),
+                      COALESCE(SUM(requirements.required * items.price), 0),
+                      MIN(MAX(items.amount, 0) /
+                          NULLIF(requirements.required, 0)),
+                      0
+                  FROM packs
+                  LEFT JOIN (
+                      SELECT pack_closure.ancestor AS pack,
+                          included_items.item AS item,
+                          SUM(pack_closure.amount *
+                              included_items.amount) AS required
+                      FROM pack_closure
+                      INNER JOIN included_items
+                      ON included_items.pack = pack_closure.descendant
+                      """ + inner_filter + """
+                      GROUP BY pack_closure.ancestor, included_items.item
+                  ) AS requirements
+                  ON requirements.pack = packs.id
+                  LEFT JOIN items
+                  ON items.id = requirements.item
+                  """ + outer_filter + """
+                  GROUP BY packs.id"""
+
+    def _get_pack_totals(self, pack):
+        """
+        Returns a dictionary with the values for 'weight', 'volume', 'price',
+        and 'amount' of the by the argument specified pack.
+        The parameter pack is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        The values are read from the table pack_totals, if they are missing
+        or marked as stale they are recalculated and stored first.
+        A connection refusing changes (query_only) recalculates them without
+        storing them.
+        """
+        with self.transaction():
+            self.cursor.execute("""SELECT weight, volume, price, amount, stale
+                                   FROM pack_totals
+                                   WHERE pack = :id""",
+                                {'id': pack['id']})
+            totals_raw = self.cursor.fetchone()
+
+            if totals_raw is None or totals_raw[4]:
+                if self.profile.get('query_only') == 'on':
+                    self.cursor.execute(
+                            self._pack_totals_query("""{pack} = :id"""),
+                            {'id': pack['id']})
+                    totals_raw = self.cursor.fetchone()[1:]
+                else:
+                    self._refresh_pack_totals(pack)
+                    self.cursor.execute("""SELECT weight, volume, price, amount
+                                           FROM pack_totals
+                                           WHERE pack = :id""",
+                                        {'id': pack['id']})
+                    totals_raw = self.cursor.fetchone()
+
+        return {'weight': from_fixed_point(totals_raw[0], 'weight'),
+                'volume': from_fixed_point(totals_raw[1], 'volume'),
+                'price':  from_fixed_point(totals_raw[2], 'price'),
+                'amount': totals_raw[3]}
+
+    @_cached_read
+    def get_buildable_amounts(self):
+        """
+        Returns a dictionary with the id of every pack in the database as key
+        to how many packs of this type can be built with the available
+        amounts of items, or None if the pack does not include any items.
+        The amounts of all the packs with missing or stale values in the
+        table pack_totals are recalculated in a single statement, so this is
+        fast enough to show the amount of every pack in a list.
+        """
+        with self.transaction():
+            if self.profile.get('query_only') == 'on':
+                self.cursor.execute(self._pack_totals_query())
+                return {row[0]: row[4] for row in self.cursor.fetchall()}
 
-        return pack_values
+            self._refresh_stale_pack_totals()
+            self.cursor.execute("""SELECT pack, amount FROM pack_totals""")
+            return dict(self.cursor.fetchall())
 
+    def _mark_stale_packs_including_item(self, item):
+        """
+        Marks the calculated values of every pack including the by the
+        argument specified item directly or indirectly as stale.
+        The parameter item is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        Needs to be called inside of the transaction changing the item.
+        """
+        if self._subscribers:
+            self.cursor.execute("""SELECT DISTINCT pack_closure.ancestor
+                                   FROM included_items
+                                   INNER JOIN pack_closure
+                                   ON pack_closure.descendant = included_items.pack
+                                   WHERE included_items.item = :id""",
+                                {'id': item['id']})
+            self._publish('packs', 'totals',
+                          [row[0] for row in self.cursor.fetchall()])
+        self.cursor.execute("""UPDATE pack_totals SET stale = 1
+                               WHERE pack IN (
+                                   SELECT pack_closure.ancestor
+                                   FROM included_items
+                                   INNER JOIN pack_closure
+                                   ON pack_closure.descendant = included_items.pack
+                                   WHERE included_items.item = :id)""",
+                            {'id': item['id']})
+
+    def _mark_stale_packs_including_pack(self, pack):
+        """
+        Marks the calculated values of the by the argument specified pack and
+        of every pack including it directly or indirectly as stale.
+        The parameter pack is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        Needs to be called inside of the transaction changing the pack.
+        """
+        if self._subscribers:
+            self.cursor.execute("""SELECT ancestor FROM pack_closure
+                                   WHERE descendant = :id""",
+                                {'id': pack['id']})
+            self._publish('packs', 'totals',
+                          [row[0] for row in self.cursor.fetchall()])
+        self.cursor.execute("""UPDATE pack_totals SET stale = 1
+                               WHERE pack IN (
+                                   SELECT ancestor FROM pack_closure
+                                   WHERE descendant = :id)""",
+                            {'id': pack['id']})
+
+    @_invalidates_cache
+    def rebuild_pack_totals(self):
+        """
+        Drops all the values stored in the table pack_totals and calculates
+        them from scratch for every pack in the database.
+        Returns a dictionary with the pack's id as key to a dictionary with
+        the values for 'weight', 'volume', 'price', and 'amount'.
+        Can be used to verify the values which are kept up to date
+        incrementally.
+        """
+        with self.transaction():
+            self.cursor.execute("""DELETE FROM pack_totals""")
+            self._refresh_pack_totals()
+            self._publish('packs', 'totals', [None])
+            self.cursor.execute("""SELECT pack, weight, volume, price, amount
+                                   FROM pack_totals""")
+            totals_raw = self.cursor.fetchall()
+
+        totals = {}
+        for totals_tuple in totals_raw:
+            totals[totals_tuple[0]] = {
+                'weight': from_fixed_point(totals_tuple[1], 'weight'),
+                'volume': from_fixed_point(totals_tuple[2], 'volume'),
+                'price':  from_fixed_point(totals_tuple[3], 'price'),
+                'amount': totals_tuple[4]}
+
+        return totals
+
+    def _shift_pack_closure(self, pack_id, included_pack_id, amount):
+        """
+        Updates the table pack_closure after the amount the pack with the id
+        included_pack_id is included in the pack with the id pack_id changed
+        by the integer amount (which is negative if it was reduced).
+        Every path leading over this inclusion from an ancestor of the pack
+        to a descendant of the included pack changes its amount accordingly.
+        Raises a ValueError if the inclusion would create a circular
+        reference.
+        Needs to be called inside of the transaction changing the pack.
+        """
+        if amount > 0:
+            self.cursor.execute("""SELECT EXISTS (
+                                       SELECT * FROM pack_closure
+                                       WHERE ancestor = :included_pack
+                                       AND descendant = :pack)""",
+                                {'pack': pack_id,
+                                 'included_pack': included_pack_id})
+            if self.cursor.fetchone()[0]:
+                raise ValueError('including pack ' + str(included_pack_id) +
+                                 ' in pack ' + str(pack_id) +
+                                 ' leads to a circular reference')
+
+        self.cursor.execute("""INSERT INTO pack_closure
+                               SELECT above.ancestor,
+                                   below.descendant,
+                                   above.amount * :amount * below.amount
+                               FROM pack_closure AS above, pack_closure AS below
+                               WHERE above.descendant = :pack
+                               AND below.ancestor = :included_pack
+                               ON CONFLICT (ancestor, descendant) DO UPDATE
+                               SET amount = amount + excluded.amount""",
+                            {'pack': pack_id,
+                             'included_pack': included_pack_id,
+                             'amount': amount})
+
+        if amount < 0:
+            self.cursor.execute("""DELETE FROM pack_closure
+                                   WHERE amount = 0
+                                   AND ancestor IN (
+                                       SELECT ancestor FROM pack_closure
+                                       WHERE descendant = :pack)
+                                   AND descendant IN (
+                                       SELECT descendant FROM pack_closure
+                                       WHERE ancestor = :included_pack)""",
+                                {'pack': pack_id,
+                                 'included_pack': included_pack_id})
+
+    @_invalidates_cache
+    def rebuild_pack_closure(self):
+        """
+        Drops all the rows of the table pack_closure and fills it from
+        scratch with the packs and included packs in the database.
+        Raises a ValueError if the database contains a circular reference.
+        """
+        with self.transaction():
+            self.cursor.execute("""DELETE FROM pack_closure""")
+            self.cursor.execute("""INSERT INTO pack_closure
+                                   SELECT id, id, 1 FROM packs""")
+
+            self.cursor.execute("""SELECT pack, included_pack, amount
+                                   FROM included_packs""")
+            for pack_id, included_pack, amount in self.cursor.fetchall():
+                self._shift_pack_closure(pack_id, included_pack, amount)
+
+    @_cached_read
     def get_items_in_pack(self, pack):
         """
         Returns a list of dictionaries, containing the attributes of all the
@@ -403,33 +1893,165 @@ class Database:
         key 'selected' which is an integer > 0 which represents how many times
         the item is selected in a pack.
         """
-        with self.conn:
-            # get the raw data for all included items from the database
-            self.cursor.execute("""SELECT * FROM items
-                                   INNER JOIN included_items
-                                   ON items.id = included_items.item
-                                   WHERE
-                                   included_items.pack = :id""",
-                                pack)
-            included_items_raw = self.cursor.fetchall()
-
-        # reserve space in list for all items
-        included_items = len(included_items_raw)*[None]
-
-        # add a dictionary with attributes for every item to the list
-        for index, item_tuple in enumerate(included_items_raw):
-            item = {'id':       item_tuple[0],
-                    'name':     item_tuple[1],
-                    'function': item_tuple[2],
-                    'weight':   decimal.Decimal(item_tuple[3]),
-                    'volume':   decimal.Decimal(item_tuple[4]),
-                    'price':    decimal.Decimal(item_tuple[5]),
-                    'amount':   item_tuple[6],
-                    'selected': item_tuple[9]}
-            included_items[index] = item
+        with self.transaction():
+            # get all included items from the database
+            cursor = self.conn.cursor()
+            cursor.row_factory = Item.from_row
+            cursor.execute("""SELECT items.id, name, function, weight,
+                                  volume, price, items.amount,
+                                  included_items.amount
+                              FROM items
+                              INNER JOIN included_items
+                              ON items.id = included_items.item
+                              WHERE
+                              included_items.pack = :id""",
+                           {'id': pack['id']})
+            included_items = cursor.fetchall()
 
         return included_items
 
+    @_cached_read
+    def explode_pack(self, pack, quantity=1):
+        """
+        Returns a list of dictionaries, containing the attributes of every
+        item needed to build quantity packs of the by the argument specified
+        type, with all the sub-packs flattened (bill of materials).
+        The parameter pack is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        The dictionaries have in addition to the standard values a value to
+        the key 'selected' which is the total amount of the item needed.
+        The amounts are multiplied through every level of included packs and
+        summed up over all the packs including the same item, in a single
+        query using the table pack_closure.
+        The items are ordered by their id.
+        """
+        return list(self.iter_explode_pack(pack, quantity))
+
+    def iter_explode_pack(self, pack, quantity=1, chunk_size=500):
+        """
+        Generator yielding a dictionary for every item needed to build
+        quantity packs of the by the argument specified type like the ones
+        returned by explode_pack.
+        The items are calculated by a single query and read chunk_size rows
+        at a time, so very large packs can be exploded without keeping all
+        of their items in memory.
+        """
+        # use a separate cursor, so the database can be used between
+        # reading two chunks
+        cursor = self.conn.cursor()
+        cursor.row_factory = Item.from_row
+        cursor.execute("""SELECT items.id, name, function, weight, volume,
+                              price, items.amount,
+                              requirements.required * :quantity
+                          FROM (
+                              SELECT included_items.item AS item,
+                                  SUM(pack_closure.amount *
+                                      included_items.amount) AS required
+                              FROM pack_closure
+                              INNER JOIN included_items
+                              ON included_items.pack = pack_closure.descendant
+                              WHERE pack_closure.ancestor = :id
+                              GROUP BY included_items.item
+                          ) AS requirements
+                          INNER JOIN items
+                          ON items.id = requirements.item
+                          ORDER BY items.id""",
+                       {'id': pack['id'], 'quantity': int(quantity)})
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                yield from chunk
+                if len(chunk) < chunk_size:
+                    break
+        finally:
+            cursor.close()
+
+    def need_to_buy(self, pack_quantities):
+        """
+        Returns a list of dictionaries, one for every item of which more is
+        needed than available to build all the given packs together.
+        The parameter pack_quantities is a dictionary with the id (integer)
+        of a pack as key to how many packs of this type are needed.
+        The packs are exploded like by explode_pack and the amounts required
+        of every item are summed up over all packs in a single query.
+        Every dictionary has the values of the item for the keys 'id',
+        'name', 'function', and 'price', the total amount needed for the key
+        'required', the available amount for the key 'available', the
+        amount to buy for the key 'missing', and the price of the amount to
+        buy for the key 'cost'.
+        The items are ordered by their id.
+        Raises a ValueError if a quantity is below 1 and a KeyError if there
+        is no pack with one of the ids.
+        """
+        for pack_id, quantity in pack_quantities.items():
+            if int(quantity) < 1:
+                raise ValueError('quantity of pack ' + str(pack_id) +
+                                 ' must be at least 1, not ' + str(quantity))
+
+        # the packs are given to SQLite as a single JSON array of
+        # [id, quantity] pairs
+        requested = json.dumps([[int(pack_id), int(quantity)]
+                                for pack_id, quantity
+                                in pack_quantities.items()])
+
+        with self.transaction():
+            self.cursor.execute("""SELECT value ->> 0
+                                   FROM json_each(:requested)
+                                   WHERE value ->> 0 NOT IN (
+                                       SELECT id FROM packs)
+                                   LIMIT 1""",
+                                {'requested': requested})
+            unknown = self.cursor.fetchone()
+            if unknown is not None:
+                raise KeyError(unknown[0])
+
+            self.cursor.execute("""WITH requested(pack, quantity) AS (
+                                       SELECT value ->> 0, value ->> 1
+                                       FROM json_each(:requested)),
+                                   requirements(item, required) AS (
+                                       SELECT included_items.item,
+                                           SUM(requested.quantity *
+                                               pack_closure.amount *
+                                               included_items.amount)
+                                       FROM requested
+                                       INNER JOIN pack_closure
+                                       ON pack_closure.ancestor =
+                                           requested.pack
+                                       INNER JOIN included_items
+                                       ON included_items.pack =
+                                           pack_closure.descendant
+                                       GROUP BY included_items.item)
+                                   SELECT items.id,
+                                       items.name,
+                                       items.function,
+                                       items.price,
+                                       requirements.required,
+                                       items.amount,
+                                       requirements.required -
+                                           MAX(items.amount, 0)
+                                   FROM requirements
+                                   INNER JOIN items
+                                   ON items.id = requirements.item
+                                   WHERE requirements.required > items.amount
+                                   ORDER BY items.id""",
+                                {'requested': requested})
+            shortfall_raw = self.cursor.fetchall()
+
+        shortfall = []
+        for item_id, name, function, price, required, available, missing \
+                in shortfall_raw:
+            shortfall.append({'id':        item_id,
+                              'name':      name,
+                              'function':  function,
+                              'price':     from_fixed_point(price, 'price'),
+                              'required':  required,
+                              'available': available,
+                              'missing':   missing,
+                              'cost':      from_fixed_point(missing * price,
+                                                            'price')})
+        return shortfall
+
+    @_cached_read
     def get_items_not_in_pack(self, pack):
         """
         Returns a list of dictionaries, containing the attributes of all the
@@ -439,40 +2061,29 @@ class Database:
         For convenience the returned dictionaries have a value to the key
         'selected' which is initialised with 0.
         """
-        with self.conn:
-            # get the raw data for all not included items from the database
-            self.cursor.execute("""SELECT DISTINCT id, name, function, weight,
-                                       volume, price, items.amount
-                                   FROM items
-                                   LEFT JOIN included_items
-                                   ON items.id = included_items.item
-                                   EXCEPT
-                                   SELECT DISTINCT id, name, function, weight,
-                                       volume, price, items.amount
-                                   FROM items
-                                   LEFT JOIN included_items
-                                   ON items.id = included_items.item
-                                   WHERE included_items.pack = :id""",
-                                pack)
-            not_included_items_raw = self.cursor.fetchall()
-
-        # reserve space in list for all items
-        not_included_items = len(not_included_items_raw)*[None]
-
-        # add a dictionary with attributes for every item to the list
-        for index, item_tuple in enumerate(not_included_items_raw):
-            item = {'id':              item_tuple[0],
-                    'name':            item_tuple[1],
-                    'function':        item_tuple[2],
-                    'weight':          decimal.Decimal(item_tuple[3]),
-                    'volume':          decimal.Decimal(item_tuple[4]),
-                    'price':           decimal.Decimal(item_tuple[5]),
-                    'amount':          item_tuple[6],
-                    'selected': 0}
-            not_included_items[index] = item
-
-        return not_included_items
+        return list(self.iter_items_not_in_pack(pack))
 
+    def iter_items_not_in_pack(self, pack, page_size=500, after_id=None,
+                               order_by='id'):
+        """
+        Generator yielding a dictionary for every item not included in the by
+        the argument specified pack like the ones returned by
+        get_items_not_in_pack.
+        The items are read page by page as described in iter_items.
+        """
+        # get all not included items from the database
+        return self._iter_keyset(
+                """SELECT id, name, function, weight, volume, price, amount, 0
+                   FROM items""",
+                'items',
+                """NOT EXISTS (
+                       SELECT * FROM included_items
+                       WHERE included_items.pack = :id
+                       AND included_items.item = items.id)""",
+                {'id': pack['id']},
+                page_size, after_id, order_by, Item.from_row)
+
+    @_invalidates_cache
     def update_pack(self, pack_values, included_items, included_packs):
         """
         This function modifies an existing instance (specified by it's id in
@@ -491,50 +2102,151 @@ class Database:
         to the including item.
         The value to the key 'selected' is an integer > 0 which represents how
         many times the item is selected in a pack.
+        Only the included items and packs which changed are written.
+        Returns the number of included items and packs inserted, updated,
+        or deleted.
         """
-        with self.conn:
+        with self.transaction():
             self.cursor.execute("""UPDATE packs SET
                                        name =  :name,
                                        function = :function
                                    WHERE id = :id""",
-                                pack_values)
-
-            self.cursor.execute("""DELETE FROM included_items WHERE
-                                   pack = :id""",
-                                pack_values)
+                                {'id': pack_values['id'],
+                                 'name': pack_values['name'],
+                                 'function': pack_values['function']})
+            self._publish('packs', 'updated', [pack_values['id']])
 
-            self.cursor.execute("""DELETE FROM included_packs WHERE
-                                   pack = :id""",
-                                pack_values)
+            changed_rows = self._write_included_items(pack_values,
+                                                      included_items)
+            changed_rows += self._write_included_packs(pack_values,
+                                                       included_packs)
 
-            # catch and handle empty packs
-            if included_items is None:
-                included_items = []
-
-            for item in included_items:
-                if item['selected'] > 0:
-                    self.cursor.execute("""INSERT INTO included_items VALUES
-                                           (:pack_id,
-                                            :item_id,
-                                            :selected)""",
-                                        {'pack_id': pack_values['id'],
-                                         'item_id': item['id'],
-                                         'selected': item['selected']})
-
-            # catch and handle empty packs
-            if included_packs is None:
-                included_packs = []
-
-            for pack in included_packs:
-                if pack['selected'] > 0:
-                    self.cursor.execute("""INSERT INTO included_packs VALUES
-                                           (:pack_id,
-                                            :included_pack,
-                                            :selected)""",
-                                        {'pack_id': pack_values['id'],
-                                         'included_pack': pack['id'],
-                                         'selected': pack['selected']})
+        return changed_rows
 
+    def _write_included_items(self, pack, included_items):
+        """
+        Changes the items included in the by the argument specified pack to
+        the ones in included_items.
+        The parameter pack is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        The parameter included_items is a list of dictionaries with a value
+        for the keys 'id' and 'selected' as described in update_pack.
+        Only the rows of the items whose amount changed are written, in
+        batches of inserts, updates and deletes.
+        Returns the number of rows which changed.
+        Needs to be called inside of the transaction changing the pack.
+        """
+        self.cursor.execute("""SELECT item, amount FROM included_items
+                               WHERE pack = :id""",
+                            {'id': pack['id']})
+        current_amounts = dict(self.cursor.fetchall())
+
+        # catch and handle empty packs
+        if included_items is None:
+            included_items = []
+
+        new_amounts = {}
+        for item in included_items:
+            if item['selected'] > 0:
+                new_amounts[item['id']] = item['selected']
+
+        removed_items = [{'pack': pack['id'], 'item': item_id}
+                         for item_id in current_amounts
+                         if item_id not in new_amounts]
+        changed_items = [{'pack': pack['id'], 'item': item_id, 'amount': amount}
+                         for item_id, amount in new_amounts.items()
+                         if current_amounts.get(item_id) != amount]
+
+        if not removed_items and not changed_items:
+            return 0
+
+        self._mark_stale_packs_including_pack(pack)
+        self._publish('packs', 'contents', [pack['id']])
+
+        self.cursor.executemany("""DELETE FROM included_items
+                                   WHERE pack = :pack AND item = :item""",
+                                removed_items)
+        self.cursor.executemany("""INSERT INTO included_items VALUES
+                                   (:pack,
+                                    :item,
+                                    :amount)
+                                   ON CONFLICT (pack, item) DO UPDATE
+                                   SET amount = excluded.amount""",
+                                changed_items)
+
+        return len(removed_items) + len(changed_items)
+
+    def _write_included_packs(self, pack, included_packs):
+        """
+        Changes the packs included in the by the argument specified pack to
+        the ones in included_packs and updates the table pack_closure.
+        The parameter pack is a dictionary with an integer value for the key
+        'id' representing it's internal reference for the database.
+        The parameter included_packs is a list of dictionaries with a value
+        for the keys 'id' and 'selected' as described in update_pack.
+        Only the rows of the packs whose amount changed are written, in
+        batches of inserts, updates and deletes.
+        Returns the number of rows which changed.
+        Raises a ValueError if an included pack leads to a circular reference.
+        Needs to be called inside of the transaction changing the pack.
+        """
+        self.cursor.execute("""SELECT included_pack, amount
+                               FROM included_packs
+                               WHERE pack = :id""",
+                            {'id': pack['id']})
+        current_amounts = dict(self.cursor.fetchall())
+
+        # catch and handle empty packs
+        if included_packs is None:
+            included_packs = []
+
+        new_amounts = {}
+        for included_pack in included_packs:
+            if included_pack['selected'] > 0:
+                new_amounts[included_pack['id']] = included_pack['selected']
+
+        removed_packs = [{'pack': pack['id'], 'included_pack': pack_id}
+                         for pack_id in current_amounts
+                         if pack_id not in new_amounts]
+        changed_packs = [{'pack': pack['id'],
+                          'included_pack': pack_id,
+                          'amount': amount}
+                         for pack_id, amount in new_amounts.items()
+                         if current_amounts.get(pack_id) != amount]
+
+        if not removed_packs and not changed_packs:
+            return 0
+
+        self._mark_stale_packs_including_pack(pack)
+        self._publish('packs', 'contents', [pack['id']])
+
+        # remove paths before adding new ones, so the circular reference
+        # check only sees the inclusions which are kept
+        for row in removed_packs:
+            self._shift_pack_closure(pack['id'],
+                                     row['included_pack'],
+                                     -current_amounts[row['included_pack']])
+        for row in changed_packs:
+            self._shift_pack_closure(pack['id'],
+                                     row['included_pack'],
+                                     row['amount'] -
+                                     current_amounts.get(row['included_pack'], 0))
+
+        self.cursor.executemany("""DELETE FROM included_packs
+                                   WHERE pack = :pack
+                                   AND included_pack = :included_pack""",
+                                removed_packs)
+        self.cursor.executemany("""INSERT INTO included_packs VALUES
+                                   (:pack,
+                                    :included_pack,
+                                    :amount)
+                                   ON CONFLICT (pack, included_pack) DO UPDATE
+                                   SET amount = excluded.amount""",
+                                changed_packs)
+
+        return len(removed_packs) + len(changed_packs)
+
+    @_cached_read
     def get_packs_in_pack(self, pack):
         """
         Returns a list of dictionaries, containing the attributes of all the
@@ -545,45 +2257,110 @@ class Database:
         key 'selected' which is an integer > 0 which represents how many times
         the pack is selected in a pack.
         """
-        with self.conn:
-            # get the raw data for all included packs from the database
-            self.cursor.execute("""SELECT * FROM packs
-                                   INNER JOIN included_packs
-                                   ON packs.id = included_packs.included_pack
-                                   WHERE
-                                   included_packs.pack = :id""",
-                                pack)
-            included_packs_raw = self.cursor.fetchall()
-
-        # reserve space in list for all packs
-        included_packs = len(included_packs_raw)*[None]
-
-        # add a dictionary with attributes for every pack to the list
-        for index, pack_tuple in enumerate(included_packs_raw):
-            pack = {'id':       pack_tuple[0],
-                    'name':     pack_tuple[1],
-                    'function': pack_tuple[2],
-                    'selected': pack_tuple[5]}
-            included_packs[index] = pack
+        with self.transaction():
+            # get all included packs from the database
+            cursor = self.conn.cursor()
+            cursor.row_factory = Pack.from_row
+            cursor.execute("""SELECT id, name, function, included_packs.amount
+                              FROM packs
+                              INNER JOIN included_packs
+                              ON packs.id = included_packs.included_pack
+                              WHERE
+                              included_packs.pack = :id""",
+                           {'id': pack['id']})
+            included_packs = cursor.fetchall()
 
         return included_packs
 
+    @_cached_read
     def leads_to_circular_reference(self, pack, pack_to_include):
         """
         Returns True if pack_to_include or any of it's sub-packs contains pack.
         If and only if this function returns False it is save to
         include pack_to_include into pack, without breaking the program later.
         """
-        if pack['id'] == pack_to_include['id']:
-            return True
-        else:
-            included_packs = self.get_packs_in_pack(pack_to_include)
-            for sub_pack in included_packs:
-                # TODO: can the recursion be avoided for better efficiency?
-                if self.leads_to_circular_reference(pack, sub_pack):
-                    return True
-            return False
-
+        with self.transaction():
+            self.cursor.execute("""SELECT EXISTS (
+                                       SELECT * FROM pack_closure
+                                       WHERE ancestor = :pack_to_include
+                                       AND descendant = :pack)""",
+                                {'pack': pack['id'],
+                                 'pack_to_include': pack_to_include['id']})
+            leads_to_circular_reference = self.cursor.fetchone()[0]
+
+        # a pack always leads to a circular reference with itself
+        return bool(leads_to_circular_reference) or \
+            pack['id'] == pack_to_include['id']
+
+    def where_used(self, row, kind):
+        """
+        Returns a list of dictionaries, containing the attributes of every
+        pack including the by the argument row specified item or pack
+        directly or through any of its sub-packs.
+        The parameter kind is 'item' or 'pack' and tells what row is, which
+        needs an integer value for the key 'id' representing it's internal
+        reference for the database.
+        The dictionaries have in addition to the standard values a value to
+        the key 'selected' which is how many times the item or pack is
+        included in the pack, multiplied along every path and summed up over
+        all paths.
+        The packs are looked up in the table pack_closure by the indexes on
+        the included items and packs, so the time needed depends on the
+        number of packs found and not on the number of packs in the database.
+        The packs are ordered by their id.
+        """
+        if kind == 'item':
+            return self._get_packs_including_item(row)
+        if kind == 'pack':
+            return self._get_packs_including_pack(row)
+        raise ValueError("kind must be 'item' or 'pack', not " + repr(kind))
+
+    @_cached_read
+    def _get_packs_including_item(self, item):
+        """
+        Returns the packs including the item like described in where_used.
+        """
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.row_factory = Pack.from_row
+            cursor.execute("""SELECT packs.id, packs.name, packs.function,
+                                  SUM(pack_closure.amount *
+                                      included_items.amount)
+                              FROM included_items
+                              INNER JOIN pack_closure
+                              ON pack_closure.descendant = included_items.pack
+                              INNER JOIN packs
+                              ON packs.id = pack_closure.ancestor
+                              WHERE included_items.item = :id
+                              GROUP BY packs.id
+                              ORDER BY packs.id""",
+                           {'id': item['id']})
+            including_packs = cursor.fetchall()
+
+        return including_packs
+
+    @_cached_read
+    def _get_packs_including_pack(self, pack):
+        """
+        Returns the packs including the pack like described in where_used.
+        """
+        with self.transaction():
+            cursor = self.conn.cursor()
+            cursor.row_factory = Pack.from_row
+            cursor.execute("""SELECT packs.id, packs.name, packs.function,
+                                  pack_closure.amount
+                              FROM pack_closure
+                              INNER JOIN packs
+                              ON packs.id = pack_closure.ancestor
+                              WHERE pack_closure.descendant = :id
+                              AND pack_closure.ancestor != :id
+                              ORDER BY packs.id""",
+                           {'id': pack['id']})
+            including_packs = cursor.fetchall()
+
+        return including_packs
+
+    @_cached_read
     def get_packs_not_in_pack(self, pack):
         """
         Returns a list of dictionaries, containing the attributes of all the
@@ -593,32 +2370,441 @@ class Database:
         For convenience the returned dictionaries have a value to the key
         'selected' which is initialised with 0.
         """
-        with self.conn:
-            # get the raw data for all not included packs from the database
-            self.cursor.execute("""SELECT DISTINCT id, name, function
-                                   FROM packs
-                                   LEFT JOIN included_packs
-                                   ON packs.id = included_packs.included_pack
-                                   EXCEPT
-                                   SELECT DISTINCT id, name, function
-                                   FROM packs
-                                   LEFT JOIN included_packs
-                                   ON packs.id = included_packs.included_pack
-                                   WHERE included_packs.pack = :id""",
-                                pack)
-            not_included_packs_raw = self.cursor.fetchall()
-            not_included_packs = []
-
-        # add a dictionary with attributes for every pack to the list
-        for index, pack_tuple in enumerate(not_included_packs_raw):
-            pack_to_select = {'id':              pack_tuple[0],
-                              'name':            pack_tuple[1],
-                              'function':        pack_tuple[2],
-                              'selected': 0}
-            if not self.leads_to_circular_reference(pack, pack_to_select):
-                not_included_packs.append(pack_to_select)
-
-        return not_included_packs
+        return list(self.iter_packs_not_in_pack(pack))
+
+    def iter_packs_not_in_pack(self, pack, page_size=500, after_id=None,
+                               order_by='id'):
+        """
+        Generator yielding a dictionary for every pack not included in the by
+        the argument specified pack like the ones returned by
+        get_packs_not_in_pack.
+        The packs are read page by page as described in iter_items.
+        """
+        # get all packs which are neither included in the pack
+        # nor would lead to a circular reference if included
+        return self._iter_keyset(
+                """SELECT id, name, function, 0
+                   FROM packs""",
+                'packs',
+                """NOT EXISTS (
+                       SELECT * FROM included_packs
+                       WHERE included_packs.pack = :id
+                       AND included_packs.included_pack = packs.id)
+                   AND NOT EXISTS (
+                       SELECT * FROM pack_closure
+                       WHERE pack_closure.ancestor = packs.id
+                       AND pack_closure.descendant = :id)
+                   AND packs.id != :id""",
+                {'id': pack['id']},
+                page_size, after_id, order_by, Pack.from_row)
+
+    @_cached_read
+    def search(self, query, limit=50):
+        """
+        Returns a list of the items and packs whose name or function contain
+        every word of the string query, at most limit of them, the best
+        matches first.
+        Every word of query also matches the words starting with it, so
+        the results can be shown while the user is still typing.
+        A match in the name ranks higher than one in the function (see
+        search_weights). If query matches more than search_rank_limit rows
+        of a table, the rows found first are returned instead of ranking
+        all of them.
+        The items are returned as Item and the packs as Pack, e.g. use
+        isinstance(row, Pack) to tell them apart.
+        """
+        rows = [(row[0], Item(*row[1:]))
+                for row in self._search('items', query, limit)]
+        rows += [(row[0], Pack(*row[1:]))
+                 for row in self._search('packs', query, limit)]
+        rows.sort(key=lambda row: row[0])
+        return [row for rank, row in rows[:limit]]
+
+    @_cached_read
+    def search_items(self, query, limit=50):
+        """
+        Returns a list of dictionaries of the items matching the string
+        query like the ones returned by get_all_items, at most limit of
+        them, the best matches first.
+        The matching items are described in search.
+        """
+        return [Item(*row[1:]) for row in self._search('items', query, limit)]
+
+    @_cached_read
+    def search_packs(self, query, limit=50):
+        """
+        Returns a list of dictionaries of the packs matching the string
+        query like the ones returned by get_all_packs, at most limit of
+        them, the best matches first.
+        The matching packs are described in search.
+        """
+        return [Pack(*row[1:]) for row in self._search('packs', query, limit)]
+
+    def _search(self, table, query, limit):
+        """
+        Returns the rows of the table ('items' or 'packs') matching query as
+        described in search, each row as a tuple of the rank, lower is
+        better, followed by the columns of the table.
+        Uses the full-text index if SQLite supports FTS5, otherwise every
+        row of the table is compared with the words of query.
+        """
+        words = re.findall(r'\w+', query)
+        if not words or limit < 1:
+            return []
+
+        if table == 'items':
+            columns = """items.id, items.name, items.function, items.weight,
+                         items.volume, items.price, items.amount"""
+        else:
+            columns = """packs.id, packs.name, packs.function"""
+
+        if self._full_text_search:
+            # every word is quoted, so it is never read as an operator
+            parameters = {'match': ' '.join('"' + word + '"*'
+                                            for word in words),
+                          'name_weight': search_weights[0],
+                          'function_weight': search_weights[1],
+                          'rank_limit': search_rank_limit,
+                          'limit': limit}
+            with self.transaction():
+                self.cursor.execute("""SELECT COUNT(*) FROM (
+                                           SELECT rowid FROM """ + table +
+                                    """_search
+                                           WHERE """ + table + """_search
+                                           MATCH :match
+                                           LIMIT :rank_limit + 1)""",
+                                    parameters)
+                if self.cursor.fetchone()[0] > search_rank_limit:
+                    matches = """SELECT rowid, 0 AS rank
+                                 FROM """ + table + """_search
+                                 WHERE """ + table + """_search MATCH :match
+                                 LIMIT :limit"""
+                else:
+                    matches = """SELECT rowid,
+                                     bm25(""" + table + """_search,
+                                          :name_weight,
+                                          :function_weight) AS rank
+                                 FROM """ + table + """_search
+                                 WHERE """ + table + """_search MATCH :match
+                                 ORDER BY rank
+                                 LIMIT :limit"""
+                # only the best matches are joined with the table
+                self.cursor.execute("""SELECT matches.rank, """ + columns + """
+                                       FROM (""" + matches + """) AS matches
+                                       JOIN """ + table + """
+                                       ON """ + table + """.id = matches.rowid
+                                       ORDER BY matches.rank, """ + table +
+                                    """.id""",
+                                    parameters)
+                return self.cursor.fetchall()
+
+        # the names starting with the first word rank before the others
+        parameters = {'limit': limit,
+                      'prefix': words[0].replace('_', '\\_') + '%'}
+        conditions = []
+        for index, word in enumerate(words):
+            parameters['word' + str(index)] = \
+                '%' + word.replace('_', '\\_') + '%'
+            conditions.append("""(name LIKE :word""" + str(index) +
+                              """ ESCAPE '\\'
+                                 OR function LIKE :word""" + str(index) +
+                              """ ESCAPE '\\')""")
+        with self.transaction():
+            self.cursor.execute("""SELECT name NOT LIKE :prefix ESCAPE '\\',
+                                       """ + columns + """
+                                   FROM """ + table + """
+                                   WHERE """ + """ AND """.join(conditions) +
+                                """ ORDER BY 1, name, id
+                                   LIMIT :limit""",
+                                parameters)
+            return self.cursor.fetchall()
+
+    @_invalidates_cache
+    def import_items(self, records, chunk_size=1000):
+        """
+        Stores the items given by the iterable records in the database.
+        records can be any iterable (e.g. a generator from packlist_utils
+        reading a csv or json-lines file) of dictionaries with a value for the
+        keys 'name', 'function', 'weight', 'volume', 'price', and 'amount'.
+        The values may also be given as strings.
+        A record may have a value for the key 'key', an external key which
+        can be used to refer to the item when importing packs.
+        The records are consumed one by one and stored in a transaction for
+        every chunk of chunk_size records, so the memory used does not depend
+        on the number of records.
+        A record which cannot be read (also a RecordError yielded by the
+        readers of packlist_utils) or holds a value SQLite cannot store is
+        skipped without aborting the import.
+        Returns a dictionary with the number of imported items for the key
+        'imported', a list of (row number, error message) tuples of the
+        skipped records for the key 'errors', and a dictionary with the
+        external keys to the item's id for the key 'keys'.
+        """
+        report = {'imported': 0, 'errors': [], 'keys': {}}
+        rows = enumerate(records, start=1)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            items = []
+            keys = []
+            for row_number, record in chunk:
+                try:
+                    if isinstance(record, Exception):
+                        # a row the reader could not read
+                        raise record
+                    item_values_for_db = {
+                        'id':       None,
+                        'name':     record['name'],
+                        'function': record['function'],
+                        'weight':   to_fixed_point(record['weight'], 'weight'),
+                        'volume':   to_fixed_point(record['volume'], 'volume'),
+                        'price':    to_fixed_point(record['price'], 'price'),
+                        'amount':   int(record['amount'])}
+                    for attribute, value in item_values_for_db.items():
+                        if attribute != 'id':
+                            _storable_value(value, attribute)
+                except (KeyError, TypeError, ValueError,
+                        decimal.InvalidOperation) as error:
+                    report['errors'].append((row_number,
+                                             type(error).__name__ + ': ' +
+                                             str(error)))
+                    continue
+                items.append(item_values_for_db)
+                keys.append(record.get('key'))
+
+            with self.transaction():
+                self.cursor.execute("""SELECT COALESCE(MAX(id), 0)
+                                       FROM items""")
+                last_id = self.cursor.fetchone()[0]
+                for offset, item_values_for_db in enumerate(items, start=1):
+                    item_values_for_db['id'] = last_id + offset
+
+                self.cursor.executemany("""INSERT INTO items VALUES
+                                           (:id,
+                                            :name,
+                                            :function,
+                                            :weight,
+                                            :volume,
+                                            :price,
+                                            :amount)""",
+                                        items)
+                self._publish('items', 'stored',
+                              [item['id'] for item in items])
+
+            report['imported'] += len(items)
+            for key, item_values_for_db in zip(keys, items):
+                if key not in (None, ''):
+                    report['keys'][key] = item_values_for_db['id']
+
+        return report
+
+    @_invalidates_cache
+    def import_packs(self, records, item_keys=None, chunk_size=1000):
+        """
+        Stores the packs given by the iterable records in the database.
+        records can be any iterable (e.g. a generator from packlist_utils
+        reading a csv or json-lines file) of dictionaries with a value for the
+        keys 'name' and 'function' and optionally 'items' and 'packs'.
+        The values for 'items' and 'packs' list the included items and packs
+        in one of the forms accepted by packlist_utils.parse_included.
+        Included items are referred to by their id, their external key in the
+        dictionary item_keys (e.g. the keys returned by import_items), or
+        their name.
+        Included packs are referred to by their id, the external key given
+        for the key 'key' of a previous record, or their name, also if it was
+        stored by a previous record of the same import.
+        The records are consumed one by one and stored in a transaction for
+        every chunk of chunk_size records, so the memory used does not depend
+        on the number of records.
+        A record which cannot be read (also a RecordError yielded by the
+        readers of packlist_utils), holds a value SQLite cannot store, or
+        refers to an unknown or ambiguous item or pack is skipped without
+        aborting the import.
+        Returns a dictionary with the number of imported packs for the key
+        'imported', a list of (row number, error message) tuples of the
+        skipped records for the key 'errors', and a dictionary with the
+        external keys to the pack's id for the key 'keys'.
+        """
+        if item_keys is None:
+            item_keys = {}
+
+        report = {'imported': 0, 'errors': [], 'keys': {}}
+        rows = enumerate(records, start=1)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            with self.transaction():
+                for row_number, record in chunk:
+                    try:
+                        if isinstance(record, Exception):
+                            # a row the reader could not read
+                            raise record
+                        pack_values = {'id':       None,
+                                       'name':     record['name'],
+                                       'function': record['function']}
+                        included_items = self._resolve_references(
+                                'items',
+                                item_keys,
+                                record.get('items'))
+                        included_packs = self._resolve_references(
+                                'packs',
+                                report['keys'],
+                                record.get('packs'))
+                        for attribute in ['name', 'function']:
+                            _storable_value(pack_values[attribute],
+                                            attribute)
+                        for included in included_items + included_packs:
+                            _storable_value(included['selected'], 'amount')
+                    except (KeyError, TypeError, ValueError) as error:
+                        report['errors'].append((row_number,
+                                                 type(error).__name__ + ': ' +
+                                                 str(error)))
+                        continue
+
+                    self.cursor.execute("""INSERT INTO packs VALUES
+                                           (:id,
+                                            :name,
+                                            :function)""",
+                                        pack_values)
+                    pack_values['id'] = self.cursor.lastrowid
+                    self._publish('packs', 'stored', [pack_values['id']])
+                    self.cursor.execute("""INSERT INTO pack_closure VALUES
+                                           (:id,
+                                            :id,
+                                            1)""",
+                                        pack_values)
+                    self._write_included_items(pack_values, included_items)
+                    self._write_included_packs(pack_values, included_packs)
+
+                    report['imported'] += 1
+                    if record.get('key') not in (None, ''):
+                        report['keys'][record['key']] = pack_values['id']
+
+        return report
+
+    def _resolve_references(self, table, keys, included):
+        """
+        Returns a list of dictionaries with a value for the keys 'id' and
+        'selected' as accepted by update_pack for the included items or packs
+        given in a record to import.
+        The parameter table is either 'items' or 'packs'.
+        References are resolved by id, by external key in the dictionary keys,
+        or by name.
+        Raises a KeyError if a reference is unknown and a ValueError if a
+        name is ambiguous.
+        Needs to be called inside of the transaction importing the record.
+        """
+        amounts = {}
+        for reference, amount in packlist_utils.parse_included(included):
+            if reference in keys:
+                row_id = keys[reference]
+            elif str(reference) in keys:
+                # external keys read from csv-files are strings
+                row_id = keys[str(reference)]
+            elif isinstance(reference, int):
+                self.cursor.execute("""SELECT id FROM """ + table + """
+                                       WHERE id = ?""",
+                                    (reference,))
+                if self.cursor.fetchone() is None:
+                    raise KeyError(reference)
+                row_id = reference
+            else:
+                self.cursor.execute("""SELECT id FROM """ + table + """
+                                       WHERE name = ?
+                                       LIMIT 2""",
+                                    (reference,))
+                found = self.cursor.fetchall()
+                if not found:
+                    raise KeyError(reference)
+                if len(found) > 1:
+                    raise ValueError('name ' + repr(reference) +
+                                     ' is ambiguous')
+                row_id = found[0][0]
+
+            amounts[row_id] = amounts.get(row_id, 0) + amount
+
+        return [{'id': row_id, 'selected': amount}
+                for row_id, amount in amounts.items()]
+
+
+class DatabasePool:
+    def __init__(self, db_name, readers=4, read_cache_size=128):
+        """
+        Pool of connections to the database in the file db_name, so it can be
+        used by several threads at the same time, e.g. to calculate or export
+        data in the background while the user interface stays responsive.
+        There is one Database for writing, used by one thread at a time, and
+        the number readers of Databases for reading, using the profile
+        'read-only-browse'. The database uses write-ahead logging, so reading
+        is possible while another thread is writing.
+        Every Database of the pool has its own read cache with
+        read_cache_size results.
+        A database in memory (':memory:') cannot be shared by connections.
+        """
+        if db_name == ':memory:' or db_name == '':
+            raise ValueError('a pool needs a database in a file')
+        if readers < 1:
+            raise ValueError('a pool needs at least one reader')
+
+        self.db_name = db_name
+        # the writer creates the schema and sets the journal_mode to 'wal',
+        # which is stored in the file and used by the readers as well
+        self._writer = Database(db_name,
+                                read_cache_size=read_cache_size,
+                                check_same_thread=False)
+        self._write_lock = threading.Lock()
+        self._n_readers = readers
+        self._readers = queue.LifoQueue()
+        for i in range(readers):
+            self._readers.put(Database(db_name,
+                                       profile='read-only-browse',
+                                       read_cache_size=read_cache_size,
+                                       check_same_thread=False))
+
+    @contextlib.contextmanager
+    def read(self):
+        """
+        Context manager giving a Database for reading in a transaction,
+        so all the reads inside of it see the same state of the database,
+        no matter what is written by other threads in the meantime.
+        Waits until one of the readers of the pool is free.
+        Changing the database raises sqlite3.OperationalError.
+        """
+        db = self._readers.get()
+        try:
+            with db.transaction():
+                yield db
+        finally:
+            self._readers.put(db)
+
+    @contextlib.contextmanager
+    def write(self):
+        """
+        Context manager giving the Database for writing in a transaction,
+        which is committed at the end or rolled back if an exception is
+        raised, so the changes inside of it are seen by the readers all
+        together or not at all.
+        Waits until no other thread is writing, so writing is serialized.
+        """
+        with self._write_lock:
+            with self._writer.transaction(begin='IMMEDIATE'):
+                yield self._writer
+
+    def close(self):
+        """
+        Closes all the connections of the pool, waiting until the readers
+        and the writer are not used anymore.
+        """
+        with self._write_lock:
+            self._writer.close()
+        for i in range(self._n_readers):
+            self._readers.get().close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Describes a local HTTP service exchanging JSON, so several users or programs
+can share one database at the same time.
+This module uses the database interface module to interact with the database
+and only needs the standard library.
+Run: 'python http_interface.py [name of the database] [port]'
+
+The service offers the following endpoints, the values in the bodies are
+the arguments of the corresponding methods of database_interface.Database:
+    GET    /items                   all items
+    POST   /items                   store a new item, returns its id
+    PUT    /items/<id>              update an item
+    DELETE /items/<id>              delete an item
+    GET    /packs                   all packs
+    POST   /packs                   store a new pack with the included items
+                                    and packs, returns its id
+    GET    /packs/<id>              attributes of a pack
+    PUT    /packs/<id>              update a pack with the included items
+                                    and packs
+    DELETE /packs/<id>              delete a pack
+    GET    /packs/<id>/items        items included in a pack
+    GET    /packs/<id>/packs        packs included in a pack
+    POST   /batch/totals            attributes of many packs
+    POST   /batch/edits             many changes in a single transaction
+"""
+import http.server
+import json
+import re
+import sqlite3
+import sys
+import traceback
+import decimal
+import database_interface as dbi
+
+__author__ = "Marco Zeller"
+__version__ = "0.0.1"
+__license__ = "MIT"
+
+db_name = 'databases/manual_testing.db'
+default_port = 8080
+
+# methods of Database which can be used in the edits of /batch/edits
+batch_edit_methods = {'store_new_item', 'update_item', 'delete_item',
+                      'store_new_pack', 'update_pack', 'delete_pack'}
+
+
+class RequestError(Exception):
+    """
+    Raised by the handlers of the endpoints if the request cannot be served,
+    with the HTTP status code and a message for the client.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def to_json(value):
+    """
+    Converts the values json does not know how to encode: rows of the
+    database become objects and decimal.Decimal values become strings, so no
+    precision is lost.
+    """
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, dbi._Row):
+        return dict(value)
+    raise TypeError('cannot encode ' + type(value).__name__)
+
+
+def _pack_arguments(pack_id, body):
+    """
+    Returns the arguments for store_new_pack and update_pack from the body of
+    a request: the values of the pack and the lists of the included items
+    and packs, given as objects with the keys 'id' and 'selected'.
+    """
+    pack_values = {'id':       pack_id,
+                   'name':     body['name'],
+                   'function': body['function']}
+    return pack_values, body.get('items') or [], body.get('packs') or []
+
+
+def get_items(pool, body):
+    with pool.read() as db:
+        return 200, db.get_all_items()
+
+
+def post_items(pool, body):
+    with pool.write() as db:
+        return 201, {'id': db.store_new_item(body)}
+
+
+def put_item(pool, body, item_id):
+    with pool.write() as db:
+        db.update_item(dict(body, id=item_id))
+        return 200, {'id': item_id}
+
+
+def delete_item(pool, body, item_id):
+    with pool.write() as db:
+        db.delete_item({'id': item_id})
+        return 200, {'id': item_id}
+
+
+def get_packs(pool, body):
+    with pool.read() as db:
+        return 200, db.get_all_packs()
+
+
+def post_packs(pool, body):
+    with pool.write() as db:
+        pack_values, items, packs = _pack_arguments(None, body)
+        db.store_new_pack(pack_values, items, packs)
+        # store_new_pack sets the id of the new pack
+        return 201, {'id': pack_values['id']}
+
+
+def get_pack(pool, body, pack_id):
+    with pool.read() as db:
+        db.cursor.execute("""SELECT id FROM packs WHERE id = ?""",
+                          (pack_id,))
+        if db.cursor.fetchone() is None:
+            raise RequestError(404, 'no pack with id ' + str(pack_id))
+        return 200, db.get_attributes_pack({'id': pack_id})
+
+
+def put_pack(pool, body, pack_id):
+    with pool.write() as db:
+        db.update_pack(*_pack_arguments(pack_id, body))
+        return 200, {'id': pack_id}
+
+
+def delete_pack(pool, body, pack_id):
+    with pool.write() as db:
+        db.delete_pack({'id': pack_id})
+        return 200, {'id': pack_id}
+
+
+def get_pack_items(pool, body, pack_id):
+    with pool.read() as db:
+        return 200, db.get_items_in_pack({'id': pack_id})
+
+
+def get_pack_packs(pool, body, pack_id):
+    with pool.read() as db:
+        return 200, db.get_packs_in_pack({'id': pack_id})
+
+
+def post_batch_totals(pool, body):
+    """
+    Returns the attributes of every pack in the list of ids given for the key
+    'packs' of the body, all read from the same state of the database.
+    """
+    with pool.read() as db:
+        return 200, [db.get_attributes_pack({'id': pack_id})
+                     for pack_id in body['packs']]
+
+
+def post_batch_edits(pool, body):
+    """
+    Applies the list of edits given for the key 'edits' of the body in a
+    single transaction, so either all of them or none is applied.
+    Every edit is an object with the name of one of the batch_edit_methods
+    for the key 'method' and the list of its arguments for the key
+    'arguments'.
+    Returns the number of applied edits.
+    """
+    with pool.write() as db:
+        for index, edit in enumerate(body['edits']):
+            if edit['method'] not in batch_edit_methods:
+                raise RequestError(400, 'edit ' + str(index) + ': unknown '
+                                   'method ' + repr(edit['method']))
+            try:
+                getattr(db, edit['method'])(*edit['arguments'])
+            except (KeyError, TypeError, ValueError,
+                    decimal.InvalidOperation, sqlite3.Error) as error:
+                raise RequestError(400, 'edit ' + str(index) + ': ' +
+                                   type(error).__name__ + ': ' + str(error))
+        return 200, {'applied': len(body['edits'])}
+
+
+# The endpoints as (HTTP method, pattern of the path, handler), the groups
+# matched by the pattern are given to the handler as integers.
+routes = [('GET',    r'/items', get_items),
+          ('POST',   r'/items', post_items),
+          ('PUT',    r'/items/(\d+)', put_item),
+          ('DELETE', r'/items/(\d+)', delete_item),
+          ('GET',    r'/packs', get_packs),
+          ('POST',   r'/packs', post_packs),
+          ('GET',    r'/packs/(\d+)', get_pack),
+          ('PUT',    r'/packs/(\d+)', put_pack),
+          ('DELETE', r'/packs/(\d+)', delete_pack),
+          ('GET',    r'/packs/(\d+)/items', get_pack_items),
+          ('GET',    r'/packs/(\d+)/packs', get_pack_packs),
+          ('POST',   r'/batch/totals', post_batch_totals),
+          ('POST',   r'/batch/edits', post_batch_edits)]
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the requests of one connection, which is kept open for further
+    requests (keep-alive) until the client closes it.
+    """
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are written separately, waiting for the
+    # acknowledgement of the headers would delay every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_endpoint('GET')
+
+    def do_POST(self):
+        self.handle_endpoint('POST')
+
+    def do_PUT(self):
+        self.handle_endpoint('PUT')
+
+    def do_DELETE(self):
+        self.handle_endpoint('DELETE')
+
+    def handle_endpoint(self, method):
+        """
+        Calls the handler of the route matching the request and sends its
+        result as JSON.
+        """
+        try:
+            # the body must be read completely to keep the connection usable
+            try:
+                length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                raise RequestError(400, 'invalid Content-Length: ' +
+                                   self.headers.get('Content-Length'))
+            raw_body = self.rfile.read(length)
+
+            path = self.path.split('?', 1)[0].rstrip('/')
+            handler, path_arguments = self.find_route(method, path)
+
+            try:
+                body = json.loads(raw_body, parse_float=decimal.Decimal) \
+                    if raw_body else {}
+            except ValueError as error:
+                raise RequestError(400, 'invalid JSON: ' + str(error))
+
+            try:
+                status, result = handler(self.server.pool, body,
+                                         *path_arguments)
+            except (KeyError, TypeError, ValueError,
+                    decimal.InvalidOperation, sqlite3.Error) as error:
+                raise RequestError(400, type(error).__name__ + ': ' +
+                                   str(error))
+        except RequestError as error:
+            status, result = error.status, {'error': error.message}
+        except Exception:
+            # an unexpected error must not leave the client without an
+            # answer, the traceback is written for the operator
+            traceback.print_exc(file=sys.stderr)
+            status, result = 500, {'error': 'internal server error'}
+
+        self.send_json(status, result)
+
+    def find_route(self, method, path):
+        """
+        Returns the handler of the route for the HTTP method and the path
+        with the integers matched in the path.
+        """
+        path_found = False
+        for route_method, pattern, handler in routes:
+            match = re.fullmatch(pattern, path)
+            if match is None:
+                continue
+            path_found = True
+            if route_method == method:
+                return handler, [int(group) for group in match.groups()]
+
+        if path_found:
+            raise RequestError(405, method + ' not allowed for ' + path)
+        raise RequestError(404, 'no endpoint ' + path)
+
+    def send_json(self, status, result):
+        encoded = json.dumps(result, default=to_json).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def send_error(self, code, message=None, explain=None):
+        """
+        Sends the errors detected by http.server (e.g. an unsupported HTTP
+        method) as JSON as well and closes the connection, since the body of
+        the request was not read.
+        """
+        self.close_connection = True
+        if message is None:
+            message = self.responses.get(code, ('',))[0]
+        encoded = json.dumps({'error': message}).encode('utf-8')
+        self.send_response(code, message)
+        self.send_header('Connection', 'close')
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(encoded)
+
+    def log_message(self, format, *arguments):
+        # logging every request would slow down the service
+        pass
+
+
+class Server(http.server.ThreadingHTTPServer):
+    def __init__(self, db_name, address=('127.0.0.1', default_port),
+                 readers=4):
+        """
+        HTTP service for the database in the file db_name, listening on the
+        address, a tuple of host and port.
+        Every connection is served by its own thread, the threads share a
+        database_interface.DatabasePool with the number readers of
+        connections for reading, so the connections only wait for each other
+        when writing or if more of them are reading at the same time.
+        """
+        self.pool = dbi.DatabasePool(db_name, readers=readers)
+        super().__init__(address, RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+
+if __name__ == "__main__":
+    """
+    Runs the service until it is interrupted with Ctrl+C.
+    """
+    if len(sys.argv) > 1:
+        db_name = sys.argv[1]
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else default_port
+    server = Server(db_name, ('127.0.0.1', port))
+    print('serving ' + db_name + ' on http://127.0.0.1:' + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,14 +1,103 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-TODO: Module Docstring
+Utility functions for more complex operations used by the interfaces,
+like reading the records of a file to import into the database.
 """
+import csv
+import json
 
 __author__ = "Marco Zeller"
-__version__ = "0.0.0"
+__version__ = "0.0.1"
 __license__ = "MIT"
 
 
+class RecordError(ValueError):
+    """
+    Yielded by the readers of this module instead of a record for a row
+    which cannot be read, so the importing method can report it as the
+    error of that row and continue with the next one.
+    """
+
+
+def read_csv_records(csv_file):
+    """
+    Generator yielding a dictionary for every row of the opened csv_file,
+    with the column's name of the header row (String) as key to the
+    corresponding value (String), or a RecordError for a row which cannot
+    be read.
+    Only the current row is kept in memory, so it can be used to import
+    files of any size with Database.import_items and Database.import_packs.
+    """
+    reader = csv.DictReader(csv_file)
+    while True:
+        try:
+            record = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            yield RecordError('csv.Error: ' + str(error))
+            continue
+        yield record
+
+
+def read_jsonl_records(jsonl_file):
+    """
+    Generator yielding a dictionary for every line of the opened jsonl_file,
+    which contains a JSON object on every non-empty line, or a RecordError
+    for a line which is no valid JSON.
+    Only the current line is kept in memory, so it can be used to import
+    files of any size with Database.import_items and Database.import_packs.
+    """
+    for line in jsonl_file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as error:
+                yield RecordError('JSONDecodeError: ' + str(error))
+
+
+def parse_included(included):
+    """
+    Returns a list of (reference, amount) tuples of the items or packs
+    included in a pack as given in a record to import.
+    The parameter included can be a string like 'Tent=1; Stove=2' as used in
+    csv-files, a dictionary of references to amounts, or a list of
+    dictionaries with a value for the keys 'ref' and 'amount'.
+    A reference is an integer id or the name (String) of the item or pack,
+    in a string a reference made of digits only is read as an id.
+    If no amount is given in a string it is 1.
+    Raises a ValueError for an amount below 1, which would not include
+    anything.
+    """
+    if included is None:
+        return []
+
+    if isinstance(included, str):
+        parsed = []
+        for entry in included.split(';'):
+            if not entry.strip():
+                continue
+            reference, separator, amount = entry.rpartition('=')
+            if not separator:
+                reference, amount = amount, '1'
+            reference = reference.strip()
+            if reference.isdigit():
+                reference = int(reference)
+            parsed.append((reference, int(amount)))
+    elif isinstance(included, dict):
+        parsed = [(reference, int(amount))
+                  for reference, amount in included.items()]
+    else:
+        parsed = [(entry['ref'], int(entry['amount'])) for entry in included]
+
+    for reference, amount in parsed:
+        if amount < 1:
+            raise ValueError('amount of ' + repr(reference) +
+                             ' must be at least 1, not ' + str(amount))
+    return parsed
+
+
 if __name__ == "__main__":
     """ TODO: Execute some tests """
     pass
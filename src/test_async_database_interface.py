@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import async_database_interface as adbi
+import database_interface as dbi
+import asyncio
+import decimal
+import threading
+import time
+import pytest
+
+
+def item_values(i):
+    return {'name': 'Name' + str(i),
+            'function': 'Function' + str(i),
+            'weight': decimal.Decimal('0.5'),
+            'volume': decimal.Decimal(0),
+            'price': decimal.Decimal(0),
+            'amount': 1}
+
+
+def test_methods_of_database():
+    # every public method of Database is offered
+    for name in vars(dbi.Database):
+        if name.startswith('_') or name in adbi._excluded_methods:
+            continue
+        assert hasattr(adbi.AsyncDatabase, name)
+
+
+def test_async_database(tmp_path):
+    async def run():
+        async with adbi.AsyncDatabase(str(tmp_path / 'async.db')) as db:
+            await asyncio.gather(*[db.store_new_item(item_values(i))
+                                   for i in range(10)])
+            items = await db.get_all_items()
+            assert len(items) == 10
+            for item in items[:4]:
+                item['selected'] = 2
+            await db.store_new_pack({'name': 'Pack', 'function': 'Function'},
+                                    items[:4], None)
+
+            # loading the members of a pack at the same time
+            pack = {'id': 1}
+            included, not_included = await asyncio.gather(
+                    db.get_items_in_pack(pack),
+                    db.get_items_not_in_pack(pack))
+            assert [item['id'] for item in included] == [1, 2, 3, 4]
+            assert len(not_included) == 6
+            attributes = await db.get_attributes_pack(pack)
+            assert attributes['weight'] == 4
+
+            names = [item['name'] async for item
+                     in db.iter_items(page_size=3, order_by='name')]
+            assert names == sorted(item['name'] for item in items)
+
+            # edits made together are rolled back together
+            def edit(writer):
+                writer.delete_item({'id': 1})
+                writer.delete_item({'id': 2})
+                raise ValueError('rolled back')
+
+            with pytest.raises(ValueError):
+                await db.run_write(edit)
+            assert len(await db.get_all_items()) == 10
+
+    asyncio.run(run())
+
+
+def test_event_loop_is_not_blocked(tmp_path):
+    async def run():
+        async with adbi.AsyncDatabase(str(tmp_path / 'async.db'),
+                                      readers=2) as db:
+            slow_reads = threading.Barrier(2, timeout=10)
+
+            def slow_read(reader):
+                # only passes if both reads run at the same time
+                slow_reads.wait()
+                time.sleep(0.2)
+                return reader.get_all_items()
+
+            async def reads():
+                await asyncio.gather(db.run_read(slow_read),
+                                     db.run_read(slow_read))
+
+            # the event loop keeps running other tasks during the reads
+            reading = asyncio.create_task(reads())
+            ticks = 0
+            while not reading.done():
+                await asyncio.sleep(0.02)
+                ticks += 1
+            await reading
+            assert ticks >= 5
+
+    asyncio.run(run())
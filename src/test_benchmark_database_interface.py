@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import benchmark_database_interface as bdi
+
+
+def test_benchmark_catalog():
+    # a tiny catalog of every shape, so the benchmarks keep matching the
+    # methods of Database
+    for shape in bdi.catalog_shapes:
+        results = bdi.benchmark_catalog(10, 6, shape, repetitions=1)
+        assert results[0]['benchmark'] == 'generate_catalog'
+        assert all(result['shape'] == shape and result['seconds'] >= 0
+                   for result in results)
+        assert 'where_used_item' in [result['benchmark']
+                                     for result in results]
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import curses
+import curses.ascii
 import npyscreen as nps
 import console_interface as coi
 import test_database_interface as tdi
@@ -440,3 +441,311 @@ def test_update_selected_items_of_a_pack():
 def test_add_new_packs_also_with_packs():
     # TODO: implement this test
     pass
+
+
+class AppWithPacks(coi.App):
+    """
+    Application starting with the items and packs of
+    test_database_interface.store_diamond_packs in the database.
+    """
+    def onStart(self):
+        super().onStart()
+        for item_values in tdi.item_attributes_list[:5]:
+            self.db.store_new_item(item_values)
+        tdi.store_diamond_packs(self.db)
+
+
+def test_where_used_screen():
+    """
+    Shows the packs including an item from the list items screen.
+    """
+    go_to_list_item_screen_from_main_menu()
+    # on the fourth item press 'u' to show where it is used
+    nps.TEST_SETTINGS['TEST_INPUT'] += 3*[curses.KEY_DOWN]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [ord('u')]
+    # go to the 'OK' buttons to get back to the main menu
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+
+    press_ok_button_from_main_menu()
+
+    app = AppWithPacks()
+    app.db_name = ':memory:'
+    app.run(fork=False)  # needs to run "py.test -s" else does not work
+
+    where_used = app.getForm('WHERE_USED')
+    assert app.selected_item['id'] == 4
+    assert [(pack['name'], pack['selected'])
+            for pack in where_used.pack_list_widget.values] == \
+        [('Pack4', 2), ('Pack3', 6), ('Pack2', 2), ('Pack1', 10)]
+
+
+def test_instrumentation_screen(monkeypatch):
+    """
+    Opens the hidden instrumentation screen with Ctrl+T from the main menu.
+    """
+    monkeypatch.setenv(coi.instrumentation_variable, '1')
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.ctrl(ord('t'))]
+    # go to the 'OK' button to get back to the main menu
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+
+    press_ok_button_from_main_menu()
+
+    app = AppWithPacks()
+    app.db_name = ':memory:'
+    app.run(fork=False)  # needs to run "py.test -s" else does not work
+
+    lines = app.getForm('INSTRUMENTATION').report_widget.values
+    assert lines[0] == coi.language['hottest_methods']
+    assert any(line.startswith('  store_new_pack: 4,') for line in lines)
+
+
+class AppWithManyItems(coi.App):
+    """
+    Application starting with 95 items and the packs of
+    test_database_interface.store_diamond_packs in the database.
+    """
+    def onStart(self):
+        super().onStart()
+        for item_values in tdi.item_attributes_list[:95]:
+            self.db.store_new_item(item_values)
+        tdi.store_diamond_packs(self.db)
+
+
+def test_windowed_lists(monkeypatch):
+    """
+    Scrolls through lists only holding a few pages of rows.
+    """
+    monkeypatch.setattr(coi, 'page_size', 10)
+    go_to_list_item_screen_from_main_menu()
+    # on the 36th item press 'u' to show where it is used
+    nps.TEST_SETTINGS['TEST_INPUT'] += 35*[curses.KEY_DOWN]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [ord('u')]
+    # go to the 'OK' buttons to get back to the main menu
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+
+    press_ok_button_from_main_menu()
+
+    app = AppWithManyItems()
+    app.db_name = ':memory:'
+    app.run(fork=False)  # needs to run "py.test -s" else does not work
+
+    assert app.selected_item['id'] == 36
+    item_list = app.getForm('LIST_ITEMS').item_list_widget
+    assert len(item_list.values) <= coi.window_pages * coi.page_size
+    assert item_list.values[item_list.cursor_line]['id'] == 36
+
+    # select items far apart in the chooser of a new pack
+    add_pack = app.getForm('ADD_PACK')
+    add_pack.beforeEditing()
+    chooser = add_pack.item_chooser
+    chooser.h_cursor_end(None)
+    assert chooser.values[chooser.cursor_line]['id'] == 95
+    assert len(chooser.values) <= coi.window_pages * coi.page_size
+    chooser.h_act_on_highlighted(ord('+'))
+    chooser.h_act_on_highlighted(ord('+'))
+    chooser.h_cursor_beginning(None)
+    assert chooser.values[chooser.cursor_line]['id'] == 1
+    chooser.h_select_toggle(None)
+    assert chooser.selected == {95: 2, 1: 1}
+    add_pack._name.value = 'Big'
+    add_pack.on_ok()
+
+    pack = app.db.get_all_packs()[-1]
+    assert [(item['id'], item['selected'])
+            for item in app.db.get_items_in_pack(pack)] == [(1, 1), (95, 2)]
+
+    # the included items are shown first when editing the pack
+    app.selected_pack = pack
+    edit_pack = app.getForm('EDIT_PACK')
+    edit_pack.beforeEditing()
+    chooser = edit_pack.item_chooser
+    assert [item['id'] for item in chooser.values[:3]] == [1, 95, 2]
+    chooser.h_act_on_highlighted(ord('-'))
+    edit_pack.on_ok()
+    assert [(item['id'], item['selected'])
+            for item in app.db.get_items_in_pack(pack)] == [(95, 2)]
+
+
+def test_select_in_empty_chooser():
+    """
+    Pressing the keys selecting a row does nothing without any rows.
+    """
+    app = coi.App()
+    app.db_name = ':memory:'
+    app.onStart()
+    add_pack = app.getForm('ADD_PACK')
+    add_pack.beforeEditing()
+    chooser = add_pack.item_chooser
+    assert chooser.values == []
+    chooser.h_select_toggle(ord('x'))
+    chooser.h_select(ord(' '))
+    chooser.h_act_on_highlighted(ord('+'))
+    assert chooser.selected == {}
+    app.prefetcher.close()
+    app.db.close()
+
+
+def test_search_items_screen():
+    """
+    Filters the list items screen while typing into the search field.
+    """
+    go_to_list_item_screen_from_main_menu()
+    # go to the search field above the list and type
+    nps.TEST_SETTINGS['TEST_INPUT'] += [ord('/')]
+    nps.TEST_SETTINGS['TEST_INPUT'] += 'name9'
+    # on the first item found press 'u' to show where it is used
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.KEY_DOWN, ord('u')]
+    # go to the 'OK' buttons to get back to the main menu
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+
+    press_ok_button_from_main_menu()
+
+    app = AppWithManyItems()
+    app.db_name = ':memory:'
+    app.run(fork=False)  # needs to run "py.test -s" else does not work
+
+    assert app.selected_item['name'] == 'Name9'
+    item_list = app.getForm('LIST_ITEMS').item_list_widget
+    assert sorted(item['name'] for item in item_list.values) == \
+        ['Name9'] + ['Name9' + str(i) for i in range(6)]
+
+
+def test_prefetcher(tmp_path):
+    """
+    Loads the data of packs in the background from a database file.
+    """
+    db_file = str(tmp_path / 'prefetch.db')
+    app = AppWithPacks()
+    app.db_name = db_file
+    app.onStart()
+    packs = app.db.get_all_packs()
+
+    future = app.prefetcher.load(packs[1])
+    assert future.result() == coi.load_pack_data(app.db, packs[1])
+    assert app.prefetcher.load(packs[1]) is future
+
+    # a change loads the data again
+    app.db.update_pack({'id': packs[1]['id'],
+                        'name': 'Renamed',
+                        'function': packs[1]['function']},
+                       [], [])
+    reloaded = app.prefetcher.load(packs[1]).result()
+    assert reloaded is not future.result()
+    assert reloaded['items_in_pack'] == []
+    app.prefetcher.close()
+    app.db.close()
+
+
+def test_edit_pack_with_prefetched_data(tmp_path):
+    """
+    Opens a pack from the list packs screen with the data loaded while it
+    was highlighted.
+    """
+    # open the second pack from the list packs screen
+    nps.TEST_SETTINGS['TEST_INPUT'] += 3*[curses.KEY_DOWN]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [10]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.KEY_DOWN, 10]
+    # go to the 'CANCEL' button and back to the main menu
+    nps.TEST_SETTINGS['TEST_INPUT'] += 11*[curses.ascii.TAB] + [10]
+    nps.TEST_SETTINGS['TEST_INPUT'] += [curses.ascii.TAB, 10]
+
+    press_ok_button_from_main_menu()
+
+    app = AppWithPacks()
+    app.db_name = str(tmp_path / 'prefetch.db')
+    app.run(fork=False)  # needs to run "py.test -s" else does not work
+
+    packs = app.db.get_all_packs()
+    pack = app.selected_pack
+    assert pack['id'] == packs[1]['id']
+    # the first and the second pack were highlighted
+    assert list(app.prefetcher._loads) == [packs[0]['id'], packs[1]['id']]
+    edit_pack = app.getForm('EDIT_PACK')
+    assert edit_pack._loading.done()
+    pack_values = app.db.get_attributes_pack(pack)
+    assert edit_pack._weight.value == str(pack_values['weight'])
+    assert [item['id'] for item in edit_pack.item_chooser.values] == \
+        [item['id'] for item in app.db.get_items_in_pack(pack)] + \
+        [item['id'] for item in app.db.get_items_not_in_pack(pack)]
+
+
+def test_screens_only_read_changes():
+    """
+    Shows the screens again without reading the database unless it changed.
+    """
+    app = AppWithPacks()
+    app.db_name = ':memory:'
+    app.onStart()
+    packs = app.db.get_all_packs()
+    app.selected_pack = packs[0]
+    screens = [app.getForm(name) for name in ('LIST_ITEMS', 'LIST_PACKS',
+                                              'ADD_PACK', 'EDIT_PACK')]
+    for screen in screens:
+        screen.beforeEditing()
+
+    # only checking for changes of other connections
+    statements = []
+    app.db.conn.set_trace_callback(
+            lambda statement: statement == 'PRAGMA data_version' or
+            statements.append(statement))
+    for screen in screens:
+        screen.beforeEditing()
+    assert statements == []
+
+    # only the changed item and the totals of the packs including it are
+    # read again
+    item = dict(tdi.item_attributes_list[4], id=5, amount=0)
+    app.db.update_item(item)
+    del statements[:]
+    for screen in screens:
+        screen.beforeEditing()
+    assert statements != []
+    item_list = app.getForm('LIST_ITEMS').item_list_widget
+    assert item_list.values[4]['name'] == item['name']
+    assert app.getForm('LIST_PACKS').pack_list_widget.buildable_amounts == \
+        app.db.get_buildable_amounts()
+    assert app.getForm('EDIT_PACK')._amount.value == '0'
+
+    del statements[:]
+    for screen in screens:
+        screen.beforeEditing()
+    assert statements == []
+
+
+def test_screens_notice_other_connections(tmp_path):
+    """
+    Reads the rows shown again and drops the prefetched data if another
+    connection (e.g. the HTTP service) changed the database.
+    """
+    db_file = str(tmp_path / 'shared.db')
+    app = AppWithPacks()
+    app.db_name = db_file
+    app.onStart()
+    packs = app.db.get_all_packs()
+    app.selected_pack = packs[1]
+    screens = [app.getForm(name) for name in ('LIST_ITEMS', 'LIST_PACKS',
+                                              'ADD_PACK', 'EDIT_PACK')]
+    for screen in screens:
+        screen.beforeEditing()
+    app.prefetcher.load(packs[1]).result()
+
+    other = tdi.dbi.Database(db_file)
+    other.update_item(dict(tdi.item_attributes_list[4], id=5,
+                           name='Renamed'))
+    other.update_pack(packs[1], [], [])
+    other.close()
+
+    for screen in screens:
+        screen.beforeEditing()
+    assert app.getForm('LIST_ITEMS').item_list_widget.values[4]['name'] == \
+        'Renamed'
+    assert app.getForm('ADD_PACK').item_chooser.values[4]['name'] == \
+        'Renamed'
+    assert app.getForm('LIST_PACKS').pack_list_widget.buildable_amounts == \
+        app.db.get_buildable_amounts()
+    assert app.prefetcher.load(packs[1]).result()['items_in_pack'] == []
+    app.prefetcher.close()
+    app.db.close()
@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import database_interface as dbi
+import packlist_utils
+import csv
 import decimal
+import io
+import json
+import pytest
+import sqlite3
+import threading
+import time
 
 # Produce some test data:
 n_items = 100
@@ -33,9 +41,9 @@ def compare_item_data(item_tuple, attribute_dict, item_id=0):
     return item_tuple == (item_id,
                           attribute_dict['name'],
                           attribute_dict['function'],
-                          str(attribute_dict['weight']),
-                          str(attribute_dict['volume']),
-                          str(attribute_dict['price']),
+                          dbi.to_fixed_point(attribute_dict['weight'], 'weight'),
+                          dbi.to_fixed_point(attribute_dict['volume'], 'volume'),
+                          dbi.to_fixed_point(attribute_dict['price'], 'price'),
                           attribute_dict['amount'])
 
 
@@ -52,6 +60,40 @@ def test_initialize():
         assert len(db.cursor.fetchall()) == 0
 
 
+def test_connection_profiles(tmp_path):
+    db_name = str(tmp_path / 'profiles.db')
+
+    # Test if the settings of every profile are in effect
+    for name, profile in dbi.connection_profiles.items():
+        db = dbi.Database(db_name, profile=name)
+        settings = db.connection_settings()
+        for setting, value in profile.items():
+            assert settings[setting] == value
+        db.conn.close()
+
+    # Test if the read only profile refuses changes
+    db = dbi.Database(db_name, profile='read-only-browse')
+    with pytest.raises(sqlite3.OperationalError):
+        db.store_new_item(item_attributes_list[0])
+    db.conn.close()
+
+    # Test if the foreign keys are enforced, deleting an included item
+    # removes it from the pack
+    db = dbi.Database(db_name)
+    db.store_new_item(item_attributes_list[0])
+    db.store_new_pack({'name': 'Pack', 'function': 'Function'},
+                      [{'id': 1, 'selected': 1}], None)
+    db.delete_item({'id': 1})
+    with db.conn:
+        db.cursor.execute(""" SELECT * FROM included_items """)
+        assert db.cursor.fetchall() == []
+
+    # Test a custom profile for a database in memory
+    db = dbi.Database(':memory:', profile={'cache_size': -1000})
+    assert db.connection_settings()['cache_size'] == -1000
+    assert db.connection_settings()['journal_mode'] == 'memory'
+
+
 def test_store_new_item():
     db = dbi.Database(':memory:')
     db.initialize()
@@ -82,6 +124,96 @@ def test_store_new_item_multiple_items():
         assert compare_item_data(item_list[i], item_attributes_list[i], i+1)
 
 
+def test_fixed_point_conversion():
+    # Test if the values are stored in mg, mL, and centimes
+    assert dbi.to_fixed_point(decimal.Decimal('1.5'), 'weight') == 1500000
+    assert dbi.to_fixed_point(decimal.Decimal('0.25'), 'volume') == 250
+    assert dbi.to_fixed_point('19.95', 'price') == 1995
+    assert dbi.to_fixed_point(3, 'price') == 300
+    for value in ['Infinity', '-Infinity', 'NaN']:
+        with pytest.raises(ValueError):
+            dbi.to_fixed_point(value, 'weight')
+
+    # Test if the values come back as the same decimals
+    for value in ['0', '1.5', '0.000001', '12', '120', '3.05']:
+        for attribute in dbi.decimal_places:
+            stored = dbi.to_fixed_point(decimal.Decimal(value), attribute)
+            assert dbi.from_fixed_point(stored, attribute) == \
+                decimal.Decimal(value).quantize(
+                    decimal.Decimal(1).scaleb(-dbi.decimal_places[attribute]),
+                    rounding=decimal.ROUND_HALF_EVEN)
+    assert str(dbi.from_fixed_point(1500000, 'weight')) == '1.5'
+    assert str(dbi.from_fixed_point(10000000, 'weight')) == '10'
+
+
+def test_migrate_to_fixed_point(tmp_path):
+    # Create a database with the schema storing the values as text
+    db_name = str(tmp_path / 'text_values.db')
+    conn = sqlite3.connect(db_name)
+    with conn:
+        conn.execute("""CREATE TABLE items(id integer PRIMARY KEY, name text,
+                        function text, weight text, volume text, price text,
+                        amount integer)""")
+        conn.execute("""CREATE TABLE packs(id integer PRIMARY KEY, name text,
+                        function text)""")
+        conn.execute("""CREATE TABLE included_items(pack integer,
+                        item integer, amount integer,
+                        PRIMARY KEY (pack, item),
+                        FOREIGN KEY (pack) REFERENCES packs(id)
+                        ON DELETE CASCADE,
+                        FOREIGN KEY (item) REFERENCES items(id)
+                        ON DELETE CASCADE)""")
+        conn.execute("""INSERT INTO items VALUES
+                        (1, 'Tent', 'Sleeping', '2.35', '4', '349.90', 1),
+                        (2, 'Stove', 'Eating', '0.5', '1.25', '79', 2)""")
+        conn.execute("""INSERT INTO packs VALUES (1, 'Camping', 'Outdoor')""")
+        conn.execute("""INSERT INTO included_items VALUES (1, 1, 1), (1, 2, 2)""")
+    conn.close()
+
+    db = dbi.Database(db_name)
+    with db.conn:
+        db.cursor.execute(""" SELECT * FROM items """)
+        item_list = db.cursor.fetchall()
+        db.cursor.execute(""" PRAGMA user_version """)
+        assert db.cursor.fetchone()[0] == dbi.schema_version
+    assert item_list == [(1, 'Tent', 'Sleeping', 2350000, 4000, 34990, 1),
+                         (2, 'Stove', 'Eating', 500000, 1250, 7900, 2)]
+
+    # Test if the included items survived the migration
+    assert [item['selected'] for item in db.get_items_in_pack({'id': 1})] == [1, 2]
+    pack_values = db.get_attributes_pack({'id': 1})
+    assert pack_values['weight'] == decimal.Decimal('3.35')
+    assert pack_values['volume'] == decimal.Decimal('6.5')
+    assert pack_values['price'] == decimal.Decimal('507.90')
+
+
+def test_migrate_to_fixed_point_bad_value(tmp_path):
+    db_name = str(tmp_path / 'bad_value.db')
+    conn = sqlite3.connect(db_name)
+    with conn:
+        conn.execute("""CREATE TABLE items(id integer PRIMARY KEY, name text,
+                        function text, weight text, volume text, price text,
+                        amount integer)""")
+        conn.execute("""INSERT INTO items VALUES
+                        (1, 'Tent', 'Sleeping', '2.35', '4', '349.90', 1),
+                        (2, 'Stove', 'Eating', 'heavy', '1.25', '79', 2)""")
+    conn.close()
+
+    # The error names the row, which is left unchanged to be fixed
+    with pytest.raises(ValueError, match="weight of the item with the id 2"
+                                         " is not a number: 'heavy'"):
+        dbi.Database(db_name)
+    conn = sqlite3.connect(db_name)
+    with conn:
+        assert conn.execute("""SELECT weight FROM items
+                               WHERE id = 2""").fetchone() == ('heavy',)
+        conn.execute("""UPDATE items SET weight = '0.5' WHERE id = 2""")
+    conn.close()
+
+    db = dbi.Database(db_name)
+    assert db.get_all_items()[1]['weight'] == decimal.Decimal('0.5')
+
+
 def test_utf8_support():
     # For sqlite not needed - found online:
     # "By default, pysqlite decodes all strings to Unicode,
@@ -120,6 +252,102 @@ def test_get_all_items():
         assert compare_item_dicts(item_list[i], item_attributes_list[i])
 
 
+def test_iter_items():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(dict(item_attributes_list[i],
+                               name='Name' + str(i % 7)))
+
+    # Test if the pages are joined without gaps or duplicates
+    all_items = db.get_all_items()
+    for page_size in [1, 3, 10, n_items, 2*n_items]:
+        assert list(db.iter_items(page_size=page_size)) == all_items
+
+    # Test if browsing can be continued after an item
+    items = db.iter_items(page_size=10, after_id=all_items[41]['id'])
+    assert list(items) == all_items[42:]
+
+    # Test ordering by name, items with equal names are ordered by id
+    by_name = sorted(all_items, key=lambda item: (item['name'], item['id']))
+    assert list(db.iter_items(page_size=3, order_by='name')) == by_name
+    items = db.iter_items(page_size=3, after_id=by_name[50]['id'],
+                          order_by='name')
+    assert list(items) == by_name[51:]
+
+    with pytest.raises(ValueError):
+        next(db.iter_items(order_by='weight'))
+
+    # Test ordering by name with names which are NULL, they come first
+    db_null = dbi.Database(':memory:')
+    for name in [None, None, 'x', 'y']:
+        db_null.store_new_item(dict(item_attributes_list[0], name=name))
+    for page_size in [1, 2, 3]:
+        assert [item['id'] for item in db_null.iter_items(
+                page_size=page_size, order_by='name')] == [1, 2, 3, 4]
+    assert [item['id'] for item in db_null.iter_items(
+            page_size=2, after_id=1, order_by='name')] == [2, 3, 4]
+
+    # Test the not included items of a pack
+    pack = {'name': 'Pack', 'function': 'Function'}
+    db.store_new_pack(pack, [{'id': i, 'selected': 1} for i in range(1, 51)], None)
+    items = db.iter_items_not_in_pack(pack, page_size=7)
+    assert [item['id'] for item in items] == list(range(51, n_items + 1))
+    assert list(db.iter_packs_not_in_pack(pack, page_size=1)) == []
+
+
+def test_item_and_pack_rows():
+    db = dbi.Database(':memory:')
+    db.store_new_item({'name': 'Tent', 'function': 'Sleeping',
+                       'weight': decimal.Decimal('2.35'), 'volume': 4,
+                       'price': decimal.Decimal('349.90'), 'amount': 1})
+    item = db.get_all_items()[0]
+
+    # Test if the item behaves like the dictionaries used before
+    expected = {'id': 1, 'name': 'Tent', 'function': 'Sleeping',
+                'weight': decimal.Decimal('2.35'),
+                'volume': decimal.Decimal('4'),
+                'price': decimal.Decimal('349.90'), 'amount': 1}
+    assert item == expected
+    assert dict(item) == expected
+    assert len(item) == 7
+    assert 'selected' not in item
+    with pytest.raises(KeyError):
+        item['colour']
+    with pytest.raises(KeyError):
+        item['colour'] = 'red'
+
+    item['selected'] = 0
+    item['selected'] += 2
+    assert item['selected'] == 2
+    assert dict(item) == dict(expected, selected=2)
+    copy = item.copy()
+    del item['selected']
+    assert 'selected' not in item and copy['selected'] == 2
+
+    # Test if the values with a unit are converted lazily
+    item = db.get_all_items()[0]
+    assert item._weight == 2350000
+    assert item['weight'] == decimal.Decimal('2.35')
+    assert item._weight == decimal.Decimal('2.35')
+
+    # an integer assigned is a value in the unit, not a fixed-point value
+    item['weight'] = 5
+    assert item['weight'] == 5
+    db.update_item(item)
+    assert db.get_all_items()[0]['weight'] == decimal.Decimal('5')
+    item = db.get_all_items()[0]
+
+    item['selected'] = 2
+    db.store_new_pack({'name': 'Pack', 'function': 'Function'},
+                      [item], [])
+    pack = db.get_all_packs()[0]
+    assert pack == {'id': 1, 'name': 'Pack', 'function': 'Function'}
+    with pytest.raises(KeyError):
+        pack['weight']
+    assert db.get_packs_not_in_pack(pack) == []
+    assert db.get_items_in_pack(pack)[0]['selected'] == 2
+
+
 def test_update_item():
     db = dbi.Database(':memory:')
     db.initialize()
@@ -169,9 +397,463 @@ def test_get_all_packs():
     pass
 
 
+def store_diamond_packs(db):
+    """
+    Helper function storing the packs of a small diamond shaped hierarchy
+    into the database, which already contains the items of
+    item_attributes_list with some weight, volume, and price.
+    Pack 1 includes pack 2 and 3, which both include pack 4.
+    Returns the list of pack dictionaries as stored in the database.
+    """
+    for i in range(1, 6):
+        db.update_item({'id': i,
+                        'name': 'Name' + str(i),
+                        'function': 'Function' + str(i),
+                        'weight': decimal.Decimal('0.25') * i,
+                        'volume': decimal.Decimal('1.5') * i,
+                        'price': decimal.Decimal('9.95') * i,
+                        'amount': 10})
+
+    packs = [{'name': 'Pack' + str(i), 'function': 'Function' + str(i)}
+             for i in range(1, 5)]
+    db.store_new_pack(packs[3],
+                      [{'id': 4, 'selected': 2}, {'id': 5, 'selected': 1}],
+                      [])
+    db.store_new_pack(packs[2],
+                      [{'id': 3, 'selected': 1}],
+                      [{'id': packs[3]['id'], 'selected': 3}])
+    db.store_new_pack(packs[1],
+                      [{'id': 2, 'selected': 4}],
+                      [{'id': packs[3]['id'], 'selected': 1}])
+    db.store_new_pack(packs[0],
+                      [{'id': 1, 'selected': 1}],
+                      [{'id': packs[1]['id'], 'selected': 2},
+                       {'id': packs[2]['id'], 'selected': 1}])
+    return packs
+
+
+def recursive_attributes_pack(db, pack):
+    """
+    Helper function calculating weight, volume, and price of a pack by
+    recursively walking its included items and packs one query at a time.
+    """
+    values = {'weight': 0, 'volume': 0, 'price': 0}
+    for item in db.get_items_in_pack(pack):
+        for key in values:
+            values[key] += item['selected'] * item[key]
+    for sub_pack in db.get_packs_in_pack(pack):
+        sub_values = recursive_attributes_pack(db, sub_pack)
+        for key in values:
+            values[key] += sub_pack['selected'] * sub_values[key]
+    return values
+
+
 def test_get_attributes_pack():
-    # TODO: implement this test
-    pass
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+
+    # Test if the values match the ones calculated recursively
+    for pack in packs:
+        pack_values = db.get_attributes_pack({'id': pack['id']})
+        assert pack_values['name'] == pack['name']
+        assert pack_values['function'] == pack['function']
+        expected = recursive_attributes_pack(db, pack)
+        for key in expected:
+            assert pack_values[key] == expected[key]
+
+    # Pack 1 reaches pack 4 along two paths: 2*1 + 1*3 times
+    pack_values = db.get_attributes_pack({'id': packs[0]['id']})
+    assert pack_values['weight'] == decimal.Decimal('0.25') * (1 + 2*4*2 + 3) + \
+        decimal.Decimal('0.25') * 5 * (2*4 + 5)
+
+    # Test an empty pack
+    db.store_new_pack({'name': 'Empty', 'function': 'Empty'}, None, None)
+    pack_values = db.get_attributes_pack({'id': 5})
+    assert pack_values['weight'] == 0
+    assert pack_values['volume'] == 0
+    assert pack_values['price'] == 0
+
+
+def test_pack_totals_after_changes():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+
+    # Fill the table pack_totals
+    for pack in packs:
+        db.get_attributes_pack(pack)
+
+    # Change an item included in pack 4 and therefore in all packs
+    db.update_item({'id': 5,
+                    'name': 'Name5',
+                    'function': 'Function5',
+                    'weight': decimal.Decimal('7.5'),
+                    'volume': decimal.Decimal('0.5'),
+                    'price': decimal.Decimal('100'),
+                    'amount': 1})
+    # Remove pack 4 from pack 2
+    db.update_pack(packs[1], [{'id': 2, 'selected': 4}], [])
+    # Delete an item only included in pack 3
+    db.delete_item({'id': 3})
+
+    rebuilt_totals = db.rebuild_pack_totals()
+    for pack in packs:
+        pack_values = db.get_attributes_pack(pack)
+        expected = recursive_attributes_pack(db, pack)
+        for key in expected:
+            assert pack_values[key] == expected[key]
+            assert rebuilt_totals[pack['id']][key] == expected[key]
+
+    # Deleting a pack marks the packs including it as stale
+    db.get_attributes_pack(packs[0])
+    db.delete_pack(packs[2])
+    pack_values = db.get_attributes_pack(packs[0])
+    assert pack_values['weight'] == recursive_attributes_pack(db, packs[0])['weight']
+    with db.conn:
+        db.cursor.execute(""" SELECT pack FROM pack_totals """)
+        assert packs[2]['id'] not in [row[0] for row in db.cursor.fetchall()]
+
+
+def recursive_requirements_pack(db, pack, multiplicity=1, requirements=None):
+    """
+    Helper function flattening a pack into the total amount required of
+    every item by recursively walking its included items and packs.
+    """
+    if requirements is None:
+        requirements = {}
+    for item in db.get_items_in_pack(pack):
+        requirements[item['id']] = requirements.get(item['id'], 0) + \
+            multiplicity * item['selected']
+    for sub_pack in db.get_packs_in_pack(pack):
+        recursive_requirements_pack(db, sub_pack,
+                                    multiplicity * sub_pack['selected'],
+                                    requirements)
+    return requirements
+
+
+def test_buildable_amount():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+    db.store_new_pack({'name': 'Empty', 'function': 'Empty'}, None, None)
+
+    # Pack 1 requires item 4 two times from pack 2 and 3 and
+    # six times from pack 3 and 4, which are 10 in total
+    assert recursive_requirements_pack(db, packs[0])[4] == 10
+    amounts = {item['id']: item['amount'] for item in db.get_all_items()}
+    for pack in packs:
+        requirements = recursive_requirements_pack(db, pack)
+        expected = min(amounts[item_id] // required
+                       for item_id, required in requirements.items())
+        assert db.get_attributes_pack(pack)['amount'] == expected
+    assert db.get_attributes_pack(packs[0])['amount'] == 1
+    assert db.get_attributes_pack(packs[3])['amount'] == 5
+    assert db.get_attributes_pack({'id': 5})['amount'] is None
+
+    assert db.get_buildable_amounts() == {packs[0]['id']: 1,
+                                          packs[1]['id']: 2,
+                                          packs[2]['id']: 1,
+                                          packs[3]['id']: 5,
+                                          5: None}
+
+    # Changing the available amount of an item changes the buildable amounts
+    db.update_item(dict(db.get_all_items()[4], amount=3))
+    assert db.get_attributes_pack(packs[3])['amount'] == 3
+    assert db.get_buildable_amounts()[packs[0]['id']] == 0
+    assert db.rebuild_pack_totals()[packs[1]['id']]['amount'] == 2
+
+
+def test_explode_pack():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+    db.store_new_pack({'name': 'Empty', 'function': 'Empty'}, None, None)
+
+    for pack in packs:
+        exploded = db.explode_pack(pack)
+        assert {item['id']: item['selected'] for item in exploded} == \
+            recursive_requirements_pack(db, pack)
+        assert [item['id'] for item in exploded] == \
+            sorted(item['id'] for item in exploded)
+
+    # Items included by pack 2 and 3 are merged
+    exploded = db.explode_pack(packs[0], quantity=3)
+    assert [(item['id'], item['selected']) for item in exploded] == \
+        [(1, 3), (2, 24), (3, 3), (4, 30), (5, 15)]
+    assert exploded[3]['name'] == 'Name4'
+    assert exploded[3]['weight'] == decimal.Decimal('1')
+
+    streamed = db.iter_explode_pack(packs[0], quantity=3, chunk_size=2)
+    assert [dict(item) for item in streamed] == \
+        [dict(item) for item in exploded]
+    assert db.explode_pack({'id': 5}) == []
+
+
+def test_need_to_buy():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+
+    # Enough items to build one pack 1
+    assert db.need_to_buy({packs[0]['id']: 1}) == []
+
+    # Pack 1 needs item 4 ten times and item 5 five times,
+    # pack 4 needs them two times and once, 10 of each are available
+    shortfall = db.need_to_buy({packs[0]['id']: 2, packs[3]['id']: 4})
+    assert [(item['id'], item['required'], item['missing'])
+            for item in shortfall] == [(2, 16, 6), (4, 28, 18), (5, 14, 4)]
+    assert shortfall[1]['available'] == 10
+    assert shortfall[1]['cost'] == 18 * decimal.Decimal('9.95') * 4
+    assert shortfall[1]['name'] == 'Name4'
+
+    # The result matches exploding the packs one by one
+    requirements = {}
+    for pack, quantity in [(packs[1], 3), (packs[2], 2)]:
+        for item in db.explode_pack(pack, quantity):
+            requirements[item['id']] = \
+                requirements.get(item['id'], 0) + item['selected']
+    amounts = {item['id']: item['amount'] for item in db.get_all_items()}
+    shortfall = db.need_to_buy({packs[1]['id']: 3, packs[2]['id']: 2})
+    assert {item['id']: item['missing'] for item in shortfall} == \
+        {item_id: required - amounts[item_id]
+         for item_id, required in requirements.items()
+         if required > amounts[item_id]}
+    assert db.need_to_buy({}) == []
+
+    # A quantity below 1 would cancel the requirements of other packs
+    with pytest.raises(ValueError):
+        db.need_to_buy({packs[0]['id']: 2, packs[3]['id']: -4})
+    with pytest.raises(ValueError):
+        db.need_to_buy({packs[0]['id']: 0})
+    with pytest.raises(KeyError):
+        db.need_to_buy({packs[0]['id']: 1, 99: 1})
+
+
+def test_where_used():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+    all_packs = {pack['id']: pack for pack in db.get_all_packs()}
+
+    # Item 4 is included two times in pack 4, which is included
+    # once in pack 2 and three times in pack 3
+    used = db.where_used({'id': 4}, 'item')
+    assert {pack['name']: pack['selected'] for pack in used} == \
+        {'Pack1': 2*2 + 1*6, 'Pack2': 2, 'Pack3': 6, 'Pack4': 2}
+    assert [pack['id'] for pack in used] == sorted(all_packs)
+
+    used = db.where_used(all_packs[packs[3]['id']], 'pack')
+    assert {pack['name']: pack['selected'] for pack in used} == \
+        {'Pack1': 5, 'Pack2': 1, 'Pack3': 3}
+    # any dictionary with the id of a pack can be looked up
+    assert db.where_used(db.get_attributes_pack(packs[3]), 'pack') == used
+    assert db.where_used(all_packs[packs[0]['id']], 'pack') == []
+    assert db.where_used({'id': n_items}, 'item') == []
+    with pytest.raises(ValueError):
+        db.where_used({'id': 1}, 'packs')
+
+    # The quantities match the explosion of every pack
+    for pack in used:
+        exploded = {item['id']: item['selected']
+                    for item in db.explode_pack(pack)}
+        assert {p['id']: p['selected']
+                for p in db.where_used({'id': 5}, 'item')}[pack['id']] == exploded[5]
+
+
+def store_search_items(db):
+    """
+    Helper function storing some items and packs with names and functions
+    to search for.
+    """
+    for name, function in [('Tent', 'Sleeping'),
+                           ('Sleeping bag', 'Sleeping warm'),
+                           ('Stove', 'Cooking food'),
+                           ('Stove_fuel', 'Cooking')]:
+        db.store_new_item(dict(item_attributes_list[0],
+                               name=name, function=function))
+    db.store_new_pack({'name': 'Sleep kit', 'function': 'Night'},
+                      [{'id': 1, 'selected': 1}], [])
+
+
+def test_search():
+    db = dbi.Database(':memory:')
+    store_search_items(db)
+
+    # A match in the name ranks before a match in the function
+    assert [item['name'] for item in db.search_items('sleeping')] == \
+        ['Sleeping bag', 'Tent']
+    # Every word matches the words starting with it
+    assert [item['name'] for item in db.search_items('sle wa')] == \
+        ['Sleeping bag']
+    assert [pack['name'] for pack in db.search_packs('sle')] == ['Sleep kit']
+    found = db.search('sle', limit=2)
+    assert len(found) == 2
+    assert isinstance(found[0], dbi.Pack)
+    assert isinstance(found[1], dbi.Item)
+    assert db.search('"(*') == []
+    assert db.search('stove', limit=0) == []
+
+    # The index follows the changes of the items and packs
+    db.update_item(dict(db.get_all_items()[2], name='Gas cooker'))
+    assert [item['id'] for item in db.search_items('gas')] == [3]
+    assert [item['id'] for item in db.search_items('stove')] == [4]
+    db.delete_item({'id': 4})
+    assert db.search_items('stove') == []
+    db.update_pack({'id': 1, 'name': 'Bivouac', 'function': 'Night'},
+                   [{'id': 1, 'selected': 1}], [])
+    assert db.search_packs('sleep') == []
+    db.delete_pack({'id': 1})
+    assert db.search_packs('bivouac') == []
+
+    # Searches matching many rows are not ranked
+    db.store_new_item(dict(item_attributes_list[0],
+                           name='Tarp', function='Sleeping'))
+    rank_limit = dbi.search_rank_limit
+    dbi.search_rank_limit = 1
+    try:
+        assert [item['name'] for item in db.search_items('sleeping')] == \
+            ['Tent', 'Sleeping bag', 'Tarp']
+    finally:
+        dbi.search_rank_limit = rank_limit
+
+
+def test_search_without_full_text_index():
+    db = dbi.Database(':memory:')
+    store_search_items(db)
+    db._full_text_search = False
+
+    # The names starting with the first word come first
+    assert [item['name'] for item in db.search_items('sleeping')] == \
+        ['Sleeping bag', 'Tent']
+    assert [item['name'] for item in db.search_items('sle wa')] == \
+        ['Sleeping bag']
+    # '_' is not a wildcard
+    assert [item['name'] for item in db.search_items('e_f')] == \
+        ['Stove_fuel']
+    assert [type(row) for row in db.search('sle')] == [dbi.Item, dbi.Pack,
+                                                       dbi.Item]
+
+
+def test_migrate_search_index(tmp_path):
+    db_file = str(tmp_path / 'version2.db')
+    db = dbi.Database(db_file)
+    store_search_items(db)
+    # Remove the index like in a database of version 2
+    with db.conn:
+        for table in ['items', 'packs']:
+            for trigger in ['insert', 'delete', 'update']:
+                db.cursor.execute("""DROP TRIGGER """ + table + """_search_"""
+                                  + trigger)
+            db.cursor.execute("""DROP TABLE """ + table + """_search""")
+        db.cursor.execute("""PRAGMA user_version = 2""")
+    db.conn.close()
+
+    db = dbi.Database(db_file)
+    assert [item['name'] for item in db.search_items('stove')] == \
+        ['Stove', 'Stove_fuel']
+    assert [pack['name'] for pack in db.search_packs('kit')] == ['Sleep kit']
+    with db.conn:
+        db.cursor.execute(""" PRAGMA user_version """)
+        assert db.cursor.fetchone()[0] == dbi.schema_version
+
+    # Errors creating the index other than a missing FTS5 are not hidden
+    with db.conn:
+        db.cursor.execute("""DROP TABLE packs_search""")
+        db.cursor.execute("""CREATE INDEX packs_search ON packs(name)""")
+        db.cursor.execute("""PRAGMA user_version = 2""")
+    db.conn.close()
+    with pytest.raises(sqlite3.OperationalError):
+        dbi.Database(db_file)
+
+
+def test_update_item_impact(tmp_path):
+    db_name = str(tmp_path / 'impact.db')
+    db = dbi.Database(db_name)
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+    before = {pack['id']: db.get_attributes_pack(pack) for pack in packs}
+    new_values = dict(db.get_all_items()[3],
+                      weight=decimal.Decimal('0.125'),
+                      price=decimal.Decimal('20'))
+
+    # Item 4 is included in all packs
+    generation = db.read_cache_info()['generation']
+    impact = db.update_item_impact(new_values, dry_run=True)
+    assert db.read_cache_info()['generation'] == generation
+    assert [pack['id'] for pack in impact] == sorted(before)
+    for pack in impact:
+        assert pack['before'] == {key: before[pack['id']][key]
+                                  for key in ['weight', 'volume', 'price']}
+        assert pack['after']['weight'] == pack['before']['weight'] + \
+            pack['selected'] * (decimal.Decimal('0.125') - 1)
+        assert pack['after']['volume'] == pack['before']['volume']
+    # Nothing was changed
+    assert db.get_all_items()[3]['weight'] == 1
+    assert db.get_attributes_pack(packs[0]) == before[packs[0]['id']]
+
+    # The changed totals match the recalculated ones
+    assert db.update_item_impact(new_values) == impact
+    assert db.get_all_items()[3]['weight'] == decimal.Decimal('0.125')
+    rebuilt_totals = db.rebuild_pack_totals()
+    for pack in impact:
+        assert db.get_attributes_pack(pack)['weight'] == \
+            pack['after']['weight']
+        assert rebuilt_totals[pack['id']]['price'] == pack['after']['price']
+
+    # Changing the amount recalculates the buildable amounts
+    db.update_item_impact(dict(new_values, amount=0))
+    assert db.get_attributes_pack(packs[3])['amount'] == 0
+
+    # Stale totals are recalculated before the change
+    db.update_item(dict(db.get_all_items()[4], weight=3))
+    # Previewing only reads, so also works refusing changes
+    read_db = dbi.Database(db_name, profile='read-only-browse')
+    preview = read_db.preview_item_impact(dict(db.get_all_items()[4],
+                                               weight=2))
+    assert preview[-1]['before']['weight'] == \
+        recursive_attributes_pack(db, packs[0])['weight']
+    read_db.conn.close()
+    impact = db.update_item_impact(dict(db.get_all_items()[4], weight=2))
+    assert impact == preview
+    assert impact[-1]['before']['weight'] == \
+        recursive_attributes_pack(db, packs[0])['weight'] + 5
+    assert db.update_item_impact(dict(db.get_all_items()[9])) == []
+    with pytest.raises(KeyError):
+        db.update_item_impact(dict(new_values, id=n_items + 1))
+
+
+def test_migrate_pack_totals(tmp_path):
+    db_file = str(tmp_path / 'version1.db')
+    db = dbi.Database(db_file)
+    db.store_new_item(item_attributes_list[0])
+    db.store_new_pack({'name': 'Pack', 'function': 'Function'},
+                      [{'id': 1, 'selected': 1}], [])
+    # Replace the table pack_totals with the one of version 1
+    with db.conn:
+        db.cursor.execute("""DROP TABLE pack_totals""")
+        db.cursor.execute("""CREATE TABLE pack_totals(
+                             pack integer PRIMARY KEY,
+                             weight integer,
+                             volume integer,
+                             price integer,
+                             stale integer)""")
+        db.cursor.execute("""INSERT INTO pack_totals VALUES (1, 0, 0, 0, 0)""")
+        db.cursor.execute("""PRAGMA user_version = 1""")
+    db.close()
+
+    db = dbi.Database(db_file)
+    assert db.get_attributes_pack({'id': 1})['amount'] == 0
+    with db.conn:
+        db.cursor.execute("""PRAGMA user_version""")
+        assert db.cursor.fetchone()[0] == dbi.schema_version
 
 
 def test_get_items_in_pack():
@@ -185,8 +867,36 @@ def test_get_items_not_in_pack():
 
 
 def test_update_pack():
-    # TODO: implement this test
-    pass
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    pack = {'name': 'Pack', 'function': 'Function'}
+    included_items = [{'id': i, 'selected': 1} for i in range(1, 51)]
+    assert db.store_new_pack(pack, included_items, None) == 50
+
+    # Writing the same content again does not change any rows
+    assert db.update_pack(pack, included_items, []) == 0
+
+    # Only the changed rows are written
+    included_items[0]['selected'] = 3
+    included_items[1]['selected'] = 0
+    del included_items[2]
+    included_items.append({'id': 51, 'selected': 2})
+    sub_pack = {'name': 'SubPack', 'function': 'Function'}
+    db.store_new_pack(sub_pack, None, None)
+    pack['name'] = 'NewName'
+    assert db.update_pack(pack,
+                          included_items,
+                          [{'id': sub_pack['id'], 'selected': 1}]) == 5
+
+    assert db.get_attributes_pack(pack)['name'] == 'NewName'
+    amounts = {item['id']: item['selected']
+               for item in db.get_items_in_pack(pack)}
+    assert len(amounts) == 49
+    assert amounts[1] == 3
+    assert 2 not in amounts and 3 not in amounts
+    assert amounts[51] == 2
+    assert [p['id'] for p in db.get_packs_in_pack(pack)] == [sub_pack['id']]
 
 
 def test_get_packs_in_pack():
@@ -195,10 +905,488 @@ def test_get_packs_in_pack():
 
 
 def test_leads_to_circular_reference():
-    # TODO: implement this test
-    pass
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+
+    # A pack can never include itself or a pack including it
+    for pack in packs:
+        assert db.leads_to_circular_reference(pack, pack)
+    assert db.leads_to_circular_reference(packs[3], packs[0])
+    assert db.leads_to_circular_reference(packs[3], packs[1])
+    assert db.leads_to_circular_reference(packs[1], packs[0])
+    assert not db.leads_to_circular_reference(packs[0], packs[3])
+    assert not db.leads_to_circular_reference(packs[1], packs[2])
+
+    # Removing pack 4 from pack 2 keeps the path over pack 3
+    db.update_pack(packs[1], [], [])
+    assert db.leads_to_circular_reference(packs[3], packs[0])
+    assert not db.leads_to_circular_reference(packs[3], packs[1])
+
+    # The database refuses to store a circular reference
+    with pytest.raises(ValueError):
+        db.update_pack(packs[3], [], [{'id': packs[0]['id'], 'selected': 1}])
+    assert db.get_packs_in_pack(packs[3]) == []
+
+
+def test_pack_closure():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+
+    # Pack 1 includes pack 4 two times over pack 2 and three times over pack 3
+    with db.conn:
+        db.cursor.execute(""" SELECT descendant, amount FROM pack_closure
+                              WHERE ancestor = ? """, (packs[0]['id'],))
+        closure = dict(db.cursor.fetchall())
+    assert closure == {packs[0]['id']: 1,
+                       packs[1]['id']: 2,
+                       packs[2]['id']: 1,
+                       packs[3]['id']: 5}
+
+    # Test if the closure of an existing database is filled on initialization
+    with db.conn:
+        db.cursor.execute(""" DELETE FROM pack_closure """)
+    db.initialize()
+    with db.conn:
+        db.cursor.execute(""" SELECT descendant, amount FROM pack_closure
+                              WHERE ancestor = ? """, (packs[0]['id'],))
+        assert dict(db.cursor.fetchall()) == closure
+
+    # Deleting a pack removes all paths over it
+    db.delete_pack(packs[2])
+    with db.conn:
+        db.cursor.execute(""" SELECT descendant, amount FROM pack_closure
+                              WHERE ancestor = ? """, (packs[0]['id'],))
+        assert dict(db.cursor.fetchall()) == {packs[0]['id']: 1,
+                                              packs[1]['id']: 2,
+                                              packs[3]['id']: 2}
+
+
+def test_import_items_and_packs():
+    db = dbi.Database(':memory:')
+    item_rows = io.StringIO(
+        'key,name,function,weight,volume,price,amount\n'
+        'T1,Tent,Sleeping,2.35,4,349.90,1\n'
+        'S1,Stove,Eating,0.5,1.25,79,2\n'
+        ',Broken,Nothing,heavy,1,1,1\n'
+        ',Pot,Eating,0.3,1,25,3\n'
+        ',Infinite,Nothing,Infinity,1,1,1\n')
+    report = db.import_items(packlist_utils.read_csv_records(item_rows),
+                             chunk_size=2)
+    assert report['imported'] == 3
+    assert [row_number for row_number, message in report['errors']] == [3, 5]
+    assert report['keys'] == {'T1': 1, 'S1': 2}
+    assert [item['name'] for item in db.get_all_items()] == ['Tent', 'Stove', 'Pot']
+    assert db.get_all_items()[0]['weight'] == decimal.Decimal('2.35')
+
+    pack_rows = io.StringIO(
+        '{"key": "K", "name": "Kitchen", "function": "Eating",'
+        ' "items": "S1=1; Pot=2"}\n'
+        '\n'
+        '{"name": "Camp", "function": "Outdoor",'
+        ' "items": {"T1": 1}, "packs": [{"ref": "K", "amount": 2}]}\n'
+        '{"name": "Unknown", "function": "Nothing", "items": "Lamp"}\n'
+        '{"name": "Trip", "function": "Outdoor", "packs": "Camp"}\n')
+    report = db.import_packs(packlist_utils.read_jsonl_records(pack_rows),
+                             item_keys=report['keys'],
+                             chunk_size=2)
+    assert report['imported'] == 3
+    assert [row_number for row_number, message in report['errors']] == [3]
+    assert report['keys'] == {'K': 1}
+
+    pack_values = db.get_attributes_pack({'id': 3})
+    assert pack_values['name'] == 'Trip'
+    assert pack_values['weight'] == decimal.Decimal('2.35') + \
+        2 * (decimal.Decimal('0.5') + 2 * decimal.Decimal('0.3'))
+
+
+def test_import_skips_unreadable_rows():
+    db = dbi.Database(':memory:')
+    item_rows = io.StringIO(
+        '{"name": "A", "function": "F", "weight": 1, "volume": 1,'
+        ' "price": 1, "amount": 1}\n'
+        '{bad json\n'
+        '{"name": "B", "function": "F", "weight": 1, "volume": 1,'
+        ' "price": 1, "amount": 1}\n')
+    report = db.import_items(packlist_utils.read_jsonl_records(item_rows))
+    assert report['imported'] == 2
+    assert [(row_number, message.split(':')[0])
+            for row_number, message in report['errors']] == \
+        [(2, 'RecordError')]
+    assert [item['name'] for item in db.get_all_items()] == ['A', 'B']
+
+    # references made of digits are ids in csv-files
+    pack_rows = io.StringIO(
+        'name,function,items\n'
+        'First,F,1=2\n'
+        'Broken,F,' + 20 * 'x' + '\n'
+        'Second,F,B\n')
+    field_size_limit = csv.field_size_limit(10)
+    try:
+        report = db.import_packs(packlist_utils.read_csv_records(pack_rows))
+    finally:
+        csv.field_size_limit(field_size_limit)
+    assert report['imported'] == 2
+    assert [row_number for row_number, message in report['errors']] == [2]
+    assert [(item['name'], item['selected'])
+            for item in db.get_items_in_pack({'id': 1})] == [('A', 2)]
+
+
+def test_import_skips_values_sqlite_cannot_store():
+    db = dbi.Database(':memory:')
+    item_rows = io.StringIO(
+        '{"name": "A", "function": "F", "weight": 1, "volume": 1,'
+        ' "price": 1, "amount": 1}\n'
+        '{"name": ["x"], "function": "F", "weight": 1, "volume": 1,'
+        ' "price": 1, "amount": 1}\n'
+        '{"name": "Many", "function": "F", "weight": 1, "volume": 1,'
+        ' "price": 1, "amount": 9223372036854775808}\n'
+        '{"name": "Heavy", "function": "F", "weight": 1e30, "volume": 1,'
+        ' "price": 1, "amount": 1}\n'
+        '{"name": "B", "function": "F", "weight": 1, "volume": 1,'
+        ' "price": 1, "amount": 1}\n')
+    report = db.import_items(packlist_utils.read_jsonl_records(item_rows))
+    assert report['imported'] == 2
+    assert [(row_number, message.split(':')[0])
+            for row_number, message in report['errors']] == \
+        [(2, 'TypeError'), (3, 'ValueError'), (4, 'ValueError')]
+    assert [item['name'] for item in db.get_all_items()] == ['A', 'B']
+
+    pack_rows = io.StringIO(
+        '{"name": "First", "function": "F", "items": "A=2"}\n'
+        '{"name": "Zero", "function": "F", "items": "A=0"}\n'
+        '{"name": "Negative", "function": "F", "items": {"A": -1}}\n'
+        '{"name": "Huge", "function": "F",'
+        ' "items": [{"ref": "A", "amount": 9223372036854775807},'
+        ' {"ref": 1, "amount": 1}]}\n'
+        '{"name": {"x": 1}, "function": "F"}\n'
+        '{"name": "Second", "function": "F", "items": "B"}\n')
+    report = db.import_packs(packlist_utils.read_jsonl_records(pack_rows))
+    assert report['imported'] == 2
+    assert [(row_number, message.split(':')[0])
+            for row_number, message in report['errors']] == \
+        [(2, 'ValueError'), (3, 'ValueError'), (4, 'ValueError'),
+         (5, 'TypeError')]
+    assert [pack['name'] for pack in db.get_all_packs()] == \
+        ['First', 'Second']
+
+
+def test_query_plans_use_indexes():
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+
+    # Record every statement sent to the database
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+    db.get_items_in_pack(packs[0])
+    db.get_items_not_in_pack(packs[0])
+    db.get_packs_in_pack(packs[0])
+    db.get_packs_not_in_pack(packs[0])
+    db.leads_to_circular_reference(packs[0], packs[3])
+    db.where_used({'id': 4}, 'item')
+    db.where_used(db.get_all_packs()[0], 'pack')
+    db.update_item(dict(item_attributes_list[3], id=4))
+    db.get_attributes_pack(packs[0])
+    db.conn.set_trace_callback(None)
+
+    # Only the items and packs may be scanned when listing them,
+    # all the tables linking them must be searched using an index
+    for statement in statements:
+        if not statement.lstrip().startswith(('SELECT', 'UPDATE', 'INSERT',
+                                              'WITH')):
+            continue
+        with db.conn:
+            db.cursor.execute('EXPLAIN QUERY PLAN ' + statement)
+            plan = [row[3] for row in db.cursor.fetchall()]
+        for detail in plan:
+            assert not detail.startswith(('SCAN included_items',
+                                          'SCAN included_packs',
+                                          'SCAN pack_closure',
+                                          'SCAN pack_totals')), \
+                statement + '\n' + '\n'.join(plan)
 
 
 def test_get_packs_not_in_pack():
-    # TODO: implement this test
-    pass
+    db = dbi.Database(':memory:')
+    for i in range(n_items):
+        db.store_new_item(item_attributes_list[i])
+    packs = store_diamond_packs(db)
+    db.store_new_pack({'name': 'Pack5', 'function': 'Function5'}, None, None)
+
+    def not_included_ids(pack):
+        return sorted(p['id'] for p in db.get_packs_not_in_pack(pack))
+
+    # Pack 1 only includes pack 4 indirectly
+    assert not_included_ids(packs[0]) == [packs[3]['id'], 5]
+    # Pack 1 includes pack 2
+    assert not_included_ids(packs[1]) == [packs[2]['id'], 5]
+    # All other packs include pack 4
+    assert not_included_ids(packs[3]) == [5]
+    assert not_included_ids({'id': 5}) == [1, 2, 3, 4]
+    for pack in db.get_packs_not_in_pack(packs[0]):
+        assert pack['selected'] == 0
+
+
+def test_read_cache(tmp_path):
+    db = dbi.Database(':memory:', read_cache_size=2)
+    for i in range(3):
+        db.store_new_item(item_attributes_list[i])
+
+    # A repeated read is answered by the cache
+    items = db.get_all_items()
+    assert db.read_cache_info()['misses'] == 1
+    assert db.get_all_items() == items
+    assert db.read_cache_info()['hits'] == 1
+
+    # Changing a returned item does not change the cached result
+    items[0]['name'] = 'Changed'
+    assert db.get_all_items()[0]['name'] == 'Name1'
+
+    # Writing through the database invalidates the cache
+    generation = db.read_cache_info()['generation']
+    db.update_item(dict(item_attributes_list[0], id=1, name='Updated'))
+    assert db.read_cache_info()['generation'] > generation
+    assert db.read_cache_info()['size'] == 0
+    assert db.get_all_items()[0]['name'] == 'Updated'
+
+    # Only the least recently used results are kept
+    db.get_all_packs()
+    db.get_items_not_in_pack({'id': 1})
+    assert db.read_cache_info()['size'] == 2
+    misses = db.read_cache_info()['misses']
+    db.get_all_items()
+    assert db.read_cache_info()['misses'] == misses + 1
+
+    # Writes of other connections to the same file are detected as well
+    db_file = str(tmp_path / 'cache.db')
+    db = dbi.Database(db_file)
+    other = dbi.Database(db_file)
+    db.store_new_item(item_attributes_list[0])
+    assert len(db.get_all_items()) == 1
+    other.store_new_item(item_attributes_list[1])
+    assert len(db.get_all_items()) == 2
+
+
+def test_transaction():
+    db = dbi.Database(':memory:')
+    db.store_new_item(item_attributes_list[0])
+
+    # Changes made in a transaction are rolled back together
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.store_new_item(item_attributes_list[1])
+            db.delete_item({'id': 1})
+            assert db.get_all_items()[0]['name'] == 'Name2'
+            raise RuntimeError
+    items = db.get_all_items()
+    assert len(items) == 1
+    assert items[0]['name'] == 'Name1'
+
+    with db.transaction():
+        db.store_new_item(item_attributes_list[1])
+        db.store_new_item(item_attributes_list[2])
+    assert len(db.get_all_items()) == 3
+
+
+def test_subscribe():
+    db = dbi.Database(':memory:')
+    for item_values in item_attributes_list[:5]:
+        db.store_new_item(item_values)
+    packs = store_diamond_packs(db)
+    published = []
+    db.subscribe(published.append)
+
+    # a changed item changes the totals of every pack including it
+    db.update_item(dict(item_attributes_list[3], id=4, amount=1))
+    assert set(published.pop()) == \
+        {dbi.Change('items', 4, 'updated')} | \
+        {dbi.Change('packs', pack['id'], 'totals') for pack in packs}
+
+    db.update_pack(packs[1], [{'id': 2, 'selected': 4}], [])
+    assert set(published.pop()) == {
+            dbi.Change('packs', packs[1]['id'], 'updated'),
+            dbi.Change('packs', packs[1]['id'], 'totals'),
+            dbi.Change('packs', packs[0]['id'], 'totals'),
+            dbi.Change('packs', packs[1]['id'], 'contents')}
+
+    # the changes of a transaction are published together after the commit
+    with db.transaction():
+        db.delete_item({'id': 1})
+        db.store_new_item(item_attributes_list[5])
+        assert published == []
+    assert set(published.pop()) == {
+            dbi.Change('packs', packs[0]['id'], 'totals'),
+            dbi.Change('packs', packs[0]['id'], 'contents'),
+            dbi.Change('items', 1, 'deleted'),
+            dbi.Change('items', 6, 'stored')}
+
+    # nothing is published for rolled back changes
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.delete_pack(packs[3])
+            raise RuntimeError
+    db.rebuild_pack_totals()
+    assert published == [[dbi.Change('packs', None, 'totals')]]
+
+    db.unsubscribe(published.append)
+    db.delete_pack(packs[3])
+    assert published == [[dbi.Change('packs', None, 'totals')]]
+
+
+def test_check_other_connections(tmp_path):
+    db_name = str(tmp_path / 'shared.db')
+    db = dbi.Database(db_name)
+    db.store_new_item(item_attributes_list[0])
+    published = []
+    db.subscribe(published.append)
+    assert db.get_all_items()[0]['name'] == item_attributes_list[0]['name']
+    # changes of this connection are not changes of another one
+    assert not db.check_other_connections()
+
+    other = dbi.Database(db_name)
+    other.update_item(dict(item_attributes_list[0], id=1, name='Renamed'))
+    other.close()
+    assert db.check_other_connections()
+    assert published == [[dbi.Change('items', None, 'changed'),
+                          dbi.Change('packs', None, 'changed')]]
+    assert not db.check_other_connections()
+    assert db.get_all_items()[0]['name'] == 'Renamed'
+
+    # a read through the read cache notices the change as well
+    other = dbi.Database(db_name)
+    other.delete_item({'id': 1})
+    other.close()
+    assert db.get_all_items() == []
+    assert len(published) == 2
+
+
+def test_instrumentation():
+    db = dbi.Database(':memory:')
+    assert db.instrumentation is None
+    instrumentation = db.enable_instrumentation()
+    for i in range(3):
+        db.store_new_item(item_attributes_list[i])
+    db.store_new_pack({'name': 'Pack', 'function': 'Function'},
+                      [{'id': 1, 'selected': 2}], [])
+    db.get_all_items()
+    db.get_all_items()
+
+    report = instrumentation.report()
+    methods = {method['method']: method for method in report['methods']}
+    assert methods['store_new_item']['calls'] == 3
+    # the changes include the rows written by triggers (the search index)
+    assert methods['store_new_item']['changes'] >= 3
+    assert methods['store_new_pack']['statements'] > 0
+    # the second call is answered by the read cache
+    assert methods['get_all_items']['calls'] == 2
+    assert methods['get_all_items']['rows'] == 6
+    assert sum(count for bound, count
+               in methods['get_all_items']['histogram']) == 2
+    # the rows of a generator are counted while it is consumed
+    assert methods['iter_items']['calls'] == 1
+    assert methods['iter_items']['rows'] == 3
+    assert methods['iter_items']['statements'] > 0
+    assert [method['total_ms'] for method in report['methods']] == \
+        sorted((method['total_ms'] for method in report['methods']),
+               reverse=True)
+    # statements only differing in their literals are counted together
+    statements = [statement['statement']
+                  for statement in report['statements']]
+    assert len(statements) == len(set(statements))
+    assert not any('Name1' in statement for statement in statements)
+    assert len(instrumentation.report(top=2)['methods']) == 2
+
+    # the time the caller spends between the rows is not measured
+    instrumentation.reset()
+    rows = db.iter_items(page_size=1)
+    next(rows)
+    time.sleep(0.05)
+    assert len(list(rows)) == 2
+    methods = {method['method']: method
+               for method in instrumentation.report()['methods']}
+    assert methods['iter_items']['rows'] == 3
+    assert methods['iter_items']['statements'] >= 3
+    assert methods['iter_items']['total_ms'] < 50
+
+    dumped = io.StringIO()
+    instrumentation.dump(dumped)
+    assert json.loads(dumped.getvalue())['methods'][0]['calls'] > 0
+
+    # nothing is recorded after disabling the instrumentation
+    db.disable_instrumentation()
+    assert 'get_all_items' not in vars(db)
+    instrumentation.reset()
+    db.store_new_item(item_attributes_list[3])
+    assert instrumentation.report() == {'methods': [], 'statements': []}
+
+
+def test_database_pool(tmp_path):
+    with pytest.raises(ValueError):
+        dbi.DatabasePool(':memory:')
+
+    n_readers = 4
+    n_writers = 4
+    n_writes = 25
+    pool = dbi.DatabasePool(str(tmp_path / 'pool.db'), readers=n_readers)
+    with pool.write() as db:
+        db.store_new_pack({'name': 'Pack', 'function': 'Function'},
+                          None, None)
+
+    # All the readers are used at the same time
+    readers_started = threading.Barrier(n_readers, timeout=10)
+    active_writers = []
+    errors = []
+
+    def write():
+        try:
+            for i in range(n_writes):
+                with pool.write() as db:
+                    active_writers.append(1)
+                    assert len(active_writers) == 1
+                    # every write stores an item and adds it to the pack
+                    db.store_new_item(dict(item_attributes_list[0],
+                                           weight=decimal.Decimal('0.5')))
+                    items = db.get_all_items()
+                    for item in items:
+                        item['selected'] = 1
+                    db.update_pack({'id': 1, 'name': 'Pack',
+                                    'function': 'Function'},
+                                   items, [])
+                    active_writers.pop()
+        except Exception as error:
+            errors.append(error)
+
+    def read():
+        try:
+            readers_started.wait()
+            for i in range(n_writes):
+                with pool.read() as db:
+                    # the readers always see complete writes
+                    items = db.get_all_items()
+                    included = db.get_items_in_pack({'id': 1})
+                    assert len(items) == len(included)
+                    with pytest.raises(sqlite3.OperationalError):
+                        db.store_new_item(item_attributes_list[0])
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=write) for i in range(n_writers)]
+    threads += [threading.Thread(target=read) for i in range(n_readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with pool.read() as db:
+        assert len(db.get_all_items()) == n_writers * n_writes
+        assert len(db.get_items_in_pack({'id': 1})) == n_writers * n_writes
+        # the stale totals are calculated without storing them
+        assert db.get_attributes_pack({'id': 1})['weight'] == \
+            n_writers * n_writes * decimal.Decimal('0.5')
+    pool.close()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import http_interface
+import database_interface as dbi
+import http.client
+import json
+import threading
+import pytest
+
+
+@pytest.fixture
+def connection(tmp_path):
+    server = http_interface.Server(str(tmp_path / 'http.db'),
+                                   ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    connection = http.client.HTTPConnection(*server.server_address)
+    yield connection
+    connection.close()
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def request(connection, method, path, body=None):
+    connection.request(method, path,
+                       body=None if body is None else json.dumps(body))
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def item_values(i):
+    return {'name': 'Name' + str(i),
+            'function': 'Function' + str(i),
+            'weight': '0.25',
+            'volume': '1',
+            'price': '2.5',
+            'amount': 1}
+
+
+def test_items_and_packs(connection):
+    # all the requests are sent over the same connection
+    assert request(connection, 'POST', '/items', item_values(1)) == \
+        (201, {'id': 1})
+    assert request(connection, 'POST', '/items', item_values(2)) == \
+        (201, {'id': 2})
+    assert request(connection, 'PUT', '/items/2',
+                   dict(item_values(2), weight='0.5'))[0] == 200
+
+    status, items = request(connection, 'GET', '/items')
+    assert status == 200
+    assert [item['weight'] for item in items] == ['0.25', '0.5']
+
+    pack = {'name': 'Pack', 'function': 'Function',
+            'items': [{'id': 1, 'selected': 2}, {'id': 2, 'selected': 1}]}
+    assert request(connection, 'POST', '/packs', pack) == (201, {'id': 1})
+    pack = {'name': 'Trip', 'function': 'Function',
+            'packs': [{'id': 1, 'selected': 2}]}
+    assert request(connection, 'POST', '/packs', pack) == (201, {'id': 2})
+
+    status, attributes = request(connection, 'GET', '/packs/2')
+    assert status == 200
+    assert attributes['weight'] == '2'
+    status, included = request(connection, 'GET', '/packs/1/items')
+    assert [item['selected'] for item in included] == [2, 1]
+    status, included = request(connection, 'GET', '/packs/2/packs')
+    assert [pack['id'] for pack in included] == [1]
+
+    assert request(connection, 'DELETE', '/items/1')[0] == 200
+    assert request(connection, 'DELETE', '/packs/2')[0] == 200
+    status, packs = request(connection, 'GET', '/packs')
+    assert [pack['name'] for pack in packs] == ['Pack']
+
+    assert request(connection, 'GET', '/packs/5')[0] == 404
+    assert request(connection, 'GET', '/nothing')[0] == 404
+    assert request(connection, 'DELETE', '/items')[0] == 405
+    assert request(connection, 'POST', '/items', {'name': 'Name'})[0] == 400
+    # errors of http.server close the connection
+    assert request(connection, 'PATCH', '/items')[0] == 501
+
+
+def test_batch_endpoints(connection):
+    edits = [{'method': 'store_new_item', 'arguments': [item_values(i)]}
+             for i in range(3)]
+    edits += [{'method': 'store_new_pack',
+               'arguments': [{'name': 'Pack' + str(i), 'function': ''},
+                             [{'id': i + 1, 'selected': 1}], []]}
+              for i in range(3)]
+    assert request(connection, 'POST', '/batch/edits', {'edits': edits}) == \
+        (200, {'applied': 6})
+
+    status, totals = request(connection, 'POST', '/batch/totals',
+                             {'packs': [3, 1]})
+    assert status == 200
+    assert [pack['name'] for pack in totals] == ['Pack2', 'Pack0']
+    assert [pack['price'] for pack in totals] == ['2.5', '2.5']
+
+    # no edit is applied if one of them fails
+    edits = [{'method': 'delete_item', 'arguments': [{'id': 1}]},
+             {'method': 'store_new_item', 'arguments': [{'name': 'Name'}]}]
+    status, error = request(connection, 'POST', '/batch/edits',
+                            {'edits': edits})
+    assert status == 400
+    assert error['error'].startswith('edit 1: KeyError')
+    edits = [{'method': 'initialize', 'arguments': []}]
+    assert request(connection, 'POST', '/batch/edits',
+                   {'edits': edits})[0] == 400
+    assert len(request(connection, 'GET', '/items')[1]) == 3
+
+
+def test_unexpected_error(connection, monkeypatch, capsys):
+    def failing_handler(pool, body):
+        raise RuntimeError('failure')
+
+    monkeypatch.setattr(http_interface, 'routes',
+                        [('GET', r'/failure', failing_handler)] +
+                        http_interface.routes)
+    assert request(connection, 'GET', '/failure') == \
+        (500, {'error': 'internal server error'})
+    assert 'RuntimeError: failure' in capsys.readouterr().err
+    # the connection is still usable
+    assert request(connection, 'GET', '/items') == (200, [])
+
+
+def test_ids_of_new_rows(connection, tmp_path):
+    # after the largest possible id SQLite picks any unused id, so the new
+    # row is not the one with the largest id
+    db = dbi.Database(str(tmp_path / 'http.db'))
+    db.cursor.execute("""INSERT INTO items VALUES
+                         (9223372036854775807, 'Last', '', 0, 0, 0, 0)""")
+    db.conn.commit()
+    db.close()
+
+    status, result = request(connection, 'POST', '/items', item_values(1))
+    assert status == 201
+    status, items = request(connection, 'GET', '/items')
+    assert [item['id'] for item in items if item['name'] == 'Name1'] == \
+        [result['id']]
+
+    status, result = request(connection, 'POST', '/packs',
+                             {'name': 'Pack', 'function': 'Function'})
+    assert (status, result) == (201, {'id': 1})
+
+
+def test_invalid_content_length(connection):
+    connection.putrequest('POST', '/items')
+    connection.putheader('Content-Length', 'many')
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    assert json.loads(response.read()) == \
+        {'error': 'invalid Content-Length: many'}